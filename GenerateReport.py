@@ -1,38 +1,87 @@
 from datetime import datetime
 import collections
+import json
+import logging
+import sys
 import utils
 import IndividualCalendar
+from SimpleEvent import Kind
+REPORT_FORMATS = ('csv', 'ndjson')
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
 def filter_simple_events(simple_events):
     filtered_events = {}
     for event in simple_events:
-        if event.date not in filtered_events:
-            filtered_events[event.date] = [event]
+        if event.day not in filtered_events:
+            filtered_events[event.day] = [event]
         else:
-            filtered_events[event.date].append(event)
-  
-    return collections.OrderedDict(sorted(filtered_events.items()))
+            filtered_events[event.day].append(event)
+
+    # The chunks of a window are retrieved in parallel, so the members of a day are sorted to keep the report stable
+    return collections.OrderedDict((day, sorted(events, key=lambda e: (e.net_id, e.kind))) for day, events in sorted(filtered_events.items()))
 
-def print_table(simple_events):
+def print_table(simple_events, output=None):
     sorted_simple_events = filter_simple_events(simple_events)
     for key in sorted_simple_events:
-        line = f"{key.date()},"
+        line = f"{datetime.fromordinal(key).date()},"
         for count, event in enumerate(sorted_simple_events[key]):
-            event_attributes = event.subject.split(' ')
-            if len(event_attributes) == 2:
-                line = line + event_attributes[0] 
+            if event.kind == Kind.OUT:
+                line = line + event.net_id 
             else:
-                line = line + event_attributes[0] + " " + event_attributes[2]
+                line = line + event.net_id + " " + event.kind.name
 
             if count < len(sorted_simple_events[key]) - 1:
                 line = line + ","
-        print(line)
-            
-def generate_report_for_specified_group(emails, start_date, end_date, access_token):
-    # emails = utils.get_email_list_from_ldap(group_name)
-    calendars = IndividualCalendar.get_individual_calendars(start_date, end_date, emails, access_token)
-    events = IndividualCalendar.process_individual_calendars(calendars, start_date, end_date)
-    print_table(events)
+        print(line, file=output)
+
+def print_ndjson(simple_events, output=None):
+    # One json object per line and per event, so the report can be processed line by line
+    sorted_simple_events = filter_simple_events(simple_events)
+    for key in sorted_simple_events:
+        date = str(datetime.fromordinal(key).date())
+        for event in sorted_simple_events[key]:
+            print(json.dumps({'date': date, 'net_id': event.net_id, 'kind': event.kind.name}), file=output)
+
+def generate_report_for_specified_group(emails, start_date, end_date, access_token, output=None, report_format='csv',
+    fetch_mode='concurrent', max_in_flight=IndividualCalendar.DEFAULT_MAX_IN_FLIGHT, work_day=None):
+    """
+    Writes the OUT events of emails between start_date and end_date to output. The timeframe is split into
+    windows whose chunks of members are retrieved in parallel, and every window is written, in date order,
+    as soon as it and the windows before it are retrieved, so only the windows that are ahead are held in memory
+
+    Args:
+        emails (list): a list of emails of the group members
+        start_date (datetime): the start date of the report
+        end_date (datetime): the end date of the report
+        access_token (str): the token used make calls to the Microsoft
+        Graph API as part of the Oauth2 Authorization code flow
+        output (file): the file the report is written to. Defaults to stdout
+        report_format (str): 'csv' for one line per day or 'ndjson' for one json object per event
+        fetch_mode (str): 'concurrent' or 'batch', see IndividualCalendar.iter_individual_calendars_events
+        max_in_flight (int): the maximum number of getSchedule calls (or batches in batch mode) made at the same time
+        work_day (WorkDay): the work-day settings used to classify the events as AM and PM
+    """
+
+    if report_format not in REPORT_FORMATS:
+        raise ValueError(f"report_format should be one of {REPORT_FORMATS}, not {report_format}")
+    write = print_table if report_format == 'csv' else print_ndjson
 
+    windows = utils.split_into_windows(start_date, end_date)
+    positions = {window: position for position, window in enumerate(windows)}
+    retrieved = {} # position to the SimpleEvents of the windows retrieved ahead of the next one to be written
+    next_position = 0
 
+    for window, events in IndividualCalendar.iter_individual_calendars_events(windows, emails, access_token, fetch_mode=fetch_mode,
+        max_in_flight=max_in_flight, work_day=work_day, max_batches_in_flight=max_in_flight):
+        if events is None:
+            raise ConnectionError(f"Unable to retrieve the individual calendars from {window[0]} to {window[1]}")
+        retrieved[positions[window]] = events
 
-    
\ No newline at end of file
+        while next_position in retrieved:
+            write(retrieved.pop(next_position), output)
+            next_position = next_position + 1
+        # The report is streamed, even when stdout is piped to a file
+        (output or sys.stdout).flush()
+        logger.debug(f"{next_position} of {len(windows)} windows were written")
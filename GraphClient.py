@@ -0,0 +1,350 @@
+import requests
+from requests.adapters import HTTPAdapter
+import json
+import logging
+import threading
+import time
+import uuid
+from urllib.parse import urlsplit
+from Throttle import ThrottleState, is_idempotent, is_retryable, parse_retry_after, get_header
+from JsonStream import iter_response_array
+import Tracing
+
+GRAPH_URL = "https://graph.microsoft.com/v1.0"
+DEFAULT_POOL_CONNECTIONS = 4
+DEFAULT_POOL_MAXSIZE = 10
+DEFAULT_TIMEOUT = 60 # in seconds
+ID_SEGMENTS = ('calendars', 'events', 'subscriptions', 'users') # The segments of a path that are followed by an id
+MISSING_STATUS = 504 # The status of a sub-request the batch response has no sub-response for
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+_graph_client = None
+
+class GraphClient:
+    """
+    A connection-pooled client for the Microsoft Graph API.
+    Every call made through the same GraphClient reuses the keep-alive connections
+    of its session, so the TCP+TLS handshake to graph.microsoft.com is paid once per pooled connection
+    instead of once per call
+
+    Attributes
+    ----------
+    base_url : str
+        The url that relative endpoints (e.g. /me/calendars) are appended to
+    timeout : int
+        The number of seconds to wait on the server before giving up on a request
+    session : requests.Session
+        The session holding the connection pool and the default headers
+    token_provider : function
+        If set, called for the access token of every request instead of using the access token given by the caller
+    throttle : ThrottleState
+        The throttling state shared by every request of the client
+    request_counts : dict
+        (method, endpoint, status) to the number of responses received since the client was created, 
+        where endpoint is the path of the request with its ids replaced by {id}
+    sub_request_counts : dict
+        Same as request_counts, for the sub-responses of batches
+    """
+
+    def __init__(self, base_url=GRAPH_URL, pool_connections=DEFAULT_POOL_CONNECTIONS, pool_maxsize=DEFAULT_POOL_MAXSIZE, timeout=DEFAULT_TIMEOUT, throttle=None):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.token_provider = None
+        self.throttle = throttle if throttle else ThrottleState()
+        self.counts_lock = threading.Lock()
+        self.request_counts = {}
+        self.sub_request_counts = {}
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers.update({
+            'Accept': 'application/json',
+            'Connection': 'keep-alive'
+        })
+
+    @classmethod
+    def from_configs(cls, configs):
+        """
+        Create a GraphClient using the optional graph_* settings of the yaml configuration file
+
+        Args:
+            configs (dict): the configs as a dict
+
+        Returns:
+            GraphClient: a client configured with the pool sizing and timeout of configs
+        """
+
+        return cls(
+            base_url=configs.get('graph_url', GRAPH_URL),
+            pool_connections=configs.get('graph_pool_connections', DEFAULT_POOL_CONNECTIONS),
+            pool_maxsize=configs.get('graph_pool_maxsize', DEFAULT_POOL_MAXSIZE),
+            timeout=configs.get('graph_timeout', DEFAULT_TIMEOUT),
+            throttle=ThrottleState.from_configs(configs)
+        )
+
+    def make_url(self, endpoint):
+        """
+        Prepend the base url to endpoint unless endpoint is already an absolute url (e.g. an @odata.nextLink)
+
+        Args:
+            endpoint (str): the relative or absolute endpoint
+
+        Returns:
+            str: the absolute url of the endpoint
+        """
+
+        if endpoint.startswith("http://") or endpoint.startswith("https://"):
+            return endpoint
+        return self.base_url + endpoint
+
+    def get_endpoint_label(self, endpoint):
+        """
+        Returns the path of endpoint without its query and with its ids replaced by {id}, 
+        e.g. /me/calendars/{id}/events, so requests to the same endpoint are counted together
+        """
+
+        path = urlsplit(endpoint).path
+        if path.startswith(urlsplit(self.base_url).path):
+            path = path[len(urlsplit(self.base_url).path):]
+        segments = path.split('/')
+        for i in range(1, len(segments)):
+            if segments[i - 1] in ID_SEGMENTS and segments[i] not in ('delta', ''):
+                segments[i] = '{id}'
+        return '/'.join(segments)
+
+    def count_response(self, counts, method, endpoint, status):
+        key = (method, self.get_endpoint_label(endpoint), status)
+        with self.counts_lock:
+            counts[key] = counts.get(key, 0) + 1
+
+    def get_request_counts(self):
+        """
+        Returns:
+            dict: copies of request_counts and sub_request_counts under 'requests' and 'sub_requests'
+        """
+
+        with self.counts_lock:
+            return {'requests': dict(self.request_counts), 'sub_requests': dict(self.sub_request_counts)}
+
+    def request(self, method, endpoint, access_token, headers=None, retry=True, idempotent=None, **kwargs):
+        """
+        Send a request to the Microsoft Graph API using the pooled session. 
+        Throttled (429) and unavailable (503) responses are retried after their 
+        Retry-After or a jittered backoff for as long as the throttle budget allows. 
+        Gateway errors (502, 504) are only retried if the request is idempotent
+
+        Args:
+            method (str): the http method (GET, POST, DELETE, ...)
+            endpoint (str): the endpoint relative to base_url or an absolute url
+            access_token (str): the token used make calls to the Microsoft Graph API
+            as part of the Oauth2 Authorization code flow
+            headers (dict): the headers that are added to the default headers of the session
+            retry (bool): whether throttled and unavailable responses are retried
+            idempotent (bool): whether the request can be sent again without side effects. 
+            Defaults to whether method and endpoint are, see Throttle.is_idempotent
+
+        Returns:
+            requests.Response: the response of the request
+        """
+
+        kwargs.setdefault('timeout', self.timeout)
+        if idempotent is None:
+            idempotent = is_idempotent(method, endpoint)
+        attempt = 0
+        with Tracing.span(method + " " + self.get_endpoint_label(endpoint), 'http', streamed=kwargs.get('stream', False)) as span:
+            while True:
+                # Every thread holds off while the Microsoft Graph API is throttling requests
+                self.throttle.wait()
+
+                if self.token_provider:
+                    access_token = self.token_provider()
+
+                # The client-request-id ties the request, and its retries, to its span and to the logs of the Microsoft Graph API
+                header = {
+                    'Authorization': str(access_token),
+                    'client-request-id': span.client_request_id,
+                    'return-client-request-id': 'true'
+                }
+                if headers:
+                    header.update(headers)
+
+                try:
+                    response = self.session.request(method, self.make_url(endpoint), headers=header, **kwargs)
+                except requests.RequestException:
+                    self.count_response(self.request_counts, method, endpoint, 'error')
+                    raise
+                self.count_response(self.request_counts, method, endpoint, response.status_code)
+                span.set(status=response.status_code, attempts=attempt + 1, request_id=response.headers.get('request-id'))
+                if not retry or not is_retryable(response.status_code, idempotent) or attempt >= self.throttle.max_retries:
+                    return response
+
+                delay = self.throttle.get_delay(attempt, parse_retry_after(response.headers.get('Retry-After')))
+                if not self.throttle.record_retry(response.status_code, delay):
+                    logger.warning(f"Not retrying {method} {endpoint} ({response.status_code}) because the throttle budget is spent")
+                    return response
+
+                logger.warning(f"{method} {endpoint} returned {response.status_code}, retrying in {delay:.1f} seconds")
+                # Releases the connection of a streamed response that is not going to be read
+                response.close()
+                attempt = attempt + 1
+
+    def get(self, endpoint, access_token, headers=None, **kwargs):
+        return self.request("GET", endpoint, access_token, headers=headers, **kwargs)
+
+    def post(self, endpoint, access_token, headers=None, **kwargs):
+        return self.request("POST", endpoint, access_token, headers=headers, **kwargs)
+
+    def batch(self, batch_requests, access_token, span_args=None):
+        """
+        Send up to 20 requests in a single call to the Microsoft Graph batch endpoint. 
+        The sub-requests that are throttled or unavailable are retried on their own 
+        after the longest Retry-After of them or a jittered backoff. A sub-request or batch 
+        that failed with a gateway error (502, 504) is only retried if it is idempotent, 
+        e.g. a batch of getSchedule calls but not a batch that adds events. A sub-request 
+        the batch response leaves out is handled as if it failed with a 504
+
+        Args:
+            batch_requests (list): the sub-requests of the batch, each with a unique id
+            access_token (str): the token used make calls to the Microsoft Graph API
+            as part of the Oauth2 Authorization code flow
+            span_args (dict): sub-request id to the attributes of the span of the sub-request, e.g. its window
+
+        Returns:
+            list: the final sub-response of every sub-request, in the order of batch_requests. 
+            If the batch itself can't be sent, the sub-responses carry its status code and error
+        """
+
+        sub_responses = {sub_response['id']: sub_response for sub_response in self.iter_batch(batch_requests, access_token, span_args)}
+        return [sub_responses[request['id']] for request in batch_requests]
+
+    def iter_batch(self, batch_requests, access_token, span_args=None):
+        """
+        Same as batch, but the batch response is decoded incrementally and every final sub-response 
+        is yielded as soon as it is decoded, so only one sub-response is held in memory at a time.
+        Every sub-request carries its own client-request-id and is traced as a span that ends when its sub-response is decoded.
+        A sub-response with an id that isn't pending is logged and ignored
+
+        Args:
+            batch_requests (list): the sub-requests of the batch, each with a unique id
+            access_token (str): the token used make calls to the Microsoft Graph API
+            as part of the Oauth2 Authorization code flow
+            span_args (dict): sub-request id to the attributes of the span of the sub-request, e.g. its window
+
+        Yields:
+            dict: the final sub-response of every sub-request, in the order they are received
+        """
+
+        header = {
+            'Content-type': 'application/json'
+        }
+        
+        requests_by_id = {request['id']: request for request in batch_requests}
+        client_request_ids = {request['id']: str(uuid.uuid4()) for request in batch_requests}
+        span_args = span_args or {}
+        parent = Tracing.get_current_span()
+        pending = batch_requests
+        attempt = 0
+        while pending:
+            sub_requests = [
+                dict(request, headers=dict(request.get('headers') or {}, **{'client-request-id': client_request_ids[request['id']]}))
+                for request in pending
+            ]
+            start = time.time()
+            # The batch is only idempotent if all of its sub-requests are
+            idempotent = all(is_idempotent(request['method'], request['url']) for request in pending)
+            response = self.post("/$batch", access_token, data=json.dumps({"requests": sub_requests}), headers=header, stream=True, idempotent=idempotent)
+            batch_request_id = response.request.headers.get('client-request-id')
+            if response.status_code != 200:
+                logger.warning(f"Unable to post batch of {len(pending)} requests: {response.status_code} (client-request-id: {batch_request_id})")
+                for request in pending:
+                    yield {
+                        'id': request['id'], 
+                        'status': response.status_code, 
+                        'headers': {}, 
+                        'body': {'error': response.text}
+                    }
+                return
+
+            retry_after = None
+            retry_status = None
+            retryable = {}
+            missing = {request['id'] for request in pending}
+            for sub_response in iter_response_array(response, "responses"):
+                if sub_response.get('id') not in missing:
+                    logger.warning(f"Ignoring a sub-response with an unexpected id {sub_response.get('id')} (client-request-id: {batch_request_id})")
+                    continue
+                missing.remove(sub_response['id'])
+                request = requests_by_id[sub_response['id']]
+                self.count_response(self.sub_request_counts, request['method'], request['url'], sub_response['status'])
+                Tracing.record_span(request['method'] + " " + self.get_endpoint_label(request['url']), 'sub_request', start, parent, 
+                    client_request_ids[sub_response['id']], id=sub_response['id'], status=sub_response['status'], attempt=attempt + 1, 
+                    batch_client_request_id=batch_request_id, **span_args.get(sub_response['id'], {}))
+                if not is_retryable(sub_response['status'], is_idempotent(request['method'], request['url'])):
+                    yield sub_response
+                    continue
+                retryable[sub_response['id']] = sub_response
+                retry_status = 429 if retry_status == 429 else sub_response['status']
+                delay = parse_retry_after(get_header(sub_response.get('headers'), 'Retry-After'))
+                if delay is not None:
+                    retry_after = max(retry_after or 0, delay)
+
+            # A sub-request the batch response left out is treated like one that timed out at the gateway
+            for request in pending:
+                if request['id'] not in missing: continue
+                logger.warning(f"The batch response has no sub-response for {request['method']} {request['url']} (client-request-id: {batch_request_id})")
+                sub_response = {
+                    'id': request['id'], 
+                    'status': MISSING_STATUS, 
+                    'headers': {}, 
+                    'body': {'error': {'code': 'MissingSubResponse', 'message': 'The batch response has no sub-response for this request'}}
+                }
+                if not is_retryable(MISSING_STATUS, is_idempotent(request['method'], request['url'])):
+                    yield sub_response
+                    continue
+                retryable[request['id']] = sub_response
+                retry_status = 429 if retry_status == 429 else MISSING_STATUS
+
+            if not retryable: return
+            if attempt >= self.throttle.max_retries:
+                yield from retryable.values()
+                return
+            delay = self.throttle.get_delay(attempt, retry_after)
+            if not self.throttle.record_retry(retry_status, delay):
+                logger.warning(f"Not retrying {len(retryable)} requests of the batch because the throttle budget is spent")
+                yield from retryable.values()
+                return
+
+            logger.warning(f"{len(retryable)} requests of the batch were throttled, retrying them in {delay:.1f} seconds")
+            pending = [request for request in pending if request['id'] in retryable]
+            attempt = attempt + 1
+
+    def close(self):
+        self.session.close()
+
+def get_graph_client():
+    """
+    Retrieves the GraphClient shared by every module, creating it on first use
+
+    Returns:
+        GraphClient: the shared GraphClient
+    """
+
+    global _graph_client
+    if _graph_client is None:
+        import utils
+        _graph_client = GraphClient.from_configs(utils.get_configurations())
+    return _graph_client
+
+def set_graph_client(graph_client):
+    """
+    Replaces the GraphClient shared by every module
+
+    Args:
+        graph_client (GraphClient): the client used by every Graph call from now on
+    """
+
+    global _graph_client
+    _graph_client = graph_client
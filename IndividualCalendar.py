@@ -1,17 +1,25 @@
 from datetime import datetime
 import utils
-import requests
+from GraphClient import get_graph_client
+from JsonStream import iter_response_array
 import logging
-from SimpleEvent import SimpleEvent
+from SimpleEvent import SimpleEvent, WorkDay, Kind
 import json
-import math
-import time
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from itertools import islice
+import Tracing
 EVENT_STATUS = 'oof' # out of office
+GROUPING = 10 # Number of schedules requested per getSchedule call
+DEFAULT_MAX_IN_FLIGHT = 4
+DEFAULT_MAX_BATCHES_IN_FLIGHT = 1
+FETCH_MODES = ('serial', 'concurrent', 'batch')
+MAX_REQUESTS_PER_BATCH = 20
+QUEUED_PER_WORKER = 2 # Number of getSchedule calls queued per thread in concurrent mode
 
 # This logger is a child of the __main__ logger located in OutlookCalendar.py
 logger = logging.getLogger("__main__." + __name__)
 
-def get_individual_calendars(start_date, end_date, group_members, access_token):
+def get_individual_calendars(start_date, end_date, group_members, access_token, stream=False):
     """
     Retrieves a json object of individuals'calendar events 
     that are within/overlap between the start_date and end_date. 
@@ -22,14 +30,15 @@ def get_individual_calendars(start_date, end_date, group_members, access_token):
         end_date (dateime):  the end date of timeframe being updated
         access_token (str): the token used make calls to the Microsoft 
         Graph API as part of the Oauth2 Authorization code flow
+        stream (bool): whether the response is decoded incrementally, one member at a time
     
     Returns:
         json: json object of the events within/overlap between the start and end date 
-        with exception of events that starts on end_date
+        with exception of events that starts on end_date. 
+        If stream is True, an iterator over the members of its 'value' instead
     """
     
     header = {
-        'Authorization': access_token, 
         'Content-Type': "application/json",
         'Prefer': "outlook.timezone=\"Central Standard Time\""
     }
@@ -47,167 +56,333 @@ def get_individual_calendars(start_date, end_date, group_members, access_token):
         "availabilityViewInterval": 1440 # Duration of an event represented in minutes
     }
 
-    endpoint = "https://graph.microsoft.com/v1.0/me/calendar/getSchedule"
-    response = requests.post(endpoint, data=json.dumps(body),headers= header) 
-
-    max_retries = 5
-    retry_count = 0
-    x = 0
-    initial_waiting_time = 30
-    while (response.status_code != 200 and retry_count <= max_retries):
-        logger.warning(f"Retrying to connect to getSchedule endpoint {retry_count} and {(2**x) * initial_waiting_time}")
-        time.sleep((2**x) * initial_waiting_time)
-        response = requests.post(endpoint, data=json.dumps(body),headers=header) 
-        retry_count = retry_count + 1
-        x = x + 1
-
-        '''
-        1 * 30 = 30
-        2 * 30 = 60
-        4 * 30 = 120
-        8 * 30 = 240
-        16 * 30 = 480
-        32 * 30 = 960
-        '''
+    # Throttled and unavailable responses are retried by the GraphClient using their Retry-After
+    endpoint = "/me/calendar/getSchedule"
+    response = get_graph_client().post(endpoint, access_token, data=json.dumps(body), headers=header, stream=stream) 
 
     if response.status_code != 200:
         logger.error(f"status code: {response.status_code}")
         logger.error(f"start date: {start_date}")
         logger.error(f"end date: {end_date}")
         logger.error(f"group members: {group_members}")
-        logger.error(f"access_token: {access_token}")
-        logger.error(f"response header: {response.headers}")
-        logger.error(f"response header type: {type(response.headers)}")
+        # The client-request-id and request-id identify the call in the trace and in the logs of the Microsoft Graph API
+        logger.error(f"client-request-id: {response.request.headers.get('client-request-id')}")
+        logger.error(f"request-id: {response.headers.get('request-id')}")
         message = 'Unable to retrieve individual calendar from the getSchedule endpoint'
         utils.send_email(message, access_token)  
         #logger.error(response.json())
         logger.error(f"response.text: \"{response.text}\"")
         raise ConnectionError(message)
 
+    if stream:
+        return iter_response_array(response, 'value')
     return response.json()
 
 
 
-def get_individual_calendars_using_batch(start_date, end_date, group_members, access_token):
+def retrieve_individual_calendar_events(start_date, end_date, group_members, access_token, work_day=None):
     """
-    Retrieves a json object of individuals'calendar events 
-    that are within/overlap between the start_date and end_date. 
-    Note that events that start on end_date is not included
-    This method uses the Microsoft graph batch endpoint to retrieve 
-    individual calendars with each entry retrieving 10 calendars
+    Retrieves the individual calendars of group_members and processes them into SimpleEvents 
+    while the response is being decoded, so that only one member's schedule is held in memory at a time
 
     Args:
         start_date (datetime): the start date of timeframe being updated
         end_date (datetime):  the end date of timeframe being updated
+        group_members (list): a list of emails of at most GROUPING group members
         access_token (str): the token used make calls to the Microsoft 
         Graph API as part of the Oauth2 Authorization code flow
-    
+        work_day (WorkDay): the work-day settings used to classify the events as AM and PM
+
     Returns:
-        json (list): a list of the bodies of the entry responses of
-        events that are within/overlap between the start and end date 
-        with exception of events that starts on end_date
+        list: the SimpleEvents of group_members
     """
-    
-    endpoint = "/me/calendar/getSchedule"
-    batch = {
-        "requests": []
-    }
-    grouping = 10
-    multiplier = math.floor(len(group_members) / grouping)
-    for i in range(0, multiplier + 1):
-        start = i * grouping
-        end = start + grouping
-        if end > len(group_members):
-            end = len(group_members)
-        
-        request = {
-            "id": str(i + 1),
-            "url": endpoint,
-            "method": "POST", # This could be different for for the delete function
-            "body": {        
-                "schedules": group_members[start:end], # List of the net_ids of each individual listed in the yaml file
-                "startTime": {
-                    "dateTime": datetime.strftime(start_date, "%Y-%m-%dT%H:%M:%S"), 
-                    "timeZone": "Central Standard Time"
-                },
-                "endTime": {
-                    "dateTime": datetime.strftime(end_date, "%Y-%m-%dT%H:%M:%S"),
-                    "timeZone": "Central Standard Time"
-                },
-                "availabilityViewInterval": 1440 # Duration of an event represented in minutes
+
+    with Tracing.span('chunk', 'chunk', start_date=start_date, end_date=end_date, members=[member.split('@')[0] for member in group_members]):
+        schedules = get_individual_calendars(start_date, end_date, group_members, access_token, stream=True)
+        return process_schedules(schedules, start_date, end_date, work_day)
+
+def iter_individual_calendars_events_concurrently(windows, group_members, grouping, access_token, max_in_flight=DEFAULT_MAX_IN_FLIGHT, work_day=None):
+    """
+    Retrieves and processes the individual calendars of every chunk of group_members for every window 
+    by making up to max_in_flight getSchedule calls in parallel. The calls are submitted window by window 
+    and at most QUEUED_PER_WORKER * max_in_flight of them are pending at a time, so only the windows 
+    being retrieved are held in memory
+
+    Args:
+        windows (list): a list of (start_date, end_date) tuples of datetimes
+        group_members (list): a list of emails of the group members
+        grouping (int): the number of group members requested per getSchedule call
+        access_token (str): the token used make calls to the Microsoft 
+        Graph API as part of the Oauth2 Authorization code flow
+        max_in_flight (int): the maximum number of getSchedule calls made at the same time
+        work_day (WorkDay): the work-day settings used to classify the events as AM and PM
+
+    Yields:
+        tuple: a window and the list of SimpleEvents within it, as soon as all of its chunks are retrieved, 
+        or None if any of its getSchedule calls failed
+    """
+
+    chunks = [group_members[i : i + grouping] for i in range(0, len(group_members), grouping)]
+    if not chunks:
+        yield from ((window, []) for window in windows)
+        return
+
+    entries = iter([(window, chunk) for window in windows for chunk in chunks])
+    remaining = {window: len(chunks) for window in windows}
+    events = {}
+
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        futures = {}
+        def submit():
+            for window, chunk in islice(entries, QUEUED_PER_WORKER * max_in_flight - len(futures)):
+                # The chunks are traced as spans of the caller, even though they run in the threads of the executor
+                future = executor.submit(Tracing.bind(retrieve_individual_calendar_events), window[0], window[1], chunk, access_token, work_day)
+                futures[future] = window
+
+        submit()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                window = futures.pop(future)
+                # Any exception raised by get_individual_calendars is re-raised here by future.result()
+                try:
+                    chunk_events = future.result()
+                except ConnectionError:
+                    # A partial window would cause the events of the missing members to be deleted from the shared calendar
+                    events[window] = None
+                else:
+                    if events.get(window, []) is not None:
+                        events.setdefault(window, []).extend(chunk_events)
+                remaining[window] = remaining[window] - 1
+                if remaining[window] == 0:
+                    yield window, events.pop(window, [])
+            submit()
+
+def iter_individual_calendars_events(windows, group_members, access_token, fetch_mode='serial', max_in_flight=DEFAULT_MAX_IN_FLIGHT, grouping=GROUPING, work_day=None, max_batches_in_flight=DEFAULT_MAX_BATCHES_IN_FLIGHT):
+    """
+    Retrieves and processes the individual calendars of group_members for every window, 
+    and yields every window as soon as all of its individual calendars are retrieved. 
+    The windows are not necessarily yielded in order when they are retrieved in parallel.
+    In every fetch_mode, a window whose getSchedule calls did not all succeed is yielded as None 
+    and the other windows are still retrieved, while the errors of the connection itself are raised
+
+    Args:
+        windows (list): a list of (start_date, end_date) tuples of datetimes
+        group_members (list): a list of emails of the group members
+        access_token (str): the token used make calls to the Microsoft 
+        Graph API as part of the Oauth2 Authorization code flow
+        fetch_mode (str): 'serial' to make one getSchedule call after another,
+        'concurrent' to make up to max_in_flight getSchedule calls at the same time or 
+        'batch' to pack up to MAX_REQUESTS_PER_BATCH getSchedule calls into each batch request
+        max_in_flight (int): the maximum number of getSchedule calls made at the same time in concurrent mode
+        grouping (int): the number of group members requested per getSchedule call
+        work_day (WorkDay): the work-day settings used to classify the events as AM and PM
+        max_batches_in_flight (int): the maximum number of batch requests posted at the same time in batch mode
+
+    Yields:
+        tuple: a window and the list of SimpleEvents within it, 
+        or None if its individual calendars could not all be retrieved
+    """
+
+    if fetch_mode not in FETCH_MODES:
+        raise ValueError(f"fetch_mode should be one of {FETCH_MODES}, not {fetch_mode}")
+
+    if work_day is None:
+        work_day = WorkDay.current()
+
+    if fetch_mode == 'batch':
+        yield from iter_individual_calendars_events_using_batch(windows, group_members, access_token, grouping, work_day, max_batches_in_flight)
+        return
+    if fetch_mode == 'concurrent':
+        yield from iter_individual_calendars_events_concurrently(windows, group_members, grouping, access_token, max_in_flight, work_day)
+        return
+
+    for window in windows:
+        events = []
+        with Tracing.span('window', 'window', start_date=window[0], end_date=window[1]):
+            try:
+                for chunk in [group_members[i : i + grouping] for i in range(0, len(group_members), grouping)]:
+                    events.extend(retrieve_individual_calendar_events(window[0], window[1], chunk, access_token, work_day))
+            except ConnectionError:
+                # A partial window would cause the events of the missing members to be deleted from the shared calendar
+                events = None
+        yield window, events
+
+def retrieve_individual_calendars_events(windows, group_members, access_token, fetch_mode='serial', max_in_flight=DEFAULT_MAX_IN_FLIGHT, grouping=GROUPING, work_day=None, max_batches_in_flight=DEFAULT_MAX_BATCHES_IN_FLIGHT):
+    """
+    Retrieves and processes the individual calendars of group_members for every window. 
+    The responses are decoded incrementally and processed as they arrive
+
+    Args:
+        windows (list): a list of (start_date, end_date) tuples of datetimes
+        group_members (list): a list of emails of the group members
+        access_token (str): the token used make calls to the Microsoft 
+        Graph API as part of the Oauth2 Authorization code flow
+        fetch_mode (str): 'serial' to make one getSchedule call after another,
+        'concurrent' to make up to max_in_flight getSchedule calls at the same time or 
+        'batch' to pack up to MAX_REQUESTS_PER_BATCH getSchedule calls into each batch request
+        max_in_flight (int): the maximum number of getSchedule calls made at the same time in concurrent mode
+        grouping (int): the number of group members requested per getSchedule call
+        work_day (WorkDay): the work-day settings used to classify the events as AM and PM
+        max_batches_in_flight (int): the maximum number of batch requests posted at the same time in batch mode
+
+    Returns:
+        dict: (start_date, end_date) window to the list of SimpleEvents within that window.
+        The window maps to None if its individual calendars could not all be retrieved
+    """
+
+    events = {window: [] for window in windows}
+    events.update(iter_individual_calendars_events(windows, group_members, access_token, fetch_mode, max_in_flight, grouping, work_day, max_batches_in_flight))
+    return events
+
+def create_schedule_request(request_id, start_date, end_date, group_members):
+    """
+    Create a getSchedule sub-request using the format indicated by the Microsoft Graph API for batch
+
+    Args:
+        request_id (str): the id of the sub-request within its batch
+        start_date (datetime): the start date of timeframe being updated
+        end_date (datetime):  the end date of timeframe being updated
+        group_members (list): a list of emails of at most GROUPING group members
+
+    Returns:
+        dict: the getSchedule sub-request
+    """
+
+    return {
+        "id": request_id,
+        "url": "/me/calendar/getSchedule",
+        "method": "POST",
+        "body": {        
+            "schedules": group_members, # List of the net_ids of each individual listed in the yaml file
+            "startTime": {
+                "dateTime": datetime.strftime(start_date, "%Y-%m-%dT%H:%M:%S"), 
+                "timeZone": "Central Standard Time"
+            },
+            "endTime": {
+                "dateTime": datetime.strftime(end_date, "%Y-%m-%dT%H:%M:%S"),
+                "timeZone": "Central Standard Time"
             },
-            "headers": {
-                'Authorization': access_token, 
-                'Content-Type': "application/json",
-                'Prefer': "outlook.timezone=\"Central Standard Time\""
-            }
+            "availabilityViewInterval": 1440 # Duration of an event represented in minutes
+        },
+        "headers": {
+            'Content-Type': "application/json",
+            'Prefer': "outlook.timezone=\"Central Standard Time\""
         }
-        batch["requests"].append(request) 
+    }
 
-    endpoint = "https://graph.microsoft.com/v1.0/$batch"
+def retrieve_schedules_using_batch(batch_entries, access_token, work_day):
+    """
+    Posts one batch of getSchedule sub-requests and processes every sub-response as soon as it is decoded. 
+    Sub-requests that are throttled are retried on their own by the GraphClient
 
-    header = {
-        'Accept': 'application/json',
-        'Content-type': 'application/json',
-        "Authorization": access_token
-    }
+    Args:
+        batch_entries (dict): the id of every sub-request to its (window, chunk) tuple
+        access_token (str): the token used make calls to the Microsoft 
+        Graph API as part of the Oauth2 Authorization code flow
+        work_day (WorkDay): the work-day settings used to classify the events as AM and PM
+
+    Returns:
+        dict: the id of every sub-request to the list of SimpleEvents of its chunk within its window, 
+        or None if the sub-request failed
+    """
+
+    batch_requests = [create_schedule_request(id, window[0], window[1], chunk) for id, (window, chunk) in batch_entries.items()]
+    span_args = {id: {'start_date': window[0], 'end_date': window[1], 'members': [member.split('@')[0] for member in chunk]} for id, (window, chunk) in batch_entries.items()}
 
-    response = requests.post(endpoint, data=json.dumps(batch), headers=header)
+    events = {}
+    for individual_response in get_graph_client().iter_batch(batch_requests, access_token, span_args):
+        window, chunk = batch_entries[individual_response['id']]
+        if individual_response['status'] != 200:
+            logger.error(f"Unable to retrieve the individual calendars of {chunk} from {window[0]} to {window[1]}: {individual_response['status']}")
+            logger.error(f"response['body']: \"{individual_response.get('body')}\"")
+            events[individual_response['id']] = None
+            continue
+        events[individual_response['id']] = process_schedules(individual_response['body']['value'], window[0], window[1], work_day)
+    return events
+
+def iter_individual_calendars_events_using_batch(windows, group_members, access_token, grouping=GROUPING, work_day=None, max_batches_in_flight=DEFAULT_MAX_BATCHES_IN_FLIGHT):
+    """
+    Retrieves and processes the individual calendars of every chunk of group_members for every window 
+    using the Microsoft graph batch endpoint. Each (chunk, window) pair is one getSchedule 
+    sub-request and up to MAX_REQUESTS_PER_BATCH sub-requests are packed into each batch. 
+    Up to max_batches_in_flight batches are posted at the same time, and every window 
+    is yielded as soon as the batches of all of its sub-requests are processed
+
+    Args:
+        windows (list): a list of (start_date, end_date) tuples of datetimes
+        group_members (list): a list of emails of the group members
+        access_token (str): the token used make calls to the Microsoft 
+        Graph API as part of the Oauth2 Authorization code flow
+        grouping (int): the number of group members requested per getSchedule sub-request
+        work_day (WorkDay): the work-day settings used to classify the events as AM and PM
+        max_batches_in_flight (int): the maximum number of batch requests posted at the same time
     
-    if response.status_code != 200:
-        message = "Unable to make batch post request"
-        #utils.send_email(user_client, access_token, message)
-        utils.send_email(message, access_token)  
-        logger.error(message)
-        logger.error(f"response.text: {response.text}")
-        #logger.warning(response.json())
-        raise ConnectionError(message)
+    Yields:
+        tuple: a window and the list of SimpleEvents within it, 
+        or None if any of its sub-requests could not be retrieved
+    """
+    
+    chunks = [group_members[i : i + grouping] for i in range(0, len(group_members), grouping)]
+    if not chunks:
+        yield from ((window, []) for window in windows)
+        return
 
-    list_of_responses = []
-    for individual_response in response.json()["responses"]:
-        if individual_response['status'] != 200: 
-            message = 'Unable to retrieve individual calendar from the getSchedule endpoint'
-            utils.send_email(message, access_token)  
-            logger.error(f"individual_response: {individual_response}")
-            logger.error(f"response header: {individual_response['headers']}")
-            logger.error(f"response['body']: \"{individual_response['body']}\"")
-            raise ConnectionError(message)
-        list_of_responses.append(individual_response['body'])
-        
-    return list_of_responses
+    entries = [(window, chunk) for window in windows for chunk in chunks]
+    batches = iter([{str(id + 1): entry for id, entry in enumerate(entries[i : i + MAX_REQUESTS_PER_BATCH])} for i in range(0, len(entries), MAX_REQUESTS_PER_BATCH)])
+    remaining = {window: len(chunks) for window in windows}
+    events = {}
+    failed = False
+
+    with ThreadPoolExecutor(max_workers=max_batches_in_flight) as executor:
+        futures = {}
+        def submit():
+            for batch_entries in islice(batches, max_batches_in_flight - len(futures)):
+                future = executor.submit(Tracing.bind(retrieve_schedules_using_batch), batch_entries, access_token, work_day)
+                futures[future] = batch_entries
+
+        submit()
+        while futures:
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch_entries = futures.pop(future)
+                for id, chunk_events in future.result().items():
+                    window = batch_entries[id][0]
+                    if chunk_events is None:
+                        # A partial window would cause the events of the missing members to be deleted from the shared calendar
+                        events[window] = None
+                        failed = True
+                    elif events.get(window, []) is not None:
+                        events.setdefault(window, []).extend(chunk_events)
+                for window, _ in batch_entries.values():
+                    remaining[window] = remaining[window] - 1
+                    if remaining[window] == 0:
+                        yield window, events.pop(window, [])
+            submit()
+
+    if failed:
+        utils.send_email('Unable to retrieve individual calendar from the getSchedule endpoint', access_token)
 
 def filter(events):
     """
-    Removes duplicates in the list of events 
+    Merges the events of each member on each day into a single event. 
+    The kinds of the events are or'ed together, so OUT AM and OUT PM on the same day become OUT
     
     Args:
         events (SimpleEvent list): contains events extracted from individual calendars
 
     Returns:
-        SimpleEvent list: a filtered list of events
+        SimpleEvent list: a filtered list of events, in the order each (net_id, day) was first seen
     """
 
-    filtered_events = []
-    events.sort()
-    event_to_add = events[0]
-
+    kinds = {}
     for event in events:
-        if event_to_add.net_id == event.net_id and event_to_add.date.date() == event.date.date():
-            event_subject_id = utils.subject_identifier(event.subject)
-            event_to_add_subject_id = utils.subject_identifier(event_to_add.subject)
-            
-            if event_subject_id > event_to_add_subject_id:
-                event_to_add = event
-            elif ("OUT AM" in event.subject and "OUT PM" in event_to_add.subject) or ("OUT PM" in event.subject and "OUT AM" in event_to_add.subject):
-                event_to_add = SimpleEvent.create_all_day_event(event_to_add.net_id, event_to_add.date)
-        else:
-            filtered_events.append(event_to_add)
-            event_to_add = event
-
-    filtered_events.append(event_to_add)
-    return filtered_events
-
-def process_individual_calendars(calendar, start_date, end_date):
+        key = (event.net_id, event.day)
+        kinds[key] = kinds.get(key, 0) | event.kind
+
+    return [SimpleEvent(net_id, day, Kind(kind)) for (net_id, day), kind in kinds.items()]
+
+def process_individual_calendars(calendar, start_date, end_date, work_day=None):
     """
     Creates simple event objects using the the individual calendars 
     retrived from get_individual_calendars
@@ -217,21 +392,45 @@ def process_individual_calendars(calendar, start_date, end_date):
         a specified start and end date for indvidual calendars
         start_date (datetime): the start date of timeframe being updated
         end_date (datetime):  the end date of timeframe being updated
+        work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
         
     Returns: 
         list: A list of SimpleEvent objects
 
     """
 
-    events = []
-    for member in calendar['value']:
-        net_id = member['scheduleId'].split('@')[0]
-        try:
-            for event in member['scheduleItems']:
-                if event['status'] != EVENT_STATUS: continue
-                events_to_add = SimpleEvent.create_event_for_individual_calendars(event, start_date, end_date, net_id)
-                events.extend(events_to_add)
-        except KeyError as e:
-            logger.warning(f"Unable to find: " + net_id)
+    return process_schedules(calendar['value'], start_date, end_date, work_day)
+
+def process_schedules(schedules, start_date, end_date, work_day=None):
+    """
+    Creates simple event objects using the schedules of the members, e.g. the 'value' of a getSchedule response
+
+    Args:
+        schedules (iterable): the schedule of each member. It is only iterated once, so the members 
+        can be decoded one at a time as they are consumed
+        start_date (datetime): the start date of timeframe being updated
+        end_date (datetime):  the end date of timeframe being updated
+        work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
+        
+    Returns: 
+        list: A list of SimpleEvent objects
+    """
+
+    if work_day is None:
+        work_day = WorkDay.current()
+
+    # The intervals are fed to the expansion as each member is decoded, so a member's schedule 
+    # can be dropped as soon as its items are parsed
+    def iter_intervals():
+        for member in schedules:
+            net_id = member['scheduleId'].split('@')[0]
+            try:
+                intervals = SimpleEvent.parse_schedule_items(member['scheduleItems'], EVENT_STATUS)
+            except KeyError as e:
+                logger.warning(f"Unable to find: " + net_id)
+                continue
+            for start, end in intervals:
+                yield (net_id, start, end)
 
+    events = SimpleEvent.create_events_for_intervals(iter_intervals(), start_date, end_date, work_day)
     return filter(events)
@@ -0,0 +1,155 @@
+import codecs
+import json
+import logging
+
+CHUNK_SIZE = 65536 # Number of bytes read from the response at a time
+WHITESPACE = ' \t\n\r'
+NUMBER_CHARACTERS = '.eE+-0123456789'
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+_decoder = json.JSONDecoder()
+
+class _Reader:
+    """
+    A text buffer over an iterable of byte chunks, holding only the part of the document
+    that hasn't been decoded yet
+    """
+
+    def __init__(self, chunks):
+        self.chunks = iter(chunks)
+        self.text_decoder = codecs.getincrementaldecoder('utf-8')()
+        self.buffer = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size=0):
+        """
+        Reads chunks until the buffer holds at least size more characters or the document ends
+
+        Returns:
+            bool: False if the document already ended
+        """
+
+        if self.eof:
+            return False
+        target = len(self.buffer) + max(size, 1)
+        while len(self.buffer) < target:
+            chunk = next(self.chunks, None)
+            if chunk is None:
+                self.buffer = self.buffer + self.text_decoder.decode(b'', final=True)
+                self.eof = True
+                break
+            self.buffer = self.buffer + self.text_decoder.decode(chunk)
+        return True
+
+    def compact(self):
+        # Drops what was already decoded so the buffer doesn't grow with the document
+        if self.pos:
+            self.buffer = self.buffer[self.pos:]
+            self.pos = 0
+
+    def peek(self):
+        """
+        Skips whitespace and returns the next character, or None at the end of the document
+        """
+
+        while True:
+            while self.pos < len(self.buffer) and self.buffer[self.pos] in WHITESPACE:
+                self.pos = self.pos + 1
+            if self.pos < len(self.buffer):
+                return self.buffer[self.pos]
+            self.compact()
+            if not self.fill():
+                return None
+
+    def expect(self, character):
+        if self.peek() != character:
+            raise json.JSONDecodeError(f"Expecting '{character}'", self.buffer, self.pos)
+        self.pos = self.pos + 1
+
+    def decode(self):
+        """
+        Decodes the value at the current position, reading more chunks until the whole value is buffered
+
+        Returns:
+            the decoded value
+        """
+
+        self.peek()
+        self.compact()
+        while True:
+            try:
+                value, end = _decoder.raw_decode(self.buffer, self.pos)
+                # A number at the end of the buffer, or cut right after its '.', 'e' or 'e-', 
+                # is only a prefix of a number that continues in the next chunk
+                is_number = isinstance(value, (int, float)) and not isinstance(value, bool)
+                if self.eof or not (is_number and (end == len(self.buffer) or self.buffer[end] in NUMBER_CHARACTERS)):
+                    self.pos = end
+                    return value
+            except json.JSONDecodeError:
+                if self.eof:
+                    raise
+            # Doubling the buffer keeps the re-decoding of a value that spans many chunks linear
+            self.fill(len(self.buffer))
+
+def iter_json_array(chunks, key):
+    """
+    Incrementally decodes a json object and yields the items of its top-level array under key
+    one at a time, e.g. the members of a getSchedule response under 'value'.
+    Only one item, and the rest of the chunk it arrived in, is held in memory at a time
+
+    Args:
+        chunks (iterable): the bytes of the json document, e.g. response.iter_content()
+        key (str): the key of the array in the top-level object
+
+    Yields:
+        the decoded items of the array
+    """
+
+    reader = _Reader(chunks)
+    reader.expect('{')
+    if reader.peek() == '}':
+        return
+
+    while True:
+        name = reader.decode()
+        reader.expect(':')
+        if name == key and reader.peek() == '[':
+            reader.pos = reader.pos + 1
+            if reader.peek() == ']':
+                reader.pos = reader.pos + 1
+            else:
+                while True:
+                    yield reader.decode()
+                    if reader.peek() == ']':
+                        reader.pos = reader.pos + 1
+                        break
+                    reader.expect(',')
+        else:
+            # The other members of the object (e.g. @odata.context) are small, so they are decoded and dropped
+            reader.decode()
+
+        if reader.peek() == '}':
+            return
+        reader.expect(',')
+
+def iter_response_array(response, key, chunk_size=CHUNK_SIZE):
+    """
+    Yields the items of the top-level array under key of the json body of a response
+    that was requested with stream=True, as they arrive
+
+    Args:
+        response (requests.Response): the streamed response
+        key (str): the key of the array in the top-level object
+        chunk_size (int): the number of bytes read at a time
+
+    Yields:
+        the decoded items of the array
+    """
+
+    try:
+        yield from iter_json_array(response.iter_content(chunk_size), key)
+    finally:
+        response.close()
@@ -0,0 +1,229 @@
+import json
+import os
+import time
+import logging
+from datetime import datetime, timezone
+import ldap3
+from ldap3.utils.conv import escape_filter_chars
+import utils
+
+MEMBERSHIP_INDEX_FILE = 'membership_index.json'
+CLOCK_SKEW = 300 # The number of seconds the clock of the ldap server is allowed to be ahead of the local one
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+class MembershipIndex:
+    """
+    An on-disk index of the ldap groups and their members, kept in vcs_directory.
+    Each group maps to its member uids and nested groups, and each uid maps to its email.
+    Every entry records its modifyTimestamp and when it was last checked, so a refresh only re-reads
+    the members of groups whose modifyTimestamp changed and only re-resolves members that were added
+    or whose entry was modified since the earliest of their checks
+
+    Attributes
+    ----------
+    path : str
+        The path of the json file of the index
+    groups : dict
+        cn to {'modifyTimestamp', 'members', 'subgroups', 'checked'}
+    users : dict
+        uid to {'mail', 'modifyTimestamp', 'checked'}
+
+    Methods
+    -------
+    get_emails
+        Returns the emails of the members of one or more groups, refreshing the index if it is stale
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.groups = {}
+        self.users = {}
+        if os.path.isfile(path):
+            with open(path, 'r') as file:
+                index = json.load(file)
+            self.groups = index.get('groups', {})
+            self.users = index.get('users', {})
+
+    @classmethod
+    def from_configs(cls, configs):
+        return cls(configs['vcs_directory'] + MEMBERSHIP_INDEX_FILE)
+
+    def save(self):
+        # Write to a temporary file first so a crash mid-write can't corrupt the index
+        with open(self.path + '.tmp', 'w') as file:
+            json.dump({'groups': self.groups, 'users': self.users}, file)
+        os.replace(self.path + '.tmp', self.path)
+
+    def get_emails(self, group_names, update_interval):
+        """
+        Returns the emails of the members of group_names, including the members of their nested groups
+
+        Args:
+            group_names (str or list): the name of a group or a list of names of groups
+            update_interval (int): the number of minutes an entry of the index is used for before it is checked again
+
+        Returns:
+            list: the illinois.edu emails of the members, without duplicates
+        """
+
+        if isinstance(group_names, str):
+            group_names = [group_names]
+
+        now = time.time()
+        if (any(self._is_stale(self.groups.get(group_name), now, update_interval) for group_name in group_names)
+            or any(uid not in self.users for uid in self.expand(group_names))):
+            self.refresh(group_names, update_interval)
+
+        emails = []
+        for uid in self.expand(group_names):
+            mail = self.users[uid]['mail']
+            if mail and '@illinois.edu' in mail and mail not in emails:
+                emails.append(mail)
+        logger.debug(f"{len(emails)} emails were found")
+        return emails
+
+    def expand(self, group_names):
+        """
+        Returns the uids of the members of group_names and of their nested groups
+
+        Args:
+            group_names (list): a list of names of groups in the index
+
+        Returns:
+            list: the uids, in the order they were first found
+        """
+
+        uids = {}
+        seen = set()
+        pending = list(group_names)
+        while pending:
+            group_name = pending.pop(0)
+            if group_name in seen or group_name not in self.groups: continue
+            seen.add(group_name)
+            for uid in self.groups[group_name]['members']:
+                uids[uid] = None
+            pending.extend(self.groups[group_name]['subgroups'])
+        return list(uids)
+
+    def refresh(self, group_names, update_interval):
+        """
+        Brings the entries of group_names, their nested groups and their members up to date with the ldap server
+
+        Args:
+            group_names (list): a list of names of groups
+            update_interval (int): the number of minutes a group is used for before it is checked again
+        """
+
+        now = time.time()
+        with utils.open_ldap_connection() as conn:
+            if not conn.bind():
+                raise Exception("Error: Could not bind to LDAP server")
+
+            seen = set()
+            pending = list(group_names)
+            while pending:
+                group_name = pending.pop(0)
+                if group_name in seen: continue
+                seen.add(group_name)
+                self._refresh_group(conn, group_name, now)
+                pending.extend(self.groups[group_name]['subgroups'])
+
+            # The members that are no longer in any group of the index are forgotten
+            members = set(self.expand(list(self.groups)))
+            for uid in [uid for uid in self.users if uid not in members]:
+                del self.users[uid]
+
+            uids = self.expand(group_names)
+            known = [uid for uid in uids if uid in self.users]
+            added = [uid for uid in uids if uid not in self.users]
+
+            # The search of the known members only returns the entries modified since the earliest of their checks, since
+            # the groups are refreshed separately and a member shared with another group may have been checked more recently.
+            # Without a check time, the known members are all resolved again
+            since = self._earliest_check(known)
+            if since:
+                entries = utils.search_uids(conn, known, ['uid', 'mail', 'modifyTimestamp'], modified_since=since)
+                for uid in known:
+                    if uid in entries:
+                        self._set_user(uid, entries[uid], now)
+                    else:
+                        self.users[uid]['checked'] = now
+            else:
+                added = added + known
+
+            if added:
+                logger.debug(f"Resolving {len(added)} members")
+                entries = utils.search_uids(conn, added, ['uid', 'mail', 'modifyTimestamp'])
+                for uid in added:
+                    if uid not in entries:
+                        raise KeyError(f"Error: Could not find member with uid {uid}")
+                    self._set_user(uid, entries[uid], now)
+
+        self.save()
+
+    def _set_user(self, uid, attributes, now):
+        mail = str(self._first(attributes.get('mail')))
+        if '@illinois.edu' not in mail:
+            logger.warning(f"{mail} is not a illinois affiliated email")
+        self.users[uid] = {
+            'mail': mail,
+            'modifyTimestamp': self._timestamp(attributes.get('modifyTimestamp')),
+            'checked': now
+        }
+
+    def _earliest_check(self, uids):
+        """
+        Returns:
+            str: the earliest time uids were checked, minus CLOCK_SKEW, as a generalized time, or None if any of them has none
+        """
+
+        checks = [self.users[uid].get('checked') for uid in uids]
+        if not checks or None in checks:
+            return None
+        return datetime.fromtimestamp(min(checks) - CLOCK_SKEW, timezone.utc).strftime('%Y%m%d%H%M%SZ')
+
+    def _refresh_group(self, conn, group_name, now):
+        search_filter = f"(cn={escape_filter_chars(group_name)})"
+        if not conn.search(utils.LDAP_SEARCH_BASE, search_filter, ldap3.SUBTREE, attributes=['modifyTimestamp']):
+            raise KeyError(f"Error: Could not find group {group_name}")
+        modify_timestamp = self._timestamp(conn.entries[0].entry_attributes_as_dict.get('modifyTimestamp'))
+
+        group = self.groups.get(group_name)
+        if group and modify_timestamp and group['modifyTimestamp'] == modify_timestamp:
+            group['checked'] = now
+            return
+
+        logger.debug(f"Reading the members of {group_name}")
+        conn.search(utils.LDAP_SEARCH_BASE, search_filter, ldap3.SUBTREE, attributes=['uniqueMember'])
+        members = []
+        subgroups = []
+        for dn in conn.entries[0].entry_attributes_as_dict.get('uniqueMember', []):
+            attribute, value = dn.split(',')[0].split('=', 1)
+            if attribute.lower() == 'cn':
+                subgroups.append(value)
+            else:
+                members.append(value)
+
+        self.groups[group_name] = {
+            'modifyTimestamp': modify_timestamp,
+            'members': members,
+            'subgroups': subgroups,
+            'checked': now
+        }
+
+    @staticmethod
+    def _is_stale(entry, now, update_interval):
+        return entry is None or now - entry['checked'] >= update_interval * 60
+
+    @staticmethod
+    def _first(value):
+        if isinstance(value, list):
+            return value[0] if value else None
+        return value
+
+    @staticmethod
+    def _timestamp(value):
+        value = MembershipIndex._first(value)
+        return str(value) if value is not None else None
@@ -0,0 +1,240 @@
+import json
+import os
+import threading
+import time
+import logging
+from contextlib import contextmanager
+
+METRICS_JSON_FILE = 'vcs_metrics.json'
+METRIC_PREFIX = 'vcs_'
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+# The descriptions of the counters in the Prometheus textfile
+COUNTER_HELP = {
+    'events_added': 'Events added to the shared calendars',
+    'events_deleted': 'Events deleted from the shared calendars',
+    'failed_targets': 'Targets whose shared calendar could not be updated',
+    'windows_failed': 'Windows skipped because not every individual calendar was retrieved',
+    'graph_retries': 'Retries of throttled or unavailable requests and batches',
+    'graph_throttled': 'Retries caused by throttled (429) responses',
+    'notifications': 'Change notifications received',
+    'batches': 'Batches of shared calendar changes posted',
+    'batch_requests': 'Shared calendar changes posted in batches'
+}
+
+_metrics = None
+_totals = {} # counter to its total since the program started
+
+class CycleMetrics:
+    """
+    The timings and counters of one cycle. A phase that runs several times in a cycle
+    (e.g. post_batch once per window) adds up its durations
+
+    Attributes
+    ----------
+    started : float
+        The time (seconds since epoch) the cycle started at
+    durations : dict
+        phase to the number of seconds spent in it
+    counters : dict
+        counter (e.g. events_added) to its value
+    gauges : dict
+        gauge (e.g. members) to its last value
+    batch_sizes : list
+        The number of requests of every batch posted to the shared calendars
+    request_counts : dict
+        The GraphClient request counts when the cycle started, so the requests of the cycle can be told apart
+
+    Methods
+    -------
+    phase
+        A context manager timing a phase
+    count
+        Adds to a counter
+    set
+        Sets a gauge
+    """
+
+    def __init__(self, request_counts=None):
+        self.started = time.time()
+        self.start_time = time.perf_counter()
+        self.durations = {}
+        self.counters = {}
+        self.gauges = {}
+        self.batch_sizes = []
+        self.request_counts = request_counts or {'requests': {}, 'sub_requests': {}}
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            with self.lock:
+                self.durations[name] = self.durations.get(name, 0) + elapsed
+
+    def count(self, name, value=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + value
+
+    def set(self, name, value):
+        with self.lock:
+            self.gauges[name] = value
+
+    def observe_batch(self, size):
+        with self.lock:
+            self.batch_sizes.append(size)
+
+    def get_summary(self, request_counts):
+        """
+        Args:
+            request_counts (dict): the current request counts of the GraphClient
+
+        Returns:
+            dict: the summary of the cycle
+        """
+
+        with self.lock:
+            return {
+                'started': self.started,
+                'duration': time.perf_counter() - self.start_time,
+                'phases': dict(self.durations),
+                'counters': dict(self.counters),
+                'gauges': dict(self.gauges),
+                'batches': {
+                    'count': len(self.batch_sizes),
+                    'requests': sum(self.batch_sizes),
+                    'max_size': max(self.batch_sizes, default=0)
+                },
+                'requests': get_difference(request_counts['requests'], self.request_counts['requests']),
+                'sub_requests': get_difference(request_counts['sub_requests'], self.request_counts['sub_requests'])
+            }
+
+def get_difference(counts, previous_counts):
+    """
+    Returns:
+        list: {'method', 'endpoint', 'status', 'count'} of every key of counts that grew since previous_counts
+    """
+
+    difference = []
+    for (method, endpoint, status), count in counts.items():
+        count = count - previous_counts.get((method, endpoint, status), 0)
+        if count:
+            difference.append({'method': method, 'endpoint': endpoint, 'status': status, 'count': count})
+    return difference
+
+def start_cycle(graph_client=None):
+    """
+    Starts the metrics of a new cycle, which get_metrics returns until the next one starts
+
+    Args:
+        graph_client (GraphClient): the client whose requests are counted
+
+    Returns:
+        CycleMetrics: the metrics of the cycle
+    """
+
+    global _metrics
+    _metrics = CycleMetrics(graph_client.get_request_counts() if graph_client else None)
+    return _metrics
+
+def get_metrics():
+    """
+    Retrieves the metrics of the current cycle. Outside of a cycle (e.g. while generating a report),
+    the metrics are collected but never written
+
+    Returns:
+        CycleMetrics: the metrics of the current cycle
+    """
+
+    global _metrics
+    if _metrics is None:
+        _metrics = CycleMetrics()
+    return _metrics
+
+def finish_cycle(configs, graph_client):
+    """
+    Writes the metrics of the current cycle to the json summary in vcs_directory (or metrics_json)
+    and, if metrics_textfile is set, to a Prometheus textfile collector file
+
+    Args:
+        configs (dict): the configs as a dict
+        graph_client (GraphClient): the client whose requests are counted
+
+    Returns:
+        dict: the summary of the cycle
+    """
+
+    metrics = get_metrics()
+    throttle = graph_client.throttle.snapshot()
+    metrics.count('graph_retries', throttle['retry_count'])
+    metrics.count('graph_throttled', throttle['throttled_count'])
+    summary = metrics.get_summary(graph_client.get_request_counts())
+    status = 'failed' if summary['counters'].get('failed_targets') else 'finished'
+    summary['status'] = status
+    for name, value in summary['counters'].items():
+        _totals[name] = _totals.get(name, 0) + value
+    _totals['batches'] = _totals.get('batches', 0) + summary['batches']['count']
+    _totals['batch_requests'] = _totals.get('batch_requests', 0) + summary['batches']['requests']
+
+    logger.info(f"Cycle {status} in {summary['duration']:.1f} seconds: " +
+        ", ".join(f"{phase} {duration:.1f}s" for phase, duration in summary['phases'].items()))
+
+    try:
+        write_file(configs.get('metrics_json', configs['vcs_directory'] + METRICS_JSON_FILE), json.dumps(summary, indent=4))
+        if configs.get('metrics_textfile'):
+            write_file(configs['metrics_textfile'], create_textfile(summary, graph_client.get_request_counts()))
+    except OSError as e:
+        # The metrics are not worth stopping the synchronization for
+        logger.warning(f"Unable to write the metrics: {e}")
+    return summary
+
+def write_file(path, text):
+    # The file is replaced at once, so the textfile collector never reads a half-written file
+    with open(path + '.tmp', 'w') as file:
+        file.write(text)
+    os.replace(path + '.tmp', path)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def create_textfile(summary, request_counts):
+    """
+    Renders the metrics in the Prometheus text exposition format. The requests and the counters
+    are counted since the program started, and the durations and batch sizes are those of the last cycle
+
+    Args:
+        summary (dict): the summary of the last cycle
+        request_counts (dict): the request counts of the GraphClient since the program started
+
+    Returns:
+        str: the content of the textfile
+    """
+
+    lines = []
+    def add(name, kind, help, samples):
+        lines.append(f"# HELP {METRIC_PREFIX}{name} {help}")
+        lines.append(f"# TYPE {METRIC_PREFIX}{name} {kind}")
+        for labels, value in samples:
+            label_text = ",".join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+            lines.append(f"{METRIC_PREFIX}{name}{{{label_text}}} {value}" if label_text else f"{METRIC_PREFIX}{name} {value}")
+
+    add('cycle_last_finished_timestamp_seconds', 'gauge', 'Time the last cycle finished at', [({}, round(summary['started'] + summary['duration'], 3))])
+    add('cycle_duration_seconds', 'gauge', 'Duration of the last cycle', [({}, round(summary['duration'], 6))])
+    add('cycle_success', 'gauge', 'Whether the last cycle updated every target', [({}, int(summary['status'] == 'finished'))])
+    add('cycle_phase_duration_seconds', 'gauge', 'Time the last cycle spent in each phase',
+        [({'phase': phase}, round(duration, 6)) for phase, duration in sorted(summary['phases'].items())])
+    add('cycle_batch_max_size', 'gauge', 'Largest batch of shared calendar changes of the last cycle', [({}, summary['batches']['max_size'])])
+    for name, value in sorted(summary['gauges'].items()):
+        add('cycle_' + name, 'gauge', f"Number of {name.replace('_', ' ')} of the last cycle", [({}, value)])
+    for name, value in sorted(_totals.items()):
+        add(name + '_total', 'counter', COUNTER_HELP.get(name, name.replace('_', ' ').capitalize()) + ' since the program started', [({}, value)])
+    for name, help in (('graph_requests_total', 'Requests made to the Microsoft Graph API'), ('graph_batch_sub_requests_total', 'Sub-responses of the Microsoft Graph batch endpoint')):
+        counts = request_counts['requests' if name == 'graph_requests_total' else 'sub_requests']
+        add(name, 'counter', help + ' since the program started',
+            [({'method': method, 'endpoint': endpoint, 'status': status}, count) for (method, endpoint, status), count in sorted(counts.items(), key=str)])
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,430 @@
+import json
+import queue
+import secrets
+import threading
+import time
+import logging
+from datetime import datetime, timedelta, timezone
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from GraphClient import get_graph_client
+from SimpleEvent import SimpleEvent
+
+DEFAULT_HOST = '0.0.0.0'
+DEFAULT_PORT = 8000
+SUBSCRIPTION_LIFETIME = 4230 # in minutes (about 2.9 days), the longest lifetime the Microsoft Graph API allows for subscriptions to Outlook events
+RENEWAL_MARGIN = 6 * 3600 # Number of seconds before the expiry of a subscription that it is renewed
+DEFAULT_DEBOUNCE = 5 # Number of seconds notifications are gathered for before they are processed
+RETRY_DELAY = 3600 # Number of seconds before a refused subscription is requested again, doubled after every refusal
+MAX_RETRY_DELAY = 24 * 3600 # in seconds
+CLIENT_STATE_KEY = 'notifications:client_state'
+SUBSCRIPTIONS_KEY = 'notifications:subscriptions'
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+class NotificationReceiver:
+    """
+    A small HTTP server receiving the change notifications of the Microsoft Graph API subscriptions.
+    It answers the validation request sent when a subscription is created, and queues every notification
+    whose clientState matches so that they can be processed outside of the request
+
+    Attributes
+    ----------
+    client_state : str
+        The secret sent with every subscription that a notification has to carry
+    notifications : queue.Queue
+        The notifications that were received and not processed yet
+    server : ThreadingHTTPServer
+        The HTTP server
+    """
+
+    def __init__(self, client_state, host=DEFAULT_HOST, port=DEFAULT_PORT):
+        self.client_state = client_state
+        self.notifications = queue.Queue()
+        self.server = ThreadingHTTPServer((host, port), self._create_handler())
+        self.thread = None
+
+    @classmethod
+    def from_configs(cls, configs, client_state):
+        return cls(client_state, configs.get('notification_host', DEFAULT_HOST), configs.get('notification_port', DEFAULT_PORT))
+
+    @property
+    def port(self):
+        return self.server.server_address[1]
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        logger.info(f"Listening for change notifications on port {self.port}")
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def get_notifications(self, timeout, debounce=DEFAULT_DEBOUNCE):
+        """
+        Waits up to timeout seconds for a notification, then keeps gathering the notifications
+        that arrive within debounce seconds, so that a burst of changes is processed together
+
+        Args:
+            timeout (float): the maximum number of seconds to wait for the first notification
+            debounce (float): the number of seconds to keep gathering notifications for
+
+        Returns:
+            list: the notifications, empty if none arrived within timeout
+        """
+
+        try:
+            notifications = [self.notifications.get(timeout=max(timeout, 0))]
+        except queue.Empty:
+            return []
+
+        deadline = time.time() + debounce
+        while True:
+            try:
+                notifications.append(self.notifications.get(timeout=max(deadline - time.time(), 0)))
+            except queue.Empty:
+                return notifications
+
+    def _create_handler(self):
+        receiver = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, format, *args):
+                logger.debug(format % args)
+
+            def _respond(self, status_code, text=None):
+                body = text.encode() if text else b''
+                self.send_response(status_code)
+                self.send_header('Content-Type', 'text/plain')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def do_POST(self):
+                # The Microsoft Graph API validates the notification url by expecting its validationToken back
+                query = parse_qs(urlparse(self.path).query)
+                if 'validationToken' in query:
+                    self._respond(200, query['validationToken'][0])
+                    return
+
+                try:
+                    body = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))))
+                except ValueError:
+                    self._respond(400)
+                    return
+
+                for notification in body.get('value', []):
+                    if notification.get('clientState') != receiver.client_state:
+                        logger.warning(f"Ignoring a notification of subscription {notification.get('subscriptionId')} with the wrong clientState")
+                        continue
+                    receiver.notifications.put(notification)
+
+                # Notifications have to be acknowledged quickly, so they are only processed after responding
+                self._respond(202)
+
+        return Handler
+
+class SubscriptionManager:
+    """
+    Creates, renews and deletes the Microsoft Graph API subscriptions to the events of the members'
+    calendars and of the shared calendars. The subscriptions are kept in the state store so that
+    they are reused after a restart
+
+    Attributes
+    ----------
+    notification_url : str
+        The public url of the NotificationReceiver
+    client_state : str
+        The secret sent with every subscription
+    state_store : StateStore
+        The store keeping the subscriptions
+    subscriptions : dict
+        resource to {'id', 'expiration', 'email', 'calendar_id'}
+    refused : dict
+        resource to {'count', 'retry_at'} of the resources whose subscription could not be created, 
+        so they aren't requested again on every wakeup
+    """
+
+    def __init__(self, notification_url, client_state, state_store, lifetime=SUBSCRIPTION_LIFETIME, renewal_margin=RENEWAL_MARGIN):
+        self.notification_url = notification_url
+        self.client_state = client_state
+        self.state_store = state_store
+        self.lifetime = lifetime
+        self.renewal_margin = renewal_margin
+        self.subscriptions = state_store.get_meta(SUBSCRIPTIONS_KEY, {})
+        self.refused = {}
+
+    @classmethod
+    def from_configs(cls, configs, state_store):
+        return cls(configs['notification_url'], get_client_state(configs, state_store), state_store)
+
+    @staticmethod
+    def get_resources(targets, shared_calendar_ids):
+        """
+        Returns the resources to subscribe to: the events of every member and of every shared calendar
+
+        Args:
+            targets (list): a list of (target, group_members) tuples
+            shared_calendar_ids (list): the ids of the shared calendars of the targets
+
+        Returns:
+            dict: resource to what it belongs to, {'email': ...} or {'calendar_id': ...}
+        """
+
+        resources = {}
+        for _, group_members in targets:
+            for email in group_members:
+                resources[f"/users/{email}/events"] = {'email': email}
+        for calendar_id in shared_calendar_ids:
+            resources[f"/me/calendars/{calendar_id}/events"] = {'calendar_id': calendar_id}
+        return resources
+
+    def get_unsubscribed_members(self, targets, now=None):
+        """
+        Returns the members of targets without a live subscription to their calendar, e.g. because it was refused
+
+        Args:
+            targets (list): a list of (target, group_members) tuples
+
+        Returns:
+            list: the emails of the members, without duplicates
+        """
+
+        now = time.time() if now is None else now
+        members = []
+        for _, group_members in targets:
+            for email in group_members:
+                subscription = self.subscriptions.get(f"/users/{email}/events")
+                if (subscription is None or subscription['expiration'] <= now) and email not in members:
+                    members.append(email)
+        return members
+
+    def get_subscription(self, subscription_id):
+        """
+        Returns:
+            dict: the subscription with subscription_id, or None if it isn't one of ours
+        """
+
+        for subscription in self.subscriptions.values():
+            if subscription['id'] == subscription_id:
+                return subscription
+        return None
+
+    def ensure(self, resources, access_token):
+        """
+        Creates the missing subscriptions, renews the ones about to expire and deletes the ones
+        to resources that are not subscribed to anymore. A resource whose subscription was refused 
+        is only requested again after a delay that doubles with every refusal
+
+        Args:
+            resources (dict): resource to what it belongs to, see get_resources
+            access_token (str): the token used make calls to the Microsoft Graph API
+            as part of the Oauth2 Authorization code flow
+        """
+
+        changed = False
+        for resource in list(self.subscriptions):
+            if resource not in resources:
+                self._delete(self.subscriptions.pop(resource), access_token)
+                changed = True
+
+        for resource in list(self.refused):
+            if resource not in resources:
+                del self.refused[resource]
+
+        now = time.time()
+        for resource, owner in resources.items():
+            subscription = self.subscriptions.get(resource)
+            if subscription and subscription['expiration'] - now > self.renewal_margin: continue
+            if subscription is None and resource in self.refused and self.refused[resource]['retry_at'] > now: continue
+
+            if subscription is None or not self._renew(subscription, access_token):
+                subscription = self._create(resource, access_token)
+                if subscription is None:
+                    if self.subscriptions.pop(resource, None) is not None:
+                        changed = True
+                    self._refuse(resource, now)
+                    continue
+            self.refused.pop(resource, None)
+            subscription.update(owner)
+            self.subscriptions[resource] = subscription
+            changed = True
+
+        if changed:
+            self.state_store.set_meta(SUBSCRIPTIONS_KEY, self.subscriptions)
+
+    def _refuse(self, resource, now):
+        count = self.refused.get(resource, {'count': 0})['count'] + 1
+        delay = min(RETRY_DELAY * 2 ** (count - 1), MAX_RETRY_DELAY)
+        self.refused[resource] = {'count': count, 'retry_at': now + delay}
+        # Until then, the resource is only kept in sync by polling it
+        logger.warning(f"Not subscribing to {resource} again for {delay / 3600:.0f} hours")
+
+    def _expiration(self):
+        expiration = datetime.now(timezone.utc) + timedelta(minutes=self.lifetime)
+        return expiration, expiration.strftime("%Y-%m-%dT%H:%M:%SZ")
+
+    def _create(self, resource, access_token):
+        expiration, expiration_date_time = self._expiration()
+        body = {
+            "changeType": "created,updated,deleted",
+            "notificationUrl": self.notification_url,
+            "resource": resource,
+            "expirationDateTime": expiration_date_time,
+            "clientState": self.client_state
+        }
+        response = get_graph_client().post("/subscriptions", access_token, data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        if response.status_code != 201:
+            logger.error(f"Unable to subscribe to {resource}: {response.status_code}")
+            logger.error(f"response.text: {response.text}")
+            return None
+        logger.debug(f"Subscribed to {resource}")
+        return {'id': response.json()['id'], 'expiration': expiration.timestamp()}
+
+    def _renew(self, subscription, access_token):
+        expiration, expiration_date_time = self._expiration()
+        body = {
+            "expirationDateTime": expiration_date_time
+        }
+        response = get_graph_client().request("PATCH", "/subscriptions/" + subscription['id'], access_token, data=json.dumps(body), headers={'Content-Type': 'application/json'})
+        if response.status_code != 200:
+            # The subscription is recreated if it expired or was removed
+            logger.warning(f"Unable to renew subscription {subscription['id']}: {response.status_code}")
+            return False
+        subscription['expiration'] = expiration.timestamp()
+        return True
+
+    def _delete(self, subscription, access_token):
+        response = get_graph_client().request("DELETE", "/subscriptions/" + subscription['id'], access_token)
+        if response.status_code not in (204, 404):
+            logger.warning(f"Unable to delete subscription {subscription['id']}: {response.status_code}")
+
+def get_client_state(configs, state_store):
+    """
+    Returns the clientState of the subscriptions: notification_client_state of the configs,
+    or a secret generated once and kept in the state store
+    """
+
+    if configs.get('notification_client_state'):
+        return configs['notification_client_state']
+    client_state = state_store.get_meta(CLIENT_STATE_KEY)
+    if client_state is None:
+        client_state = secrets.token_urlsafe(32)
+        state_store.set_meta(CLIENT_STATE_KEY, client_state)
+    return client_state
+
+def get_affected_ranges(notifications, subscription_manager, horizon, access_token, state_store):
+    """
+    Works out which member and which days have to be re-synchronized for each notification.
+    A change to a member's calendar affects the days of the changed event, and the days the member
+    was last known to be absent on if the event was updated, since it may have been moved from them. 
+    It affects the whole horizon if the event was deleted. A change to a shared calendar affects the member and the day of
+    the changed event, unless the change was made by the program itself
+
+    Args:
+        notifications (list): the notifications from the NotificationReceiver
+        subscription_manager (SubscriptionManager): the manager of the subscriptions the notifications are for
+        horizon (tuple): the (start_date, end_date) kept in sync
+        access_token (str): the token used make calls to the Microsoft Graph API
+        as part of the Oauth2 Authorization code flow
+        state_store (StateStore): the store keeping the mirror of the shared calendars and the member absences
+
+    Returns:
+        dict: net_id to the (start_date, end_date) to re-synchronize for that member
+    """
+
+    ranges = {}
+    for notification in notifications:
+        subscription = subscription_manager.get_subscription(notification.get('subscriptionId'))
+        if subscription is None:
+            logger.warning(f"Ignoring a notification of unknown subscription {notification.get('subscriptionId')}")
+            continue
+
+        if 'email' in subscription:
+            affected = get_member_range(notification, subscription['email'], horizon, access_token, state_store)
+        else:
+            affected = get_shared_calendar_range(notification, horizon, access_token, state_store)
+        if affected is None: continue
+
+        net_id, start_date, end_date = affected
+        start_date = max(start_date, horizon[0])
+        end_date = min(end_date, horizon[1])
+        if start_date >= end_date: continue
+        if net_id in ranges:
+            start_date = min(start_date, ranges[net_id][0])
+            end_date = max(end_date, ranges[net_id][1])
+        ranges[net_id] = (start_date, end_date)
+
+    return ranges
+
+def get_event_range(event):
+    # The days from the start of the event until the end of the event, as midnights
+    start = SimpleEvent.make_datetime(event['start']['dateTime'])
+    start_date = start.replace(hour=0, minute=0, second=0, microsecond=0)
+    if 'end' not in event:
+        return start_date, start_date + timedelta(days=1)
+
+    end = SimpleEvent.make_datetime(event['end']['dateTime'])
+    end_date = end.replace(hour=0, minute=0, second=0, microsecond=0)
+    if end_date < end or end_date == start_date:
+        end_date = end_date + timedelta(days=1)
+    return start_date, end_date
+
+def get_event(resource, access_token):
+    """
+    Retrieves the start, end and subject of the event a notification is about
+
+    Returns:
+        dict: the event, or None if it can't be retrieved (e.g. it was deleted)
+    """
+
+    header = {
+        'Prefer': "outlook.timezone=\"Central Standard Time\""
+    }
+    response = get_graph_client().get("/" + resource.lstrip('/') + "?$select=subject,start,end,showAs", access_token, headers=header)
+    if response.status_code != 200:
+        logger.debug(f"Unable to retrieve {resource}: {response.status_code}")
+        return None
+    return response.json()
+
+def get_member_range(notification, email, horizon, access_token, state_store):
+    net_id = email.split('@')[0]
+    event = None
+    if notification.get('changeType') != 'deleted':
+        event = get_event(notification['resource'], access_token)
+    if event is None:
+        # The days a deleted event was on aren't known anymore
+        return (net_id, horizon[0], horizon[1])
+
+    start_date, end_date = get_event_range(event)
+    if notification.get('changeType') == 'updated':
+        # The days the event was on before it was moved are among the absences of the previous retrieval
+        dates = state_store.get_member_absence_dates(net_id, horizon[0], horizon[1])
+        if dates:
+            start_date = min(start_date, dates[0])
+            end_date = max(end_date, dates[-1] + timedelta(days=1))
+    return (net_id, start_date, end_date)
+
+def get_shared_calendar_range(notification, horizon, access_token, state_store):
+    event_id = (notification.get('resourceData') or {}).get('id')
+    mirrored = state_store.get_shared_event(event_id) if event_id else None
+
+    if notification.get('changeType') == 'deleted':
+        # A deleted event can't be retrieved anymore, but the mirror keeps its date. 
+        # The events deleted by the program were already removed from the mirror
+        event = mirrored
+    elif notification.get('changeType') == 'created' and mirrored is not None:
+        # The event was created by the program, which mirrors the events it adds, so it isn't retrieved
+        return None
+    else:
+        event = get_event(notification['resource'], access_token)
+        if event is not None and mirrored is not None and mirrored['subject'] == event.get('subject') \
+            and mirrored['start']['dateTime'][:19] == event['start']['dateTime'][:19]:
+            # The event was created by the program
+            return None
+
+    if event is None or not event.get('subject'):
+        return None
+    return (event['subject'].split(' ')[0], *get_event_range(event))
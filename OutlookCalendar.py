@@ -2,16 +2,24 @@
 import SharedCalendar 
 import argparse
 from datetime import datetime
-from SimpleEvent import SimpleEvent
+from SimpleEvent import SimpleEvent, WorkDay
 from os import path
 from datetime import timedelta 
 import time
 import logging
 from logging import handlers
 import utils
-from msal import PublicClientApplication
+from TokenManager import TokenManager
 import IndividualCalendar
 import GenerateReport
+from GraphClient import GraphClient, set_graph_client, get_graph_client
+from StateStore import StateStore
+from MembershipIndex import MembershipIndex
+from Scheduler import Scheduler, Tier
+import Notifications
+from Notifications import NotificationReceiver, SubscriptionManager
+import Metrics
+import Tracing
         
 def process_args():
         parser = argparse.ArgumentParser(
@@ -30,6 +38,11 @@ Program is controlled using the following environment variables:
         parser.add_argument('-d', '--dump_json', action='store_true', help='Dump table data to console as json')
         parser.add_argument('-g', '--generate_report', action='store', nargs=3, help="Generate a report to console of members OUT events: "+
                             "<group_name> <start_date> <end_date> with format YYYY-MM-DD")
+        parser.add_argument('-f', '--report_format', action='store', choices=GenerateReport.REPORT_FORMATS, default='csv', 
+                            help="Format of the report: csv (one line per day, default) or ndjson (one json object per event)")
+        parser.add_argument('-o', '--report_output', action='store', help="File the report is written to instead of the console")
+        parser.add_argument('-p', '--push', action='store_true', help='Update shared calendar whenever a member\'s calendar changes, '+
+                            'using Microsoft Graph change notifications')
         parser.add_argument('-m', '--manual_update', action='store', nargs=2, help="Manually update the shared calendar with start and end time "+
                             "with format YYYY-MM-DD")
         
@@ -53,87 +66,373 @@ def sanitize_input(start_date, end_date):
     
     return (start_date, end_date)
 
-def retrieve_and_update_calendars(current_date, end_date, group_members, grouping, access_token):
-    logger.debug(f"{current_date} to {end_date}")
-    individual_calendars_events = []
-    
-    # Create a list of lists in chunks of size grouping
-    for group in [group_members[i : i + grouping] for i in range(0, len(group_members), grouping)]:
-        individual_calendars = IndividualCalendar.get_individual_calendars(current_date, end_date, group, access_token)
-        individual_calendars_events.extend(IndividualCalendar.process_individual_calendars(individual_calendars, current_date, end_date))
-        
-    # Retrieve the shared calendar and process it 
-    shared_calendar_id = SharedCalendar.get_shared_calendar_id(configs['shared_calendar_name'], access_token)
-    shared_calendar = SharedCalendar.get_shared_calendar(shared_calendar_id, current_date, end_date, access_token)
-    shared_calendar_events, event_ids = SharedCalendar.process_shared_calendar(shared_calendar, group_members)
-    SharedCalendar.update_shared_calendar(individual_calendars_events, shared_calendar_events, event_ids, shared_calendar_id, configs['category_name'], configs['category_color'], access_token)
+TARGET_KEYS = ('group_name', 'shared_calendar_name', 'category_name', 'category_color')
+DEFAULT_PUSH_POLL_INTERVAL = 6 * 3600 # in seconds
+
+def get_targets(configs):
+    """
+    Returns the (group, shared calendar, category) targets to synchronize. Every entry of the optional 
+    targets list of the configs is a target, and the keys an entry leaves out are taken from the top level 
+    of the configs. Without a targets list, the top level of the configs is the only target
+
+    Args:
+        configs (dict): the configs as a dict
+
+    Returns:
+        list: a list of dicts with the keys of TARGET_KEYS
+    """
+
+    targets = []
+    for entry in configs.get('targets') or [{}]:
+        target = {}
+        for key in TARGET_KEYS:
+            target[key] = entry.get(key, configs.get(key))
+            if target[key] is None:
+                raise KeyError(f"{key} is missing from the target {entry}")
+        targets.append(target)
+    return targets
+
+def retrieve_and_update_calendars(configs, start_date, end_date, targets, access_token, state_store, sync_range=None, targeted=False):
+    """
+    Retrieves the individual calendars of the members of every target once and 
+    updates the shared calendar of every target with the events of its members
+
+    Args:
+        configs (dict): the configs as a dict
+        start_date (datetime): the start date of timeframe being updated
+        end_date (datetime): the end date of timeframe being updated
+        targets (list): a list of (target, group_members) tuples, where target is one of get_targets
+        access_token (str): the token used make calls to the Microsoft Graph API
+        state_store (StateStore): the state kept between cycles
+        sync_range (tuple): the whole (start_date, end_date) kept in sync, when start_date to end_date is only a part of it
+        targeted (bool): whether targets only hold some of the members of their groups, e.g. the members whose calendar changed
+    """
+
+    logger.debug(f"{start_date} to {end_date}")
+    with Tracing.span('cycle', 'cycle', start_date=start_date, end_date=end_date, targets=[target['shared_calendar_name'] for target, _ in targets]):
+        metrics = Metrics.get_metrics()
+        cycle_id = state_store.start_cycle(start_date, end_date)
+
+        # A member of several targets is only retrieved once
+        all_members = list(dict.fromkeys(member for _, group_members in targets for member in group_members))
+        logger.debug(f"{len(all_members)} unique members in {len(targets)} targets")
+
+        # Retrieve the individual calendars of every window and process them
+        windows = utils.split_into_windows(start_date, end_date)
+        with metrics.phase('get_schedule'):
+            events_per_window = IndividualCalendar.retrieve_individual_calendars_events(
+                windows, 
+                all_members, 
+                access_token, 
+                fetch_mode=configs.get('fetch_mode', 'serial'), 
+                max_in_flight=configs.get('max_in_flight', IndividualCalendar.DEFAULT_MAX_IN_FLIGHT),
+                work_day=WorkDay.from_configs(configs),
+                max_batches_in_flight=configs.get('max_batches_in_flight', IndividualCalendar.DEFAULT_MAX_BATCHES_IN_FLIGHT)
+            )
+        metrics.set('members', max(metrics.gauges.get('members', 0), len(all_members)))
+        metrics.count('windows_failed', sum(events_per_window[window] is None for window in windows))
+
+        with metrics.phase('member_absences'):
+            for window in windows:
+                if events_per_window[window] is None: continue
+                absences = [(event.net_id, str(event.date.date()), event.kind.label) for event in events_per_window[window]]
+                added, removed = state_store.replace_member_absences(window[0], window[1], absences, SharedCalendar.get_net_ids(all_members) if targeted else None)
+                logger.debug(f"{added} member absences were added and {removed} were removed since the previous cycle from {window[0]} to {window[1]}")
+
+        events_added = 0
+        events_deleted = 0
+        status = 'finished'
+        for target, group_members in targets:
+            try:
+                with Tracing.span('target', 'target', shared_calendar_name=target['shared_calendar_name'], group_name=target['group_name']):
+                    added, deleted = update_target(configs, target, group_members, start_date, end_date, windows, events_per_window, access_token, state_store, sync_range)
+            except Exception as e:
+                # The other targets don't depend on this one, so they are still updated
+                logger.exception(f"Unable to update {target['shared_calendar_name']}: {e}")
+                status = 'failed'
+                metrics.count('failed_targets')
+                continue
+            events_added = events_added + added
+            events_deleted = events_deleted + deleted
+
+        state_store.finish_cycle(cycle_id, events_added, events_deleted, status)
+        metrics.count('events_added', events_added)
+        metrics.count('events_deleted', events_deleted)
+
+def update_target(configs, target, group_members, start_date, end_date, windows, events_per_window, access_token, state_store, sync_range=None):
+    """
+    Updates the shared calendar of target with the events of its members
+
+    Args:
+        configs (dict): the configs as a dict
+        target (dict): the target, see get_targets
+        group_members (list): a list of emails of the members of the target
+        start_date (datetime): the start date of timeframe being updated
+        end_date (datetime): the end date of timeframe being updated
+        windows (list): a list of (start_date, end_date) tuples of datetimes
+        events_per_window (dict): window to the SimpleEvents of the members of every target, or None
+        access_token (str): the token used make calls to the Microsoft Graph API
+        state_store (StateStore): the state kept between cycles
+        sync_range (tuple): the whole (start_date, end_date) kept in sync, when start_date to end_date is only a part of it
+
+    Returns:
+        tuple: the number of events added to and deleted from the shared calendar
+    """
+
+    logger.debug(f"Updating {target['shared_calendar_name']} for {target['group_name']}")
+    net_ids = SharedCalendar.get_net_ids(group_members)
+
+    # Retrieve the shared calendar once for the whole timeframe and partition it per window as the pages arrive
+    with Metrics.get_metrics().phase('shared_calendar_read'):
+        shared_calendar_id = SharedCalendar.get_shared_calendar_id(target['shared_calendar_name'], access_token)
+        shared_calendar = SharedCalendar.read_shared_calendar(
+            shared_calendar_id, 
+            start_date, 
+            end_date, 
+            access_token, 
+            state_store, 
+            sync_mode=configs.get('shared_calendar_sync', 'full'), 
+            refresh_interval=configs.get('shared_calendar_refresh_interval', SharedCalendar.DEFAULT_REFRESH_INTERVAL),
+            sync_range=sync_range
+        )
+        shared_events_per_window = SharedCalendar.partition_shared_calendar(shared_calendar, windows, group_members)
+
+    events_added = 0
+    events_deleted = 0
+    for window in windows:
+        if events_per_window[window] is None:
+            logger.warning(f"Skipping the update of {window[0]} to {window[1]} because not all individual calendars were retrieved")
+            continue
+        logger.debug(f"{window[0]} to {window[1]}")
+
+        events = [event for event in events_per_window[window] if event.net_id in net_ids]
+        shared_calendar_events, event_ids = shared_events_per_window[window]
+        with Tracing.span('window', 'window', start_date=window[0], end_date=window[1]):
+            added, deleted = SharedCalendar.update_shared_calendar(events, shared_calendar_events, event_ids, shared_calendar_id, target['category_name'], target['category_color'], access_token, state_store, 
+                max_batch_concurrency=configs.get('max_batch_concurrency', SharedCalendar.DEFAULT_MAX_BATCH_CONCURRENCY))
+        events_added = events_added + added
+        events_deleted = events_deleted + deleted
+
+    return events_added, events_deleted
+
+def get_targets_members(configs, membership_index):
+    """
+    Returns:
+        list: a (target, group_members) tuple for every target of configs
+    """
+
+    targets = []
+    with Metrics.get_metrics().phase('membership'):
+        for target in get_targets(configs):
+            group_members = membership_index.get_emails(target['group_name'], configs['email_list_update_interval'])
+            targets.append((target, group_members))
+    return targets
+
+def get_member_targets(targets, members):
+    """
+    Returns:
+        list: the (target, group_members) tuples of targets, restricted to members, of the targets with any of them
+    """
+
+    member_targets = []
+    for target, group_members in targets:
+        group_members = [member for member in group_members if member in members]
+        if group_members:
+            member_targets.append((target, group_members))
+    return member_targets
+
+def run_push_mode(configs, token_manager, state_store, membership_index):
+    """
+    Keeps the shared calendars in sync using Microsoft Graph change notifications. A change to a member's 
+    calendar or to a shared calendar only re-synchronizes the affected member over the affected days, 
+    and the whole days_out horizon is still polled every push_poll_interval seconds as a safety net. 
+    The members without a subscription to their calendar (e.g. because it was refused) are polled 
+    every update_interval seconds instead, as they would be without push mode
+
+    Args:
+        configs (dict): the configs as a dict
+        token_manager (TokenManager): keeps the access token valid
+        state_store (StateStore): the state kept between cycles
+        membership_index (MembershipIndex): the members of the groups
+    """
+
+    subscription_manager = SubscriptionManager.from_configs(configs, state_store)
+    receiver = NotificationReceiver.from_configs(configs, subscription_manager.client_state)
+    receiver.start()
+
+    poll_interval = configs.get('push_poll_interval', DEFAULT_PUSH_POLL_INTERVAL)
+    scheduler = Scheduler([Tier(0, configs['days_out'], poll_interval)])
+    unsubscribed_scheduler = Scheduler([Tier(0, configs['days_out'], configs['update_interval'])])
+    unsubscribed = [] # the emails of the members without a subscription
+    shared_calendar_ids = {} # shared calendar name to its id, so that a wakeup doesn't look them up again
+    while True:
+        # Picks up the changes made to the configuration file since the previous cycle
+        configs = utils.get_configurations()
+        today = datetime.today()
+        today = datetime(year=today.year, month=today.month, day=today.day, hour=0,minute=0)
+        horizon = (today, today + timedelta(days=configs['days_out']))
+
+        # The throttle budget is shared by every range and member updated during the cycle
+        get_graph_client().throttle.start_cycle()
+        metrics = Metrics.start_cycle(get_graph_client())
+        targets = get_targets_members(configs, membership_index)
+        with metrics.phase('token'):
+            access_token = token_manager.get_token()
+
+        # The ids are only looked up for new targets, and again with every poll in case a shared calendar was recreated
+        due_tiers = scheduler.due()
+        if due_tiers:
+            shared_calendar_ids = {}
+        names = [target['shared_calendar_name'] for target, _ in targets]
+
+        # Subscriptions are created for new members and renewed before they expire
+        with metrics.phase('subscriptions'):
+            for name in names:
+                if name not in shared_calendar_ids:
+                    shared_calendar_ids[name] = SharedCalendar.get_shared_calendar_id(name, access_token)
+            subscription_manager.ensure(SubscriptionManager.get_resources(targets, [shared_calendar_ids[name] for name in names]), access_token)
+
+        members = subscription_manager.get_unsubscribed_members(targets)
+        if members and set(members) != set(unsubscribed):
+            logger.warning(f"{len(members)} members have no subscription to their calendar and are polled every {configs['update_interval']} seconds")
+        unsubscribed = members
+
+        if due_tiers:
+            logger.info(f"Polling the whole horizon from {horizon[0].date()} to {horizon[1].date()}")
+            retrieve_and_update_calendars(configs, horizon[0], horizon[1], targets, access_token, state_store, horizon)
+            scheduler.mark_run(due_tiers)
+            # The members without a subscription were just polled with the others
+            unsubscribed_scheduler.mark_run(unsubscribed_scheduler.tiers)
+        elif unsubscribed and unsubscribed_scheduler.due():
+            logger.info(f"Polling {len(unsubscribed)} members without a subscription from {horizon[0].date()} to {horizon[1].date()}")
+            member_targets = get_member_targets(targets, unsubscribed)
+            retrieve_and_update_calendars(configs, horizon[0], horizon[1], member_targets, access_token, state_store, horizon, targeted=True)
+            unsubscribed_scheduler.mark_run(unsubscribed_scheduler.tiers)
+        Metrics.finish_cycle(configs, get_graph_client())
+
+        # Waits for notifications until the next poll, but wakes up in time to renew the subscriptions
+        next_run = min(scheduler.next_run(), unsubscribed_scheduler.next_run()) if unsubscribed else scheduler.next_run()
+        timeout = min(next_run - time.time(), Notifications.RENEWAL_MARGIN / 2)
+        notifications = receiver.get_notifications(timeout, configs.get('notification_debounce', Notifications.DEFAULT_DEBOUNCE))
+        if not notifications: continue
+
+        logger.debug(f"{len(notifications)} change notifications were received")
+        get_graph_client().throttle.start_cycle()
+        metrics = Metrics.start_cycle(get_graph_client())
+        metrics.count('notifications', len(notifications))
+        with metrics.phase('token'):
+            access_token = token_manager.get_token()
+        with metrics.phase('notifications'):
+            affected = Notifications.get_affected_ranges(notifications, subscription_manager, horizon, access_token, state_store)
+        for net_id, (start_date, end_date) in affected.items():
+            member_targets = []
+            for target, group_members in targets:
+                members = [member for member in group_members if member.split('@')[0] == net_id]
+                if members:
+                    member_targets.append((target, members))
+            if not member_targets: continue
+
+            logger.info(f"Updating {net_id} from {start_date.date()} to {end_date.date()} after a change notification")
+            retrieve_and_update_calendars(configs, start_date, end_date, member_targets, access_token, state_store, horizon, targeted=True)
+        Metrics.finish_cycle(configs, get_graph_client())
 
 def main(configs):
     args = process_args()
     
     start_date = None
     end_date = None
-    days_out = timedelta(days=configs['days_out'])
-    group_members = None
 
-    # Define the msal public client
-    app = PublicClientApplication(client_id=configs['client_id'], authority=f"https://login.microsoftonline.com/{configs['tenant_id']}")
+    # Keeps the access token valid in the background
+    token_manager = TokenManager.from_configs(configs)
+
+    # Every module makes its Graph calls through this connection-pooled client
+    graph_client = GraphClient.from_configs(configs)
+    graph_client.token_provider = token_manager.get_token
+    set_graph_client(graph_client)
+
+    # Writes the spans of the cycles, requests and batches to trace_file, if it is set
+    Tracing.configure(configs)
+
+    # The state kept between cycles and restarts
+    state_store = StateStore.from_configs(configs)
+    membership_index = MembershipIndex.from_configs(configs)
+
+    if args.push:
+        run_push_mode(configs, token_manager, state_store, membership_index)
+        return
 
     if args.generate_report:
             group_name = args.generate_report[0]
             dates = sanitize_input(args.generate_report[1], args.generate_report[2])
             start_date = dates[0]
             end_date = dates[1]
-            access_token = utils.acquire_access_token(app, configs['scopes'])
-            current_date = start_date
+            access_token = token_manager.get_token()
             emails = utils.get_email_list_from_ldap(group_name)
-            while (current_date + timedelta(14) <= end_date):
-                temp_end_date = current_date + timedelta(14)
-                GenerateReport.generate_report_for_specified_group(emails, current_date, temp_end_date, access_token)
-                current_date = temp_end_date
-            
-            if (current_date < end_date):
-                GenerateReport.generate_report_for_specified_group(emails, current_date, end_date, access_token)
+            output = open(args.report_output, 'w') if args.report_output else None
+            try:
+                # The windows are retrieved in parallel and written in date order as they arrive
+                GenerateReport.generate_report_for_specified_group(
+                    emails, 
+                    start_date, 
+                    end_date, 
+                    access_token, 
+                    output=output, 
+                    report_format=args.report_format, 
+                    fetch_mode=configs.get('report_fetch_mode', 'concurrent'), 
+                    max_in_flight=configs.get('max_in_flight', IndividualCalendar.DEFAULT_MAX_IN_FLIGHT), 
+                    work_day=WorkDay.from_configs(configs)
+                )
+            finally:
+                if output:
+                    output.close()
             return
 
 
+    # Decides which days are refreshed and when. The days that are about to happen are refreshed more often
+    scheduler = Scheduler.from_configs(configs)
     count = 0
     while True:
+        # Sleeps until the days of at least one tier are due
+        if args.update_shared_calendar:
+            due_tiers = scheduler.wait()
+
+        # Picks up the changes made to the configuration file since the previous cycle
+        configs = utils.get_configurations()
+        # The throttle budget is shared by every range updated during the cycle
+        graph_client.throttle.start_cycle()
+        metrics = Metrics.start_cycle(graph_client)
+
         #if args.update_shared_calendar or args.generate_report:
         if args.update_shared_calendar:
-            logger.info(f"Updating shared calendar -> count: {count}") 
             today = datetime.today()
-            start_date = datetime(year=today.year, month=today.month, day=today.day, hour=0,minute=0)
-            end_date = start_date + days_out
+            today = datetime(year=today.year, month=today.month, day=today.day, hour=0,minute=0)
+            horizon = scheduler.horizon()
+            sync_range = (today + timedelta(days=horizon[0]), today + timedelta(days=horizon[1]))
+            ranges = [(today + timedelta(days=start_day), today + timedelta(days=end_day)) for start_day, end_day in Scheduler.get_ranges(due_tiers)]
         elif args.manual_update:
             logger.info(f"Running manually")
             dates = sanitize_input(args.manual_update[0], args.manual_update[1])
-            start_date = dates[0]
-            end_date = dates[1]
+            sync_range = None
+            ranges = [dates]
 
-        # Retrieve the group member emails 
-        group_members = utils.get_email_list(configs['group_name'], configs['email_list_update_interval'])
+        # Retrieve the group member emails of every target
+        targets = get_targets_members(configs, membership_index)
     
-        # Get access token
-        access_token = utils.acquire_access_token(app, configs['scopes'])
+        # Get access token. It is only acquired here when the background refresh couldn't keep it valid
+        with metrics.phase('token'):
+            access_token = token_manager.get_token()
 
-        # Retrieve the individual calendar and process it 
-        grouping = 10
-        
-        current_date = start_date
-        
-        while (current_date + timedelta(14) <= end_date):
-            temp_end_date = current_date + timedelta(14)
-            retrieve_and_update_calendars(current_date, temp_end_date, group_members, grouping, access_token)
-            current_date = temp_end_date
-            
-        if (current_date < end_date):
-            retrieve_and_update_calendars(current_date, end_date, group_members, grouping, access_token)
+        for start_date, end_date in ranges:
+            if args.update_shared_calendar:
+                logger.info(f"Updating shared calendar from {start_date.date()} to {end_date.date()} -> count: {count}") 
+            retrieve_and_update_calendars(configs, start_date, end_date, targets, access_token, state_store, sync_range)
+        Metrics.finish_cycle(configs, graph_client)
         
         if args.manual_update: break
-     
+
+        scheduler.mark_run(due_tiers)
+        scheduler.update(configs)
         count = count + 1
-        time.sleep(configs['update_interval'])
             
 if __name__ == '__main__':
     configs = utils.get_configurations()
@@ -0,0 +1,181 @@
+import time
+import logging
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+class Tier:
+    """
+    A range of days, relative to today, that is refreshed every interval seconds
+
+    Attributes
+    ----------
+    start_day : int
+        The first day of the tier (0 is today)
+    end_day : int
+        The day after the last day of the tier
+    interval : int
+        The number of seconds between two refreshes of the tier
+    next_run : float
+        The time (seconds since epoch) the tier is due at next
+    last_run : float
+        The time (seconds since epoch) the tier was last refreshed at, or None
+    """
+
+    def __init__(self, start_day, end_day, interval):
+        if start_day < 0 or end_day <= start_day or interval <= 0:
+            raise ValueError(f"Invalid refresh tier: days {start_day} to {end_day} every {interval} seconds")
+        self.start_day = start_day
+        self.end_day = end_day
+        self.interval = interval
+        self.next_run = 0
+        self.last_run = None
+
+    @property
+    def key(self):
+        return (self.start_day, self.end_day, self.interval)
+
+    def __repr__(self):
+        return f"Tier(days {self.start_day}-{self.end_day} every {self.interval}s)"
+
+class Scheduler:
+    """
+    Decides which ranges of days are refreshed and when. Every tier keeps its own next run,
+    so the days that are about to happen are refreshed more often than the days far out
+
+    Attributes
+    ----------
+    tiers : list
+        The tiers, sorted by their start_day
+
+    Methods
+    -------
+    wait
+        Blocks until at least one tier is due and returns the ranges of days of the due tiers
+    mark_run
+        Schedules the next run of tiers
+    """
+
+    def __init__(self, tiers):
+        self.tiers = sorted(tiers, key=lambda tier: tier.start_day)
+        for previous, tier in zip(self.tiers, self.tiers[1:]):
+            if tier.start_day < previous.end_day:
+                raise ValueError(f"Refresh tiers {previous} and {tier} overlap")
+
+    @staticmethod
+    def get_tiers(configs):
+        """
+        Creates the tiers from the optional refresh_tiers of the configs. Without refresh_tiers,
+        the whole days_out horizon is one tier refreshed every update_interval seconds
+
+        Args:
+            configs (dict): the configs as a dict
+
+        Returns:
+            list: a list of Tiers
+        """
+
+        if not configs.get('refresh_tiers'):
+            return [Tier(0, configs['days_out'], configs['update_interval'])]
+        return [Tier(tier['start'], tier['end'], tier['interval']) for tier in configs['refresh_tiers']]
+
+    @classmethod
+    def from_configs(cls, configs):
+        return cls(cls.get_tiers(configs))
+
+    def update(self, configs):
+        """
+        Picks up the changes made to the tiers of the configuration file.
+        The tiers that didn't change keep their next run. Invalid tiers (e.g. tiers that overlap) 
+        are logged and the previous tiers are kept, so a bad edit doesn't stop the program
+
+        Args:
+            configs (dict): the configs as a dict
+        """
+
+        current = {tier.key: tier for tier in self.tiers}
+        try:
+            tiers = [current.get(tier.key, tier) for tier in self.get_tiers(configs)]
+            if [tier.key for tier in tiers] == [tier.key for tier in self.tiers]:
+                return
+            # The tiers are only replaced once they are known to be valid
+            self.tiers = Scheduler(tiers).tiers
+        except (ValueError, KeyError, TypeError) as e:
+            logger.error(f"Keeping the refresh tiers {self.tiers} because the refresh tiers of the configuration file are invalid: {e}")
+            return
+        logger.info(f"Refresh tiers changed to {self.tiers}")
+
+    def due(self, now=None):
+        """
+        Returns:
+            list: the tiers whose next run has come
+        """
+
+        now = time.time() if now is None else now
+        return [tier for tier in self.tiers if tier.next_run <= now]
+
+    def next_run(self):
+        return min(tier.next_run for tier in self.tiers)
+
+    def wait(self):
+        """
+        Blocks until at least one tier is due
+
+        Returns:
+            list: the tiers that are due
+        """
+
+        delay = self.next_run() - time.time()
+        if delay > 0:
+            logger.debug(f"Sleeping {delay:.0f} seconds until the next refresh")
+            time.sleep(delay)
+        return self.due()
+
+    def mark_run(self, tiers, now=None):
+        """
+        Schedules the next run of tiers, which were just refreshed. The next run is kept on the
+        tier's own cadence, unless the refresh overran the interval, in which case it starts over from now
+
+        Args:
+            tiers (list): the tiers that were refreshed
+            now (float): the time the refresh finished at
+        """
+
+        now = time.time() if now is None else now
+        for tier in tiers:
+            next_run = tier.next_run + tier.interval
+            if next_run <= now:
+                if tier.last_run is not None:
+                    logger.warning(f"{tier} missed its deadline by {now - next_run:.0f} seconds")
+                next_run = now + tier.interval
+            tier.last_run = now
+            tier.next_run = next_run
+
+    @staticmethod
+    def get_ranges(tiers):
+        """
+        Merges the tiers into contiguous ranges of days, so that adjacent tiers that are due
+        together are refreshed with a single cycle
+
+        Args:
+            tiers (list): a list of Tiers
+
+        Returns:
+            list: a list of (start_day, end_day) tuples
+        """
+
+        ranges = []
+        for tier in sorted(tiers, key=lambda tier: tier.start_day):
+            if ranges and ranges[-1][1] == tier.start_day:
+                ranges[-1] = (ranges[-1][0], tier.end_day)
+            else:
+                ranges.append((tier.start_day, tier.end_day))
+        return ranges
+
+    def horizon(self):
+        """
+        Returns:
+            tuple: the (start_day, end_day) covered by all of the tiers
+        """
+
+        return (self.tiers[0].start_day, max(tier.end_day for tier in self.tiers))
@@ -1,14 +1,24 @@
-from datetime import datetime
 import json
-import datetime
 from datetime import timedelta 
 import logging
+import time
 import math
+import bisect
+from concurrent.futures import ThreadPoolExecutor, as_completed
 import utils
-import requests
+from GraphClient import get_graph_client
 from SimpleEvent import SimpleEvent
+from Metrics import get_metrics
+import Tracing
 
 MAX_REQUESTS_PER_BATCH = 20
+# The Microsoft Graph API allows 4 concurrent requests per mailbox, and a batch already carries up to 20 requests
+# against the mailbox of the shared calendar, so a second batch in flight only adds to the throttled requests
+DEFAULT_MAX_BATCH_CONCURRENCY = 1
+PAGE_SIZE = 400 # Number of events requested per page of the shared calendar
+SYNC_MODES = ('full', 'delta', 'store')
+DEFAULT_REFRESH_INTERVAL = 3600 # in seconds
+DELTA_RANGE_SLACK = 30 # Number of days the delta range extends past the timeframe being updated
 
 # This logger is a child of the __main__ logger located in OutlookCalendar.py
 logger = logging.getLogger("__main__." + __name__)
@@ -27,11 +37,10 @@ def get_shared_calendar_id(shared_calendar_name, access_token):
     """
 
     header = {
-        'Authorization': str(access_token),
         'Content-Type': 'application/json'
     }
-    endpoint = "https://graph.microsoft.com/v1.0/me/calendars"
-    response = requests.get(endpoint, headers=header)
+    endpoint = "/me/calendars"
+    response = get_graph_client().get(endpoint, access_token, headers=header)
     
     if response.status_code != 200:
         message = f"Unable to connect to the {endpoint} endpoint to retrieve {shared_calendar_name}"
@@ -51,19 +60,21 @@ def get_shared_calendar_id(shared_calendar_name, access_token):
     logger.error(f"response.text: {response.text}")
     raise KeyError(message)
 
-def get_shared_calendar(shared_calendar_id, start_date, end_date, access_token):
+def iterate_shared_calendar(shared_calendar_id, start_date, end_date, access_token):
     """
-    Retrieves a json object of the shared calendar events \
-    between the start_date to end_date (including start_date and excluding end_date)
+    Yields the shared calendar events between the start_date to end_date 
+    (including start_date and excluding end_date) one page at a time by following 
+    the @odata.nextLink of each page, so no event is left out of a busy timeframe
 
     Args:
+        shared_calendar_id (str): the associated id to the shared calendar
         start_date (datetime): the start date of timeframe being updated
         end_date (dateime):  the end date of timeframe being updated
         access_token (str): the token used make calls to the Microsoft Graph API \
         as part of the Oauth2 Authorization code flow
     
-    Returns:
-        json: json object of the events between the start and end date
+    Yields:
+        dict: an event between the start and end date
         (including start_date and excluding end_date)
     """
 
@@ -71,7 +82,6 @@ def get_shared_calendar(shared_calendar_id, start_date, end_date, access_token):
     end_date = str(end_date.date())
     
     header = {
-        'Authorization': str(access_token),
         'Prefer': "outlook.timezone=\"Central Standard Time\""
     }
 
@@ -80,17 +90,202 @@ def get_shared_calendar(shared_calendar_id, start_date, end_date, access_token):
     # start between start_date and end_date (includes start_date)
     # The exception is if the event start on the end_date. That event will not be included in the response.json()
 
-    endpoint = 'https://graph.microsoft.com/v1.0/me/calendars/' + shared_calendar_id +'/events?$select=subject,body,start,end,showAs&$top=400&$filter=start/dateTime ge ' + '\''+ start_date + '\'' + ' and start/dateTime lt ' + '\'' + end_date + '\''    
-    response = requests.get(endpoint, headers=header)
+    endpoint = '/me/calendars/' + shared_calendar_id +'/events?$select=subject,start,end,showAs&$top=' + str(PAGE_SIZE) + '&$filter=start/dateTime ge ' + '\''+ start_date + '\'' + ' and start/dateTime lt ' + '\'' + end_date + '\''    
+    graph_client = get_graph_client()
 
-    if (response.status_code != 200):
-        message = f'Unable to retrieve shared calendar from {endpoint} endpoint'
-        utils.send_email(message)
-        #logger.error(response.json())
-        logger.error(f"response.text: {response.text}")
-        raise ConnectionError(message)
+    while endpoint:
+        response = graph_client.get(endpoint, access_token, headers=header)
+
+        if (response.status_code != 200):
+            message = f'Unable to retrieve shared calendar from {endpoint} endpoint'
+            utils.send_email(message, access_token)
+            #logger.error(response.json())
+            logger.error(f"response.text: {response.text}")
+            raise ConnectionError(message)
+
+        page = response.json()
+        yield from page['value']
+        endpoint = page.get('@odata.nextLink')
+
+def get_shared_calendar(shared_calendar_id, start_date, end_date, access_token):
+    """
+    Retrieves a json object of the shared calendar events \
+    between the start_date to end_date (including start_date and excluding end_date)
+
+    Args:
+        shared_calendar_id (str): the associated id to the shared calendar
+        start_date (datetime): the start date of timeframe being updated
+        end_date (dateime):  the end date of timeframe being updated
+        access_token (str): the token used make calls to the Microsoft Graph API \
+        as part of the Oauth2 Authorization code flow
+    
+    Returns:
+        json: json object of the events between the start and end date
+        (including start_date and excluding end_date)
+    """
+
+    return {'value': list(iterate_shared_calendar(shared_calendar_id, start_date, end_date, access_token))}
+
+def sync_shared_calendar_delta(shared_calendar_id, start_date, end_date, access_token, state_store, sync_range=None):
+    """
+    Brings the mirror of the shared calendar kept in state_store up to date using the calendarView delta query. 
+    Only the events that were created, updated or removed since the previous cycle are retrieved. 
+    A new delta range is started when the saved one doesn't cover start_date to end_date
+
+    Args:
+        shared_calendar_id (str): the associated id to the shared calendar
+        start_date (datetime): the start date of timeframe being updated
+        end_date (dateime):  the end date of timeframe being updated
+        access_token (str): the token used make calls to the Microsoft Graph API \
+        as part of the Oauth2 Authorization code flow
+        state_store (StateStore): the store keeping the delta link and the mirror of the shared calendar
+        sync_range (tuple): the (start_date, end_date) a new delta range should cover, when start_date to end_date 
+        is only a part of the timeframe that is kept in sync
+
+    Returns:
+        list: the mirrored events of the shared calendar between start_date and end_date
+    """
+
+    delta_key = 'delta:' + shared_calendar_id
+    delta_state = state_store.get_meta(delta_key)
+    range_start = start_date.strftime("%Y-%m-%dT%H:%M:%S")
+    range_end = end_date.strftime("%Y-%m-%dT%H:%M:%S")
+    
+    if delta_state is None or delta_state['start'] > range_start or delta_state['end'] < range_end:
+        # The delta range is made wider than the timeframe so that it isn't restarted every day as the timeframe moves forward, 
+        # or whenever a different part of sync_range is refreshed
+        sync_end_date = end_date
+        if sync_range is not None:
+            range_start = min(start_date, sync_range[0]).strftime("%Y-%m-%dT%H:%M:%S")
+            sync_end_date = max(end_date, sync_range[1])
+        range_end = (sync_end_date + timedelta(days=DELTA_RANGE_SLACK)).strftime("%Y-%m-%dT%H:%M:%S")
+        logger.debug(f"Starting a new delta range from {range_start} to {range_end}")
+        delta_state = {
+            'start': range_start,
+            'end': range_end,
+            'delta_link': None
+        }
+        state_store.clear_shared_events(shared_calendar_id)
+    
+    endpoint = delta_state['delta_link']
+    if endpoint is None:
+        endpoint = '/me/calendars/' + shared_calendar_id + '/calendarView/delta?startDateTime=' + delta_state['start'] + '&endDateTime=' + delta_state['end']
+    
+    header = {
+        'Prefer': f"outlook.timezone=\"Central Standard Time\", odata.maxpagesize={PAGE_SIZE}"
+    }
+
+    graph_client = get_graph_client()
+    changes = 0
+    while True:
+        response = graph_client.get(endpoint, access_token, headers=header)
+
+        if response.status_code == 410 and delta_state['delta_link'] is not None:
+            # The sync state expired on the server, so the mirror has to be rebuilt from scratch
+            logger.warning("The delta link of the shared calendar expired. Starting a new delta range")
+            state_store.set_meta(delta_key, None)
+            return sync_shared_calendar_delta(shared_calendar_id, start_date, end_date, access_token, state_store, sync_range)
+
+        if (response.status_code != 200):
+            message = f'Unable to retrieve the changes of the shared calendar from {endpoint} endpoint'
+            utils.send_email(message, access_token)
+            logger.error(f"response.text: {response.text}")
+            raise ConnectionError(message)
+
+        page = response.json()
+        state_store.apply_shared_event_changes(shared_calendar_id, page['value'])
+        changes = changes + len(page['value'])
+        
+        if '@odata.nextLink' in page:
+            endpoint = page['@odata.nextLink']
+        else:
+            delta_state['delta_link'] = page['@odata.deltaLink']
+            break
+
+    logger.debug(f"{changes} changes were applied to the mirror of the shared calendar")
+    state_store.set_meta(delta_key, delta_state)
+    return state_store.get_shared_events(shared_calendar_id, start_date, end_date)
+
+def read_shared_calendar(shared_calendar_id, start_date, end_date, access_token, state_store, sync_mode='full', refresh_interval=DEFAULT_REFRESH_INTERVAL, sync_range=None):
+    """
+    Retrieves the events of the shared calendar between start_date and end_date
+    (including start_date and excluding end_date) using sync_mode
+
+    Args:
+        shared_calendar_id (str): the associated id to the shared calendar
+        start_date (datetime): the start date of timeframe being updated
+        end_date (dateime):  the end date of timeframe being updated
+        access_token (str): the token used make calls to the Microsoft Graph API \
+        as part of the Oauth2 Authorization code flow
+        state_store (StateStore): the store keeping the mirror of the shared calendar
+        sync_mode (str): 'full' to read every event from the shared calendar, 
+        'delta' to only read the changes since the previous cycle or 
+        'store' to use the mirror in state_store as long as it was fully read within refresh_interval seconds
+        refresh_interval (int): the number of seconds the mirror is used for in 'store' mode
+        sync_range (tuple): the whole (start_date, end_date) kept in sync, when start_date to end_date is only a part of it
+
+    Returns:
+        iterable: the events of the shared calendar
+    """
+
+    if sync_mode not in SYNC_MODES:
+        raise ValueError(f"sync_mode should be one of {SYNC_MODES}, not {sync_mode}")
+
+    if sync_mode == 'delta':
+        return sync_shared_calendar_delta(shared_calendar_id, start_date, end_date, access_token, state_store, sync_range)
 
-    return response.json()
+    refresh_key = 'refreshed:' + shared_calendar_id
+    if sync_mode == 'store':
+        if is_refreshed(state_store.get_meta(refresh_key), start_date, end_date, refresh_interval):
+            logger.debug("Using the mirror of the shared calendar")
+            return state_store.get_shared_events(shared_calendar_id, start_date, end_date)
+
+    def refresh_mirror():
+        events = iterate_shared_calendar(shared_calendar_id, start_date, end_date, access_token)
+        yield from state_store.mirror_shared_events(shared_calendar_id, start_date, end_date, events)
+        # Every range is recorded on its own, as the tiers of the scheduler refresh different ranges
+        now = time.time()
+        refreshed = [refreshed_range for refreshed_range in get_refreshed_ranges(state_store.get_meta(refresh_key)) 
+            if now - refreshed_range['time'] < refresh_interval and not (str(start_date) <= refreshed_range['start'] and refreshed_range['end'] <= str(end_date))]
+        refreshed.append({'start': str(start_date), 'end': str(end_date), 'time': now})
+        state_store.set_meta(refresh_key, {'ranges': refreshed})
+
+    return refresh_mirror()
+
+def get_refreshed_ranges(refreshed):
+    """
+    Returns:
+        list: the {'start', 'end', 'time'} ranges of the mirror that were fully read, from the meta of the mirror
+    """
+
+    if refreshed is None:
+        return []
+    # The meta used to hold a single range
+    return refreshed.get('ranges', [refreshed] if 'start' in refreshed else [])
+
+def is_refreshed(refreshed, start_date, end_date, refresh_interval):
+    """
+    Returns whether start_date to end_date is covered by ranges of the mirror fully read within refresh_interval seconds
+
+    Args:
+        refreshed (dict): the meta of the mirror, see get_refreshed_ranges
+        start_date (datetime): the start date of timeframe being read
+        end_date (datetime): the end date of timeframe being read
+        refresh_interval (int): the number of seconds the mirror is used for
+
+    Returns:
+        bool: True if the mirror can be used instead of the shared calendar
+    """
+
+    now = time.time()
+    covered = str(start_date)
+    for refreshed_range in sorted(get_refreshed_ranges(refreshed), key=lambda refreshed_range: refreshed_range['start']):
+        if now - refreshed_range['time'] >= refresh_interval: continue
+        if refreshed_range['start'] <= covered < refreshed_range['end']:
+            covered = refreshed_range['end']
+        if covered >= str(end_date):
+            return True
+    return covered >= str(end_date)
 
 def process_shared_calendar(shared_calendar, group_members):
     """
@@ -106,24 +301,70 @@ def process_shared_calendar(shared_calendar, group_members):
 
     filtered_events = []
     event_ids = {}
+    net_ids = get_net_ids(group_members)
     # the events can be multiday
     
     for event in shared_calendar['value']:
-
-        if event['showAs'] != 'free': continue
-        
-        simple_event = SimpleEvent.create_event_for_shared_calendar(event, group_members)
-        # Only valid events are returned as a simpleEvent object
+        simple_event = create_simple_event(event, net_ids)
         if simple_event == None: continue
         
         filtered_events.append(simple_event)
-        event_date = str(simple_event.date.date())
-        
-        event_ids[simple_event.subject + event_date] = event['id']
+        event_ids[simple_event.key] = event['id']
 
     return (filtered_events, event_ids)
 
-def update_shared_calendar(individual_calendars, shared_calendar, event_ids, shared_calendar_id, category_name, category_color, access_token):
+def partition_shared_calendar(shared_calendar_events, windows, group_members):
+    """
+    Creates simple event objects from the shared calendar events as they are retrieved 
+    and partitions them into the windows they start in
+
+    Args:
+        shared_calendar_events (iterable): the events of the shared calendar, e.g. from iterate_shared_calendar
+        windows (list): a sorted list of contiguous (start_date, end_date) tuples of datetimes
+        group_members (list): A list of emails of the group members
+
+    Returns: 
+        dict: (start_date, end_date) window to a tuple containing a list of SimpleEvent objects 
+        and a list of the correspending event ids 
+    """
+
+    partitions = {window: ([], {}) for window in windows}
+    window_starts = [window[0].toordinal() for window in windows]
+    net_ids = get_net_ids(group_members)
+
+    for event in shared_calendar_events:
+        simple_event = create_simple_event(event, net_ids)
+        if simple_event == None: continue
+
+        index = bisect.bisect_right(window_starts, simple_event.day) - 1
+        if index < 0 or simple_event.day >= windows[index][1].toordinal(): continue
+
+        filtered_events, event_ids = partitions[windows[index]]
+        filtered_events.append(simple_event)
+        event_ids[simple_event.key] = event['id']
+
+    return partitions
+
+def create_simple_event(event, net_ids):
+    """
+    Creates a simple event object from a shared calendar event 
+
+    Args:
+        event (dict): an event of the shared calendar
+        net_ids (set): the netids of the group members
+
+    Returns:
+        SimpleEvent: the SimpleEvent of the event or None if the event wasn't created by the program
+    """
+
+    if event['showAs'] != 'free': return None
+    # Only valid events are returned as a simpleEvent object
+    return SimpleEvent.create_event_for_shared_calendar(event, net_ids)
+
+def get_net_ids(group_members):
+    return {member.split("@")[0] for member in group_members}
+
+def update_shared_calendar(individual_calendars, shared_calendar, event_ids, shared_calendar_id, category_name, category_color, access_token, state_store=None, max_batch_concurrency=DEFAULT_MAX_BATCH_CONCURRENCY):
     """
     Update the specified shared calendar by adding and deleting events from it
 
@@ -136,21 +377,35 @@ def update_shared_calendar(individual_calendars, shared_calendar, event_ids, sha
         category_color: the color of the category for the event
         access_token (str): the token used make calls to the Microsoft Graph API \
         as part of the Oauth2 Authorization code flow
+        state_store (StateStore): if given, the mirror of the shared calendar in it is updated with the added and deleted events
+        max_batch_concurrency (int): the maximum number of batches posted at the same time
+
+    Returns:
+        tuple: the number of events to be added and to be deleted
     """
     
-    individual_events  = set(create_tuple(individual_calendars))
-    shared_events = set(create_tuple(shared_calendar))
-    
-    events_to_add = individual_events.difference(shared_events)
-    events_to_delete = shared_events.difference(individual_events)
+    metrics = get_metrics()
+    with metrics.phase('diff'):
+        individual_events  = set(create_tuple(individual_calendars))
+        shared_events = set(create_tuple(shared_calendar))
+        
+        events_to_add = individual_events.difference(shared_events)
+        events_to_delete = shared_events.difference(individual_events)
     
 
     logger.debug(f"Number of events to be added: {len(events_to_add)}")
-    batches = create_batches_for_adding_events(events_to_add, access_token, shared_calendar_id, category_name, category_color)
-    post_batch(access_token, batches)
+    if events_to_add:
+        with metrics.phase('create_batches'):
+            batches = create_batches_for_adding_events(events_to_add, access_token, shared_calendar_id, category_name, category_color)
+        with metrics.phase('post_batch'):
+            post_batch(access_token, batches, state_store=state_store, max_concurrency=max_batch_concurrency)
+
+    with metrics.phase('create_batches'):
+        batches, deleted_event_info = create_batches_for_deleting_events(events_to_delete, access_token, shared_calendar_id, event_ids)
+    with metrics.phase('post_batch'):
+        post_batch(access_token, batches, deleted_event_info, state_store=state_store, max_concurrency=max_batch_concurrency)
 
-    batches, deleted_event_info = create_batches_for_deleting_events(events_to_delete, access_token, shared_calendar_id, event_ids)
-    post_batch(access_token, batches, deleted_event_info)
+    return (len(events_to_add), len(events_to_delete))
 
 def create_tuple(calendar):
     """
@@ -160,24 +415,20 @@ def create_tuple(calendar):
         calendar (list): a list of Simple Events
     
     Returns:
-        A set of tuple events
+        A tuple of the (net_id, day, kind) keys of the events
     """
 
-    events = []
-    for event in calendar:
-        event_tuple = (event.net_id, event.subject, str(event.date.date()))
-        events.append(event_tuple)
-    return tuple(events)
+    return tuple(event.key for event in calendar)
 
 def create_batches_for_deleting_events(events, access_token, calendar_id, event_ids):
     """
     Create the batches for events being deleted from the shared_calendar using the format indicated by the Microsoft Graph API for batch
 
     Args:
-        events (list): a list of tuples (net_id, subject, date). date has format of YYYY-MM-DD
+        events (list): a list of (net_id, day, kind) keys of SimpleEvents
         access_token: a token to use the services offered by the Microsoft Graph API
         calendar_id (str): the id of the specified shared calendar
-        event_ids (dict): (net_id + subject) to event_id paring with event_id being the event id of the event
+        event_ids (dict): (net_id, day, kind) key to event_id paring with event_id being the event id of the event
 
     Returns:
         A list of dictionaries (batches)
@@ -199,15 +450,12 @@ def create_batches_for_deleting_events(events, access_token, calendar_id, event_
 
     event_info = {}
     for event in events:
-        event_id = event_ids[event[1] + event[2]]
+        event_id = event_ids[event]
 
         request = {
             "id": str(id_counter),
             "url": '/me/calendars/' + calendar_id +'/events/' +  str(event_id),
-            "method": "DELETE",
-            "headers": {
-                'Authorization': str(access_token)
-            }
+            "method": "DELETE"
         }
 
         event_info[str(id_counter)] = event
@@ -229,7 +477,7 @@ def create_batches_for_adding_events(events, access_token, calendar_id, category
     Create the batches for events being added to the shared_calendar using the format indicated by the Microsoft Graph API for batch
 
     Args:
-        events (list): a list of tuples (net_id, subject, date). date has format of YYYY-MM-DD
+        events (list): a list of (net_id, day, kind) keys of SimpleEvents
         access_token: a token to use the services offered by the Microsoft Graph API
         calendar_id (str): the id of the specified shared calendar
         category_name: the name of the category for the event
@@ -254,8 +502,10 @@ def create_batches_for_adding_events(events, access_token, calendar_id, category
     id_counter = 1
     
     for event in events:
-        start_date_time = event[2] + "T00:00:00.0000000"
-        end_date = datetime.datetime.strptime(event[2],"%Y-%m-%d") + timedelta(days=1)
+        # The subject and dates are only rendered here, when the payload is built
+        simple_event = SimpleEvent(*event)
+        start_date_time = simple_event.date.strftime("%Y-%m-%d") + "T00:00:00.0000000"
+        end_date = simple_event.date + timedelta(days=1)
         end_date_time = end_date.strftime("%Y-%m-%d") + "T00:00:00.0000000"
         
         request = {
@@ -263,7 +513,7 @@ def create_batches_for_adding_events(events, access_token, calendar_id, category
             "url": '/me/calendars/' + calendar_id +'/events',
             "method": "POST", # This could be different for for the delete function
             "body": {
-                "subject": event[1],
+                "subject": simple_event.subject,
                 "showAs": "free",
                 "isAllDay": True,
                 "start": {
@@ -277,7 +527,6 @@ def create_batches_for_adding_events(events, access_token, calendar_id, category
                 "categories": [category]
             },
             "headers": {
-                "Authorization": access_token,
                 'Content-type': 'application/json'
             }
         }
@@ -290,19 +539,24 @@ def create_batches_for_adding_events(events, access_token, calendar_id, category
     
     return batches
 
-def check_add_response(batch, batch_responses, access_token):
+def check_add_response(batch, batch_responses, access_token, state_store=None):
     """
     Checks each of the add event calls from the batch
 
     Args:
         batch (dict): The request body to the Microsoft Graph batch endpoint
         batch_responses (dict): The response from the batch request
+        state_store (StateStore): if given, the added events are added to the mirror of the shared calendar in it
     """
     message = ""
     for response in batch_responses:
         
         if response["status"] == 201: # 201 is the response for Created
             logger.info("Event {subject} on {date} was successfully added".format(subject=response['body']['subject'], date=response['body']['start']['dateTime']))
+            if state_store:
+                # The url of the request is /me/calendars/{calendar_id}/events
+                calendar_id = batch['requests'][int(response['id']) - 1]['url'].split('/')[3]
+                state_store.apply_shared_event_changes(calendar_id, [response['body']])
         else:
             id = int(response['id'])
             subject = batch['requests'][id - 1]['body']['subject']
@@ -314,56 +568,89 @@ def check_add_response(batch, batch_responses, access_token):
     # if (len(message) != 0):
     #     utils.send_email(user_client, access_token, message)
 
-def check_deleted_response(batch, batch_responses, access_token, info):
+def check_deleted_response(batch, batch_responses, access_token, info, state_store=None):
     """
     Checks each of the delete event calls from the batch
 
     Args:
         batch_responses (dict): The response from the batch request
         info (dict): a dictionary containing the events set to be deleted
+        state_store (StateStore): if given, the deleted events, and the ones that were already gone (404),
+        are removed from the mirror of the shared calendar in it
     """
 
     for response in batch_responses:
         id = response["id"]
-        event = info[id]
-        if response["status"] == 204:
-            logger.info(f"Event {event[1]} on {event[2]} was succesfully deleted")
+        event = SimpleEvent(*info[id])
+        if response["status"] in (204, 404):
+            # A 404 means the event is already gone, e.g. someone deleted it by hand, so the mirror has to forget it too
+            if response["status"] == 204:
+                logger.info(f"Event {event.subject} on {event.date.date()} was succesfully deleted")
+            else:
+                logger.info(f"Event {event.subject} on {event.date.date()} was already deleted")
+            if state_store:
+                # The url of the request is /me/calendars/{calendar_id}/events/{event_id}
+                state_store.remove_shared_events([batch['requests'][int(id) - 1]['url'].split('/')[-1]])
         else:
-            logger.warning(f"Event {event[1]} on {event[2]} was unsuccesfully deleted")
+            logger.warning(f"Event {event.subject} on {event.date.date()} was unsuccesfully deleted")
             logger.warning(f"Error: {response['body']['error']}")
     
 
-def post_batch(access_token, batches, info=None):
+def post_batch(access_token, batches, info=None, state_store=None, max_concurrency=DEFAULT_MAX_BATCH_CONCURRENCY):
     """
-    Create the batches for events being deleted from the shared_calendar using the format indicated by the Microsoft Graph API for batch
+    Posts the batches to the Microsoft Graph batch endpoint, up to max_concurrency of them at the same time, 
+    and checks the responses of each batch
 
     Args:
-        user_client (Graph Client Object) : msgraph.core._graph_client.GraphClient 
+        access_token (str): the token used make calls to the Microsoft Graph API \
+        as part of the Oauth2 Authorization code flow
         batches (list): A list of dictionaries (batches)
+        info (list): for batches deleting events, the dictionary of the events set to be deleted of each batch
+        state_store (StateStore): if given, the mirror of the shared calendar in it is updated with the results of the batches
+        max_concurrency (int): the maximum number of batches posted at the same time
     """
-    endpoint = "https://graph.microsoft.com/v1.0/$batch"
-    
-    header = {
-        'Accept': 'application/json',
-        'Content-type': 'application/json',
-        "Authorization": access_token
-    }
-   
-    for count, batch in enumerate(batches):
-        response = requests.post(endpoint, data=json.dumps(batch), headers=header)
-        #print(batch)
-        if response.status_code != 200:
-            message = "Unable to post batch \n" + str(response.json()["error"])
-            #utils.send_email(user_client, access_token, message)
-            logger.warning(message)
-            logger.warning(f"response.text: {response.text}")
-            #logger.warning(response.json())
-            continue
-
-        if info:
-            check_deleted_response(batch, response.json()["responses"], access_token, info[count])
-        else:
-            check_add_response(batch, response.json()["responses"], access_token)
+    if not batches: return
+
+    for batch in batches:
+        get_metrics().observe_batch(len(batch['requests']))
+
+    with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batches))) as executor:
+        futures = {}
+        for count, batch in enumerate(batches):
+            # The sub-requests are traced with the event they add or delete
+            if info:
+                span_args = {id: {'subject': SimpleEvent(*event).subject, 'date': str(SimpleEvent(*event).date.date())} for id, event in info[count].items()}
+            else:
+                span_args = {request['id']: {'subject': request['body']['subject'], 'date': request['body']['start']['dateTime'][:10]} for request in batch['requests']}
+            futures[executor.submit(Tracing.bind(send_batch), access_token, batch, span_args)] = count
+
+        # The responses are checked in the main thread as soon as their batch completes
+        for future in as_completed(futures):
+            count = futures[future]
+            batch_responses = future.result()
+
+            if info:
+                check_deleted_response(batches[count], batch_responses, access_token, info[count], state_store)
+            else:
+                check_add_response(batches[count], batch_responses, access_token, state_store)
+
+def send_batch(access_token, batch, span_args=None):
+    """
+    Posts a single batch to the Microsoft Graph batch endpoint
+
+    Args:
+        access_token (str): the token used make calls to the Microsoft Graph API \
+        as part of the Oauth2 Authorization code flow
+        batch (dict): the batch
+        span_args (dict): sub-request id to the attributes of the span of the sub-request
+
+    Returns:
+        list: the responses of the requests of the batch
+    """
+
+    # Requests that are throttled are retried on their own by the GraphClient, 
+    # the ones that still fail are reported by check_add_response and check_deleted_response
+    return get_graph_client().batch(batch['requests'], access_token, span_args)
         
 def get_category(access_token, category_name, category_color):
     """
@@ -379,12 +666,9 @@ def get_category(access_token, category_name, category_color):
     
     """
 
-    endpoint = 'https://graph.microsoft.com/v1.0/me/outlook/masterCategories'
-    headers = {
-        'Authorization': access_token
-    }
+    endpoint = '/me/outlook/masterCategories'
     
-    response = requests.get(endpoint, headers=headers)
+    response = get_graph_client().get(endpoint, access_token)
     if (response.status_code != 200):
         message = f"Unable to connect to {endpoint} endpoint to retrieve the masterCategories"
         utils.send_email(message, access_token)
@@ -414,9 +698,8 @@ def create_category(access_token, category_name, category_color):
         str: the name of the user specified category
     """
 
-    endpoint = 'https://graph.microsoft.com/v1.0/me/outlook/masterCategories'
+    endpoint = '/me/outlook/masterCategories'
     headers = {
-        'Authorization': access_token,
         'Content-Type': 'application/json'
     }
     # Can find the list of preset colors at https://learn.microsoft.com/en-us/graph/api/resources/outlookcategory?view=graph-rest-1.0
@@ -425,7 +708,7 @@ def create_category(access_token, category_name, category_color):
         'color': category_color
     }
 
-    response = requests.post(endpoint, data=json.dumps(body), headers=headers)
+    response = get_graph_client().post(endpoint, access_token, data=json.dumps(body), headers=headers)
 
     if response.status_code != 201:
         message = f"Unable to create {category_name}"
@@ -1,34 +1,182 @@
 from dataclasses import dataclass
 from datetime import datetime
+from enum import IntEnum
+from functools import lru_cache
+import sys
 from datetime import time
-from datetime import timedelta 
 import utils
 
 # If a multiday event starts at 12:00 AM on a Monday and ends at 5PM on a Wednesday. Then only two events will be created: 
 # ALL-DAY for Monday and Tuesday, but no events for Wednesday 
 # If a multiday event starts at 11:00 AM on a Monday and ends at 5PM on a Wednesday. Then only three events will be created: 
 # ALL-DAY for Tuesday, OUT AM for Monday and OUT PM for Wednesday 
-configs = utils.get_configurations()
-# AM_config = configs['AM_config']
-# PM_config = configs['PM_config']
-start_of_workday = configs['start_of_work_day']
-end_of_workday = configs['end_of_work_day']
-start_of_lunch = configs['start_of_lunch']
-end_of_lunch = configs['end_of_lunch']
-duration = configs['duration']
-
-@dataclass(order=True)
+
+@dataclass(frozen=True)
+class WorkDay:
+    """
+    The work-day settings, in minutes since midnight, used to classify events as AM and PM
+    """
+    start_of_workday : int
+    end_of_workday : int
+    start_of_lunch : int
+    end_of_lunch : int
+    duration : int # The minimum number of minutes an event has to overlap the AM or PM to count as OUT
+
+    @classmethod
+    def from_configs(cls, configs):
+        return cls(
+            configs['start_of_work_day'],
+            configs['end_of_work_day'],
+            configs['start_of_lunch'],
+            configs['end_of_lunch'],
+            configs['duration']
+        )
+
+    @classmethod
+    def current(cls):
+        """
+        Returns the work-day settings of the current configurations
+        """
+        return cls.from_configs(utils.get_configurations())
+
+class Kind(IntEnum):
+    """
+    The kind of an absence. OUT is AM | PM, so the kinds of a day can be merged with a bitwise or
+    """
+    AM = 1
+    PM = 2
+    OUT = 3
+
+    @property
+    def label(self):
+        return KIND_LABELS[self]
+
+KIND_LABELS = {Kind.AM: "OUT AM", Kind.PM: "OUT PM", Kind.OUT: "OUT"}
+LABEL_KINDS = {label: kind for kind, label in KIND_LABELS.items()}
+
+MIDNIGHT = time(0, 0, 0, 0)
+END_OF_DAY = 23 * 60 + 59 # 11:59 PM in minutes since midnight
+
+def is_AM_minutes(start_time, end_time, work_day):
+    '''
+    Verify whether the time from start_time to end_time, in minutes since midnight, fit within the AM specification
+    '''
+
+    if start_time > work_day.start_of_lunch or end_time < work_day.start_of_workday:
+        return False
+
+    if start_time < work_day.start_of_workday:
+        start_time = work_day.start_of_workday
+    
+    if end_time > work_day.start_of_lunch:
+        end_time = work_day.start_of_lunch
+    
+    if end_time - start_time >= work_day.duration:
+        return True
+    return False
+
+def is_PM_minutes(start_time, end_time, work_day):
+    '''
+    Verify whether the time from start_time to end_time, in minutes since midnight, fit within the PM specification
+    '''
+
+    if start_time > work_day.end_of_workday or end_time < work_day.end_of_lunch:
+        return False
+
+    if start_time < work_day.end_of_lunch:
+        start_time = work_day.end_of_lunch
+    
+    if end_time > work_day.end_of_workday:
+        end_time = work_day.end_of_workday
+
+    if end_time - start_time >= work_day.duration:
+        return True
+    return False
+
+@lru_cache(maxsize=65536)
+def get_minutes_kind(start_time, end_time, work_day):
+    '''
+    Classifies the time from start_time to end_time, in minutes since midnight, as OUT AM, OUT PM or OUT. 
+    Events tend to start and end on the hour or half hour, so the classifications are memoized
+
+    Returns:
+        Kind: the kind of the time or None if it is neither AM nor PM
+    '''
+
+    kind = 0
+    if is_AM_minutes(start_time, end_time, work_day):
+        kind = kind | Kind.AM
+    if is_PM_minutes(start_time, end_time, work_day):
+        kind = kind | Kind.PM
+    return Kind(kind) if kind else None
+
+@lru_cache(maxsize=4096)
+def parse_date_prefix(date):
+    '''
+    Parses the YYYY-MM-DD prefix of a timestamp. The timestamps of a cycle only span days_out days,
+    so the same few prefixes are parsed over and over and are memoized
+
+    Args:
+        date (str): The date in the form YYYY-MM-DD
+
+    Returns:
+        tuple: (year, month, day) as ints
+    '''
+
+    return int(date[0:4]), int(date[5:7]), int(date[8:10])
+
 class SimpleEvent:
-    net_id : str 
-    date : datetime 
-    subject : str # Our own formatted subject "[netID] [OUT/OUT AM/OUT PM]"
-    # date : datetime 
+    """
+    A compact record of a member's absence on a day. The subject "[netID] [OUT/OUT AM/OUT PM]" 
+    is only rendered when it is needed, e.g. to build a Microsoft Graph API payload, 
+    and events are compared, hashed and diffed using their (net_id, day, kind) key
+
+    Attributes
+    ----------
+    net_id : str
+        The netid of owner of the event. It is interned so every event of a member shares the same string
+    day : int
+        The proleptic Gregorian ordinal of the date of the event (datetime.toordinal)
+    kind : Kind
+        Whether the member is OUT in the AM, in the PM or for the whole day
+    """
+
+    __slots__ = ('net_id', 'day', 'kind')
+
+    def __init__(self, net_id, day, kind):
+        self.net_id = sys.intern(net_id)
+        self.day = day
+        self.kind = kind
+
+    @property
+    def date(self):
+        return datetime.fromordinal(self.day)
+
+    @property
+    def subject(self):
+        return self.net_id + " " + KIND_LABELS[self.kind]
+
+    @property
+    def key(self):
+        return (self.net_id, self.day, self.kind)
+
+    def __eq__(self, other):
+        return isinstance(other, SimpleEvent) and self.key == other.key
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __repr__(self):
+        return f"SimpleEvent(net_id={self.net_id!r}, date={self.date.date()}, kind={self.kind.name})"
     
     # Returns a list of Simple Events
     # The list will return 1 item if the event is a one day event 
     # Otherwise, the length of the list is equal to length of the event in terms of days
     @classmethod 
-    def create_event_for_individual_calendars(cls, event, start_date, end_date, net_id):
+    def create_event_for_individual_calendars(cls, event, start_date, end_date, net_id, work_day=None):
         '''
         Create SimpleEvents and returns a list of SimpleEvents using events from individual calendars
 
@@ -36,66 +184,101 @@ class SimpleEvent:
             event (dict): contains the information about the event
             start_date (datetime): the start date given by the user (today's date)
             net_id (str): the netid of owner of the event 
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
 
         Returns:
             A list of SimpleEvents
         '''
 
-        events = []
-        # TODO: Change the variable names to make them more specific
         start = SimpleEvent.make_datetime(event['start']['dateTime'])
         end = SimpleEvent.make_datetime(event['end']['dateTime'])
+        return cls.create_events_for_interval(start, end, start_date, end_date, net_id, work_day)
 
-        if start.date() == end.date():
-            if SimpleEvent.is_event_valid(start_date, end_date, start, end):
-                return [cls(net_id, start, SimpleEvent.get_event_subject(start, end, net_id))]
-            return []
+    @classmethod 
+    def create_events_for_interval(cls, start, end, start_date, end_date, net_id, work_day=None):
+        '''
+        Create SimpleEvents and returns a list of SimpleEvents using the already parsed
+        start and end of an event from an individual calendar (see parse_schedule_items)
+
+        Args:
+            start (datetime): A datetime object of the event's start time
+            end (datetime): A datetime object of the event's end time
+            start_date (datetime): the start date given by the user (today's date)
+            net_id (str): the netid of owner of the event 
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
+
+        Returns:
+            A list of SimpleEvents
+        '''
+
+        return cls.create_events_for_intervals([(net_id, start, end)], start_date, end_date, work_day)
+
+    @classmethod 
+    def create_events_for_intervals(cls, intervals, start_date, end_date, work_day=None):
+        '''
+        Create SimpleEvents for the events of every member at once. A multiday event is split 
+        into its first day, its full middle days and its last day using interval arithmetic, 
+        so the middle days are classified once instead of once per day
+
+        Args:
+            intervals (iterable): (net_id, start, end) tuples of the events of the members
+            start_date (datetime): the start date given by the user (today's date)
+            end_date (datetime): the end date given by the user
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
+
+        Returns:
+            A list of SimpleEvents, in the order of intervals and then of their days
+        '''
+
+        if work_day is None:
+            work_day = WorkDay.current()
+
+        # The days whose midnight is within [start_date, end_date), i.e. the days that can hold 
+        # a middle day or the last day of a multiday event, as a range of ordinals
+        first_valid_day = start_date.toordinal() + (start_date.time() != MIDNIGHT)
+        last_valid_day = end_date.toordinal() + (end_date.time() != MIDNIGHT)
+        full_day_kind = get_minutes_kind(0, END_OF_DAY, work_day)
+
+        events = []
+        for net_id, start, end in intervals:
+            start_day = start.toordinal()
+            start_time = start.hour * 60 + start.minute
+
+            if start_day == end.toordinal():
+                if start_date <= start < end_date:
+                    kind = get_minutes_kind(start_time, end.hour * 60 + end.minute, work_day)
+                    if kind:
+                        events.append(cls(net_id, start_day, kind))
+                continue
+
+            # The number of days the event is split into, e.g. an event from 12:00 AM on a Monday to 
+            # 12:00 AM on a Wednesday covers Monday and Tuesday but an event from 11:00 AM on a Monday 
+            # to 5:00 PM on a Wednesday covers Monday, Tuesday and Wednesday
+            duration = end - start
+            n_days = duration.days + (duration.seconds // 3600 != 0) + (start.time() != MIDNIGHT and end.time() <= start.time())
+            if n_days < 1: continue
+
+            # The first day goes from the start of the event until the end of the day
+            if start_date <= start < end_date:
+                kind = get_minutes_kind(start_time, END_OF_DAY, work_day)
+                if kind:
+                    events.append(cls(net_id, start_day, kind))
+
+            # The middle days are full days
+            if full_day_kind:
+                for day in range(max(start_day + 1, first_valid_day), min(start_day + n_days - 1, last_valid_day)):
+                    events.append(cls(net_id, day, full_day_kind))
+
+            # The last day goes from the start of the day until the end of the event
+            last_day = start_day + n_days - 1
+            if n_days > 1 and first_valid_day <= last_day < last_valid_day:
+                end_time = END_OF_DAY if end.time() == MIDNIGHT else end.hour * 60 + end.minute
+                kind = get_minutes_kind(0, end_time, work_day)
+                if kind:
+                    events.append(cls(net_id, last_day, kind))
 
-        # if an event goes in here, then it's all day because the start date and end date differ by one day so it has to be at least be 1 All Day
-        # Automatically All Day 
-        dates_interval = end - start
-        
-        add_on = 0
-        remaining_hours = dates_interval.seconds // 3600
- 
-        if (remaining_hours!= 0):
-            add_on = add_on + 1
-        
-        # if (start.time() >= )
-
-        midnight_start_time  = time(0, 0, 0, 0)   
-
-        if (start.time() != midnight_start_time and end.time() <= start.time()):
-            add_on = add_on + 1        
-
-        for i in range(dates_interval.days + add_on): # The plus accounts for the last day of the multiday event. Even if it's just one All-Day
-            
-            #new_date = start + timedelta(days=i)
-            
-            # new_start and new_end are just changing the time
-            new_start = start + timedelta(days=i)
-            new_end = end + timedelta(days=i)
-            new_end = new_end.replace(year=new_start.year, month=new_start.month, day=new_start.day)
-            
-            # Adjust the time so that we can create an accurate subject for the split up event
-            # Manipulating the time for the simple event here
-
-            if (i == 0):
-                new_end = new_end.replace(hour=23,minute=59,second=59)
-            elif (i == dates_interval.days + add_on - 1):
-                new_start = new_start.replace(hour=0,minute=0,second=0)
-                if (new_end.time() == midnight_start_time):
-                    new_end = new_end.replace(hour=23,minute=59,second=59)
-            else:
-                new_start = new_start.replace(hour=0,minute=0,second=0)
-                new_end = new_end.replace(hour=23,minute=59,second=59)
-
-            if SimpleEvent.is_event_valid(start_date, end_date, new_start, new_end):
-                events.append(cls(net_id, new_start, SimpleEvent.get_event_subject(new_start, new_end, net_id)))
-                
         return events
 
-    
     @classmethod 
     def create_event_for_shared_calendar(cls, event, net_ids):
         '''
@@ -103,16 +286,9 @@ class SimpleEvent:
 
         Args:
             event (dict): contains the information about the event
+            net_ids (set): the netids of the group members
         '''
-        temp_net_ids = []
-        for net_id in net_ids:
-            temp_net_ids.append(net_id.split("@")[0])
-            
-
-        net_ids = temp_net_ids
         
-        
-        start = SimpleEvent.make_datetime(event['start']['dateTime'])
         subject = event['subject']
         event_identifier = subject.split(' ', 1) # (net_id, status)
         
@@ -120,20 +296,41 @@ class SimpleEvent:
             # this is for manager manual update
             return
 
-        if (len(event_identifier) == 2 and (event_identifier[1] == "OUT" or event_identifier[1] == "OUT AM" or  event_identifier[1] == "OUT PM")):
-            simple_event = cls(event_identifier[0], start, subject)
+        if (len(event_identifier) == 2 and event_identifier[1] in LABEL_KINDS):
+            start = SimpleEvent.make_datetime(event['start']['dateTime'])
+            simple_event = cls(event_identifier[0], start.toordinal(), LABEL_KINDS[event_identifier[1]])
             return simple_event
 
     
 
     @classmethod
-    def create_all_day_event(cls, net_id, date):
-        return cls(net_id, date, net_id + " OUT")
+    def create_all_day_event(cls, net_id, day):
+        return cls(net_id, day, Kind.OUT)
+
+    @staticmethod    
+    # get_event_kind assumes that start and end are on the same day, so it's just checking their times
+    def get_event_kind(start, end, work_day=None):
+        '''
+        Classifies an event as OUT AM, OUT PM or OUT based on the start and end time given by the user
+
+        Args:
+            start (datetime): A datetime object of the event's start time
+            end (datetime): A datetime object of the event's end time
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
+        
+        Returns:
+            Kind: the kind of the event or None if it is neither AM nor PM
+        '''
+
+        if work_day is None:
+            work_day = WorkDay.current()
+
+        return get_minutes_kind(start.hour * 60 + start.minute, end.hour * 60 + end.minute, work_day)
 
 
     @staticmethod    
     # get_event_subject assumes that start and end are on the same day, so it's just checking their times to create the subject
-    def get_event_subject(start, end, net_id):
+    def get_event_subject(start, end, net_id, work_day=None):
         '''
         Creates an event subject for the shared calendar event based on the start and end time given by the user
 
@@ -141,23 +338,18 @@ class SimpleEvent:
             start (datetime): A datetime object of the event's start time
             end (datetime): A datetime object of the event's end time
             net_id (str): the netid of owner of the event  
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
         
         Returns:
             The subject of the shared calendar event as a str
         '''
 
-        is_AM = SimpleEvent.is_AM(start, end)
-        is_PM = SimpleEvent.is_PM(start,end)
-
-        if (is_AM == True and is_PM == True):
-            return net_id + " OUT"
-        elif (is_AM == True):
-            return net_id + " OUT AM"
-        elif (is_PM == True):
-            return net_id + " OUT PM"    
+        kind = SimpleEvent.get_event_kind(start, end, work_day)
+        if kind:
+            return net_id + " " + kind.label
     
     @staticmethod    
-    def is_event_valid(user_start, user_end, start, end):
+    def is_event_valid(user_start, user_end, start, end, work_day=None):
         '''
         Verify whether the event duration fit within the specified start and end time
 
@@ -165,6 +357,7 @@ class SimpleEvent:
             user_start (datetime): The start time given by user
             start (datetime): A datetime object of the event's start time
             end (datetime): A datetime object of the event's end time
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
 
         Returns:
             True if event is a valid event
@@ -175,7 +368,10 @@ class SimpleEvent:
         #     return True
         # return False
 
-        if (user_start <= start and user_end > start) and (SimpleEvent.is_AM(start, end) or SimpleEvent.is_PM(start,end)):
+        if work_day is None:
+            work_day = WorkDay.current()
+
+        if (user_start <= start and user_end > start) and (SimpleEvent.is_AM(start, end, work_day) or SimpleEvent.is_PM(start, end, work_day)):
             return True
         return False
     
@@ -191,6 +387,14 @@ class SimpleEvent:
             A datetime object representing the date
         '''
         
+        # The Microsoft Graph API always uses the fixed layout 2023-03-18T00:00:00.0000000, 
+        # so its fields are sliced out directly instead of going through strptime
+        if len(date) >= 19 and date[10] == "T" and date[13] == ":" and date[16] == ":":
+            year, month, day = parse_date_prefix(date[:10])
+            return datetime(year, month, day, int(date[11:13]), int(date[14:16]), int(date[17:19]))
+        if len(date) == 10 and date[4] == "-" and date[7] == "-":
+            return datetime(*parse_date_prefix(date))
+
         if "T" in date:
             # The format of date is 2023-03-18T00:00:00.0000000
             # The split is to remove the microseconds b/c datetime only take microseconds up to 6 digits, 
@@ -198,66 +402,66 @@ class SimpleEvent:
             return datetime.strptime(date.split('.')[0], "%Y-%m-%dT%H:%M:%S")
         else:
             return datetime.strptime(date, "%Y-%m-%d")
+
+    @staticmethod
+    def parse_schedule_items(schedule_items, status=None):
+        '''
+        Parses the start and end of every item of the scheduleItems of a getSchedule response
+
+        Args:
+            schedule_items (list): the scheduleItems of a member
+            status (str): if given, only the items with this status (e.g. oof) are parsed
+
+        Returns:
+            list: a list of (start, end) tuples of datetimes, in the order of schedule_items
+        '''
+
+        make_datetime = SimpleEvent.make_datetime
+        return [
+            (make_datetime(item['start']['dateTime']), make_datetime(item['end']['dateTime']))
+            for item in schedule_items
+            if status is None or item['status'] == status
+        ]
         
     @staticmethod
-    def is_AM(start, end):
+    def is_AM(start, end, work_day=None):
         '''
         Verify whether the event duration fit within the AM specification
 
         Args:
             start (datetime): A datetime object of the event's start time
             end (datetime): A datetime object of the event's end time
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
 
         Returns: 
             True if the event is AM
             False if not
         '''
 
-        start_time = (start.hour * 60) + start.minute
-        end_time= (end.hour * 60) + end.minute
-
-        if start_time > start_of_lunch or end_time < start_of_workday:
-            return False
+        if work_day is None:
+            work_day = WorkDay.current()
 
-        if start_time < start_of_workday:
-            start_time = start_of_workday
-        
-        if end_time > start_of_lunch:
-            end_time = start_of_lunch
-        
-        if end_time - start_time >= duration:
-            return True
-        return False
+        return is_AM_minutes((start.hour * 60) + start.minute, (end.hour * 60) + end.minute, work_day)
 
     @staticmethod
-    def is_PM(start, end):
+    def is_PM(start, end, work_day=None):
         '''
         Verify whether the event duration fit within the PM specification
 
         Args:
             start (datetime): A datetime object of the event's start time
             end (datetime): A datetime object of the event's end time
+            work_day (WorkDay): the work-day settings. Defaults to the ones of the current configurations
 
         Returns: 
             True if the event is PM
             False if not
         '''
     
-        start_time = (start.hour * 60) + start.minute
-        end_time= (end.hour * 60) + end.minute
+        if work_day is None:
+            work_day = WorkDay.current()
 
-        if start_time > end_of_workday or end_time < end_of_lunch:
-            return False
-
-        if start_time < end_of_lunch:
-            start_time= end_of_lunch
-        
-        if end_time > end_of_workday:
-            end_time = end_of_workday
-
-        if end_time - start_time >= duration:
-            return True
-        return False
+        return is_PM_minutes((start.hour * 60) + start.minute, (end.hour * 60) + end.minute, work_day)
 
 # event = {
 # 			'isPrivate': False,
@@ -0,0 +1,258 @@
+import sqlite3
+import threading
+import json
+import logging
+from datetime import datetime
+
+STATE_STORE_FILE = 'vcs_state.db'
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS shared_events (
+    id TEXT PRIMARY KEY,
+    calendar_id TEXT NOT NULL,
+    subject TEXT,
+    start TEXT NOT NULL,
+    show_as TEXT
+);
+CREATE INDEX IF NOT EXISTS shared_events_start ON shared_events (calendar_id, start);
+CREATE TABLE IF NOT EXISTS member_absences (
+    net_id TEXT NOT NULL,
+    date TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    PRIMARY KEY (net_id, date, kind)
+);
+CREATE TABLE IF NOT EXISTS cycles (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    started TEXT NOT NULL,
+    finished TEXT,
+    start_date TEXT,
+    end_date TEXT,
+    events_added INTEGER,
+    events_deleted INTEGER,
+    status TEXT
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT
+);
+'''
+
+class StateStore:
+    """
+    A SQLite backed store, kept in vcs_directory, of the state that survives between cycles and restarts
+
+    Attributes
+    ----------
+    path : str
+        The path of the SQLite database file
+    connection : sqlite3.Connection
+        The connection to the database. It is shared between threads and guarded by lock
+    lock : threading.Lock
+        Serializes the access to connection
+
+    Methods
+    -------
+    get_shared_events
+        Returns the mirrored shared calendar events that start within a timeframe
+    mirror_shared_events
+        Replaces the mirrored shared calendar events of a timeframe while the new events are being retrieved
+    get_shared_event
+        Returns a mirrored shared calendar event by its id
+    replace_member_absences
+        Replaces the member absences of a timeframe and counts what changed
+    get_member_absence_dates
+        Returns the days a member was last known to be absent on
+    start_cycle / finish_cycle
+        Records the metadata of a cycle
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        with self.lock, self.connection:
+            self.connection.executescript(SCHEMA)
+
+    @classmethod
+    def from_configs(cls, configs):
+        return cls(configs['vcs_directory'] + STATE_STORE_FILE)
+
+    def close(self):
+        with self.lock:
+            self.connection.close()
+
+    # Shared calendar mirror
+    # The events are kept in the same shape as the events returned by the Microsoft Graph API
+    # so that SharedCalendar.process_shared_calendar can use them as is
+
+    @staticmethod
+    def _row(calendar_id, event):
+        return (event['id'], calendar_id, event.get('subject'), event['start']['dateTime'][:19], event.get('showAs'))
+
+    @staticmethod
+    def _event(row):
+        return {
+            'id': row[0],
+            'subject': row[1],
+            'start': {'dateTime': row[2]},
+            'showAs': row[3]
+        }
+
+    def get_shared_events(self, calendar_id, start_date, end_date):
+        """
+        Returns the mirrored events of the shared calendar that start between start_date and end_date
+        (including start_date and excluding end_date)
+
+        Args:
+            calendar_id (str): the associated id to the shared calendar
+            start_date (datetime): the start date of the timeframe
+            end_date (datetime): the end date of the timeframe
+
+        Returns:
+            list: a list of events
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT id, subject, start, show_as FROM shared_events WHERE calendar_id = ? AND start >= ? AND start < ? ORDER BY start',
+                (calendar_id, start_date.strftime("%Y-%m-%dT%H:%M:%S"), end_date.strftime("%Y-%m-%dT%H:%M:%S"))
+            ).fetchall()
+        return [self._event(row) for row in rows]
+
+    def mirror_shared_events(self, calendar_id, start_date, end_date, events):
+        """
+        Yields every event of events while replacing the mirrored events between start_date and end_date with them.
+        The mirror is only changed once every event has been yielded
+
+        Args:
+            calendar_id (str): the associated id to the shared calendar
+            start_date (datetime): the start date of the timeframe
+            end_date (datetime): the end date of the timeframe
+            events (iterable): the events of the shared calendar within the timeframe
+
+        Yields:
+            dict: the events of events
+        """
+
+        rows = []
+        for event in events:
+            rows.append(self._row(calendar_id, event))
+            yield event
+
+        with self.lock, self.connection:
+            self.connection.execute(
+                'DELETE FROM shared_events WHERE calendar_id = ? AND start >= ? AND start < ?',
+                (calendar_id, start_date.strftime("%Y-%m-%dT%H:%M:%S"), end_date.strftime("%Y-%m-%dT%H:%M:%S"))
+            )
+            self.connection.executemany('INSERT OR REPLACE INTO shared_events VALUES (?, ?, ?, ?, ?)', rows)
+
+    def get_shared_event(self, event_id):
+        """
+        Returns the mirrored event with event_id, or None if it isn't mirrored
+        """
+
+        with self.lock:
+            row = self.connection.execute(
+                'SELECT id, subject, start, show_as FROM shared_events WHERE id = ?', (event_id,)
+            ).fetchone()
+        return self._event(row) if row else None
+
+    def clear_shared_events(self, calendar_id):
+        with self.lock, self.connection:
+            self.connection.execute('DELETE FROM shared_events WHERE calendar_id = ?', (calendar_id,))
+
+    def apply_shared_event_changes(self, calendar_id, events):
+        """
+        Adds, updates and removes mirrored events
+
+        Args:
+            calendar_id (str): the associated id to the shared calendar
+            events (list): events to add or update. Events with an @removed annotation are removed instead
+        """
+
+        with self.lock, self.connection:
+            for event in events:
+                if '@removed' in event:
+                    self.connection.execute('DELETE FROM shared_events WHERE id = ?', (event['id'],))
+                else:
+                    self.connection.execute('INSERT OR REPLACE INTO shared_events VALUES (?, ?, ?, ?, ?)', self._row(calendar_id, event))
+
+    def remove_shared_events(self, event_ids):
+        with self.lock, self.connection:
+            self.connection.executemany('DELETE FROM shared_events WHERE id = ?', [(event_id,) for event_id in event_ids])
+
+    # Member absences
+
+    def replace_member_absences(self, start_date, end_date, absences, net_ids=None):
+        """
+        Replaces the absences between start_date and end_date with absences
+
+        Args:
+            start_date (datetime): the start date of the timeframe
+            end_date (datetime): the end date of the timeframe
+            absences (iterable): (net_id, date, kind) tuples. date has format of YYYY-MM-DD
+            net_ids (set): if given, only the absences of these members are replaced
+
+        Returns:
+            tuple: the number of absences that were added and removed since the previous cycle
+        """
+
+        start = str(start_date.date())
+        end = str(end_date.date())
+        absences = set(absences)
+        with self.lock, self.connection:
+            previous = set(self.connection.execute(
+                'SELECT net_id, date, kind FROM member_absences WHERE date >= ? AND date < ?', (start, end)
+            ).fetchall())
+            if net_ids is not None:
+                previous = {absence for absence in previous if absence[0] in net_ids}
+            added = absences.difference(previous)
+            removed = previous.difference(absences)
+            self.connection.executemany('DELETE FROM member_absences WHERE net_id = ? AND date = ? AND kind = ?', removed)
+            self.connection.executemany('INSERT INTO member_absences VALUES (?, ?, ?)', added)
+        return (len(added), len(removed))
+
+    def get_member_absence_dates(self, net_id, start_date, end_date):
+        """
+        Returns the days between start_date and end_date that net_id was absent on when its calendar was last retrieved,
+        e.g. the days an event was on before it was moved
+
+        Returns:
+            list: the sorted days as datetimes at midnight
+        """
+
+        with self.lock:
+            rows = self.connection.execute(
+                'SELECT DISTINCT date FROM member_absences WHERE net_id = ? AND date >= ? AND date < ? ORDER BY date',
+                (net_id, str(start_date.date()), str(end_date.date()))
+            ).fetchall()
+        return [datetime.strptime(date, '%Y-%m-%d') for date, in rows]
+
+    # Cycle metadata
+
+    def start_cycle(self, start_date, end_date):
+        with self.lock, self.connection:
+            cursor = self.connection.execute(
+                'INSERT INTO cycles (started, start_date, end_date, status) VALUES (?, ?, ?, ?)',
+                (datetime.now().isoformat(), str(start_date.date()), str(end_date.date()), 'running')
+            )
+            return cursor.lastrowid
+
+    def finish_cycle(self, cycle_id, events_added, events_deleted, status='finished'):
+        with self.lock, self.connection:
+            self.connection.execute(
+                'UPDATE cycles SET finished = ?, events_added = ?, events_deleted = ?, status = ? WHERE id = ?',
+                (datetime.now().isoformat(), events_added, events_deleted, status, cycle_id)
+            )
+
+    def get_meta(self, key, default=None):
+        with self.lock:
+            row = self.connection.execute('SELECT value FROM meta WHERE key = ?', (key,)).fetchone()
+        return json.loads(row[0]) if row else default
+
+    def set_meta(self, key, value):
+        with self.lock, self.connection:
+            self.connection.execute('INSERT OR REPLACE INTO meta VALUES (?, ?)', (key, json.dumps(value)))
@@ -0,0 +1,204 @@
+import random
+import threading
+import time
+import logging
+from datetime import datetime
+from email.utils import parsedate_to_datetime
+from urllib.parse import urlsplit
+
+THROTTLED_STATUS_CODES = (429, 503) # Throttled or unavailable, so the request was not processed
+GATEWAY_STATUS_CODES = (502, 504) # The request might have been processed before the gateway gave up on it
+IDEMPOTENT_METHODS = ('GET', 'DELETE', 'PATCH')
+READ_ONLY_ACTIONS = ('getSchedule',) # POST endpoints that don't change anything
+DEFAULT_BUDGET = 300 # Number of seconds per cycle that can be spent waiting to retry requests
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_BASE_DELAY = 2 # in seconds
+DEFAULT_MAX_DELAY = 120 # in seconds
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+def parse_retry_after(value):
+    """
+    Parses the value of a Retry-After header
+
+    Args:
+        value (str): the number of seconds to wait or an HTTP date
+
+    Returns:
+        float: the number of seconds to wait or None if value is missing or invalid
+    """
+
+    if value is None:
+        return None
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+    try:
+        return max((parsedate_to_datetime(value) - datetime.now().astimezone()).total_seconds(), 0)
+    except (TypeError, ValueError):
+        return None
+
+def is_idempotent(method, url):
+    """
+    Returns:
+        bool: True if the request can be sent again without side effects, e.g. a GET or a getSchedule POST
+    """
+
+    return method.upper() in IDEMPOTENT_METHODS or urlsplit(url).path.rstrip('/').split('/')[-1] in READ_ONLY_ACTIONS
+
+def is_retryable(status_code, idempotent):
+    """
+    Returns whether a response should be retried. A write that failed with 502 or 504 is not retried, 
+    as it might have been applied already and retrying it could e.g. create a duplicate event
+
+    Args:
+        status_code (int): the status code of the response
+        idempotent (bool): whether the request can be sent again without side effects
+
+    Returns:
+        bool: True if the request should be retried
+    """
+
+    return status_code in THROTTLED_STATUS_CODES or (idempotent and status_code in GATEWAY_STATUS_CODES)
+
+def get_header(headers, name):
+    """
+    Case-insensitive lookup of a header in a dict, e.g. the headers of a batch sub-response
+    """
+
+    if not headers:
+        return None
+    for key, value in headers.items():
+        if key.lower() == name.lower():
+            return value
+    return None
+
+class ThrottleState:
+    """
+    The throttling state shared by every request made through a GraphClient.
+    When the Microsoft Graph API throttles a request, every thread waits until the
+    Retry-After has passed before sending its next request, and the time spent waiting
+    to retry is limited by a per-cycle budget
+
+    Attributes
+    ----------
+    budget : float
+        The number of seconds per cycle that can be spent waiting to retry requests
+    spent : float
+        The number of seconds the retries granted since the cycle started extended the throttling by
+    max_retries : int
+        The maximum number of times a single request is retried
+    throttled_until : float
+        The time (seconds since epoch) until which no request should be sent
+    throttled_count : int
+        The number of throttled (429) responses, including sub-responses, that were granted a retry during the cycle
+    retry_count : int
+        The number of retries of the cycle
+    """
+
+    def __init__(self, budget=DEFAULT_BUDGET, max_retries=DEFAULT_MAX_RETRIES, base_delay=DEFAULT_BASE_DELAY, max_delay=DEFAULT_MAX_DELAY):
+        self.budget = budget
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.lock = threading.Lock()
+        self.throttled_until = 0
+        self.start_cycle()
+
+    @classmethod
+    def from_configs(cls, configs):
+        return cls(
+            budget=configs.get('throttle_budget', DEFAULT_BUDGET),
+            max_retries=configs.get('throttle_max_retries', DEFAULT_MAX_RETRIES)
+        )
+
+    def start_cycle(self):
+        """
+        Resets the budget and the counters at the start of a cycle. The Retry-After of a throttled 
+        request is still honoured until it expires, even if it started in the previous cycle
+        """
+
+        with self.lock:
+            self.spent = 0
+            self.throttled_count = 0
+            self.retry_count = 0
+
+    def remaining_budget(self):
+        return max(self.budget - self.spent, 0)
+
+    def is_throttled(self):
+        """
+        Returns:
+            bool: True if the caller should slow down because the Microsoft Graph API is throttling requests
+        """
+
+        return time.time() < self.throttled_until
+
+    def get_delay(self, attempt, retry_after=None):
+        """
+        Returns the number of seconds to wait before retrying
+
+        Args:
+            attempt (int): the number of times the request was already retried
+            retry_after (float): the Retry-After of the response, if any
+
+        Returns:
+            float: the Retry-After if given, otherwise a jittered exponential backoff
+        """
+
+        if retry_after is not None:
+            return retry_after
+        # Full jitter, so that threads that were throttled together don't retry together
+        return random.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    def record_retry(self, status_code, delay):
+        """
+        Records a response that is going to be retried after delay seconds
+
+        Args:
+            status_code (int): the status code of the response
+            delay (float): the number of seconds until the retry
+
+        Returns:
+            bool: False if the retry doesn't fit in the remaining budget
+        """
+
+        with self.lock:
+            # Only the time spent waiting counts, not how long the cycle has been running. Every thread waits
+            # until throttled_until, so the waits that overlap it are only charged for the time they add to it
+            now = time.time()
+            extension = max(0, now + delay - max(self.throttled_until, now))
+            if self.spent + extension > self.budget:
+                return False
+            self.spent = self.spent + extension
+            self.retry_count = self.retry_count + 1
+            if status_code == 429:
+                self.throttled_count = self.throttled_count + 1
+            self.throttled_until = max(self.throttled_until, now + delay)
+            return True
+
+    def wait(self):
+        """
+        Blocks until the Microsoft Graph API stops throttling requests
+        """
+
+        delay = self.throttled_until - time.time()
+        if delay > 0:
+            time.sleep(delay)
+
+    def snapshot(self):
+        """
+        Returns:
+            dict: the current state of the throttling
+        """
+
+        with self.lock:
+            return {
+                'throttled': time.time() < self.throttled_until,
+                'throttled_for': max(self.throttled_until - time.time(), 0),
+                'throttled_count': self.throttled_count,
+                'retry_count': self.retry_count,
+                'remaining_budget': max(self.budget - self.spent, 0)
+            }
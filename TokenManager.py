@@ -0,0 +1,154 @@
+import os
+import time
+import threading
+import logging
+from msal import PublicClientApplication, SerializableTokenCache
+import utils
+
+TOKEN_CACHE_FILE = 'token_cache.bin'
+LEGACY_TOKEN_FILE = 'token.txt'
+REFRESH_MARGIN = 600 # Number of seconds before the expiry of the access token that it is refreshed
+MINIMUM_REFRESH_DELAY = 30 # in seconds
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+class TokenManager:
+    """
+    Keeps a valid access token for the Microsoft Graph API in memory. The msal token cache is
+    persisted in vcs_directory so that the refresh token survives restarts, and the access token
+    is refreshed by a background timer ahead of its expiry so that no request has to wait on it
+
+    Attributes
+    ----------
+    app : PublicClientApplication
+        The public client for the msal library
+    scopes : list
+        A list consisting of the Azure permissions
+    cache_path : str
+        The path the SerializableTokenCache is persisted to
+    access_token : str
+        The current access token
+    expires_at : float
+        The time (seconds since epoch) the current access token expires at
+
+    Methods
+    -------
+    get_token
+        Returns a valid access token, acquiring one if needed
+    stop
+        Stops the background refresh
+    """
+
+    def __init__(self, client_id, tenant_id, scopes, vcs_directory, refresh_margin=REFRESH_MARGIN):
+        self.scopes = scopes
+        self.vcs_directory = vcs_directory
+        self.cache_path = vcs_directory + TOKEN_CACHE_FILE
+        self.refresh_margin = refresh_margin
+        self.access_token = None
+        self.expires_at = 0
+        self.lock = threading.RLock()
+        self.timer = None
+
+        self.cache = SerializableTokenCache()
+        if os.path.isfile(self.cache_path):
+            with open(self.cache_path, 'r') as file:
+                self.cache.deserialize(file.read())
+
+        self.app = PublicClientApplication(
+            client_id=client_id,
+            authority=f"https://login.microsoftonline.com/{tenant_id}",
+            token_cache=self.cache
+        )
+
+    @classmethod
+    def from_configs(cls, configs):
+        return cls(configs['client_id'], configs['tenant_id'], configs['scopes'], configs['vcs_directory'])
+
+    def get_token(self):
+        """
+        Returns the access token for the Microsoft Graph API, acquiring a new one
+        if there isn't one yet or if it is about to expire
+
+        Returns:
+            str: the access token for the Microsoft Graph API
+        """
+
+        with self.lock:
+            if self.access_token is None or time.time() >= self.expires_at - MINIMUM_REFRESH_DELAY:
+                self._acquire(interactive=True)
+            return self.access_token
+
+    def stop(self):
+        with self.lock:
+            if self.timer:
+                self.timer.cancel()
+                self.timer = None
+
+    def _acquire(self, interactive, force_refresh=False):
+        """
+        Acquire the access token using the MSAL library
+
+        Args:
+            interactive (bool): whether the device code flow can be used if there is no usable refresh token
+            force_refresh (bool): whether a new access token is requested even if the cached one is still valid
+        """
+
+        result = None
+        accounts = self.app.get_accounts()
+        legacy_token_path = self.vcs_directory + LEGACY_TOKEN_FILE
+        if accounts:
+            logger.debug("Tokens found in cache")
+            result = self.app.acquire_token_silent(self.scopes, accounts[0], force_refresh=force_refresh)
+        elif os.path.isfile(legacy_token_path):
+            # The refresh token written by previous versions is used once to populate the token cache
+            with open(legacy_token_path, "r") as file:
+                logger.debug("Refresh token found")
+                refresh_token = file.readline().strip()
+            result = self.app.acquire_token_by_refresh_token(refresh_token, self.scopes)
+
+        if (not result or "error" in result) and interactive:
+            result = utils.init_device_code_flow(self.app, self.scopes)
+
+        if not result or "access_token" not in result:
+            if result:
+                logger.error(result.get("error"))
+                logger.error(result.get("error_description"))
+                logger.error(result.get("correlation_id"))
+            raise ConnectionError("Unable to retrieve access_token")
+
+        self.access_token = result["access_token"]
+        self.expires_at = time.time() + int(result.get("expires_in", 0))
+        logger.debug(f"Access token acquired, expires in {result.get('expires_in')} seconds")
+
+        self._persist_cache()
+        if os.path.isfile(legacy_token_path):
+            os.remove(legacy_token_path)
+        self._schedule_refresh()
+
+    def _persist_cache(self):
+        if not self.cache.has_state_changed:
+            return
+        # Write to a temporary file first so a crash mid-write can't corrupt the cache
+        temp_path = self.cache_path + '.tmp'
+        with open(os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), 'w') as file:
+            file.write(self.cache.serialize())
+        os.replace(temp_path, self.cache_path)
+        self.cache.has_state_changed = False
+        logger.debug("Writing the token cache into the token cache file")
+
+    def _schedule_refresh(self):
+        if self.timer:
+            self.timer.cancel()
+        delay = max(self.expires_at - self.refresh_margin - time.time(), MINIMUM_REFRESH_DELAY)
+        self.timer = threading.Timer(delay, self._background_refresh)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def _background_refresh(self):
+        with self.lock:
+            try:
+                self._acquire(interactive=False, force_refresh=True)
+            except Exception as e:
+                # get_token falls back on the device code flow if the token can't be refreshed in time
+                logger.warning(f"Unable to refresh the access token in the background: {e}")
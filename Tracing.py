@@ -0,0 +1,211 @@
+import contextvars
+import json
+import os
+import threading
+import time
+import uuid
+import logging
+from contextlib import contextmanager
+
+# This logger is a child of the __main__ logger located in OutlookCalendar.py
+logger = logging.getLogger("__main__." + __name__)
+
+_tracer = None
+_current_span = contextvars.ContextVar('current_span', default=None)
+
+class Span:
+    """
+    A timed operation (a cycle, a window, an http request, ...) nested in the span that was current when it started
+
+    Attributes
+    ----------
+    name : str
+        The name of the operation, e.g. POST /$batch
+    category : str
+        The kind of operation, e.g. cycle, window, chunk, http or sub_request
+    span_id : str
+        The id of the span
+    parent_id : str
+        The id of the span it is nested in, or None
+    trace_id : str
+        The id shared by the span and every span nested in it, i.e. of the cycle
+    client_request_id : str
+        The id sent to the Microsoft Graph API as the client-request-id header of the request of the span
+    args : dict
+        The attributes of the span, e.g. the window or the status of the response
+    """
+
+    def __init__(self, name, category, parent, args, start=None):
+        self.name = name
+        self.category = category
+        self.span_id = uuid.uuid4().hex[:16]
+        self.parent_id = parent.span_id if parent else None
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.client_request_id = str(uuid.uuid4())
+        self.args = args
+        self.start = time.time() if start is None else start
+
+    def set(self, **args):
+        self.args.update(args)
+
+class Tracer:
+    """
+    Writes the spans to a file as JSON lines, one object per span, so the file can be appended to
+    while the program runs and processed line by line. convert_to_chrome turns it into the
+    Chrome trace event format, which chrome://tracing and https://ui.perfetto.dev load
+
+    Attributes
+    ----------
+    path : str
+        The path of the trace file
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.lock = threading.Lock()
+        self.pid = os.getpid()
+        self.file = open(path, 'a')
+
+    def write(self, span, end):
+        record = {
+            'name': span.name,
+            'category': span.category,
+            'start': span.start,
+            'duration': max(end - span.start, 0),
+            'pid': self.pid,
+            'thread_id': threading.get_ident(),
+            'thread_name': threading.current_thread().name,
+            'span_id': span.span_id,
+            'parent_id': span.parent_id,
+            'trace_id': span.trace_id,
+            'client_request_id': span.client_request_id,
+            'args': span.args
+        }
+        line = json.dumps(record, default=str) + "\n"
+        with self.lock:
+            self.file.write(line)
+            self.file.flush()
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+def convert_to_chrome(path, output_path):
+    """
+    Converts a trace file written by Tracer to the Chrome trace event format
+
+    Args:
+        path (str): the path of the trace file
+        output_path (str): the path the Chrome trace is written to
+    """
+
+    events = []
+    threads = set()
+    with open(path, 'r') as file:
+        for line in file:
+            if not line.strip(): continue
+            record = json.loads(line)
+            if (record['pid'], record['thread_id']) not in threads:
+                # Names the row of the thread in the trace viewer
+                threads.add((record['pid'], record['thread_id']))
+                events.append({'name': 'thread_name', 'ph': 'M', 'pid': record['pid'], 'tid': record['thread_id'], 'args': {'name': record['thread_name']}})
+            events.append({
+                'name': record['name'],
+                'cat': record['category'],
+                'ph': 'X',
+                'ts': int(record['start'] * 1000000),
+                'dur': int(record['duration'] * 1000000),
+                'pid': record['pid'],
+                'tid': record['thread_id'],
+                'args': dict(record['args'], span_id=record['span_id'], parent_id=record['parent_id'],
+                    trace_id=record['trace_id'], client_request_id=record['client_request_id'])
+            })
+    with open(output_path, 'w') as file:
+        json.dump(events, file)
+
+def configure(configs):
+    """
+    Starts writing the spans to the trace_file of the configs, if it is set
+
+    Args:
+        configs (dict): the configs as a dict
+    """
+
+    global _tracer
+    if configs.get('trace_file'):
+        _tracer = Tracer(configs['trace_file'])
+        logger.info(f"Writing the trace to {configs['trace_file']}")
+
+def set_tracer(tracer):
+    global _tracer
+    _tracer = tracer
+
+def get_current_span():
+    return _current_span.get()
+
+@contextmanager
+def span(name, category='internal', **args):
+    """
+    Times the code of the with block as a span nested in the current span.
+    The span is current for the code of the with block, including the threads started through bind
+
+    Args:
+        name (str): the name of the operation
+        category (str): the kind of operation
+        args: the attributes of the span
+
+    Yields:
+        Span: the span, whose attributes can be set while it runs
+    """
+
+    current = Span(name, category, _current_span.get(), args)
+    token = _current_span.set(current)
+    try:
+        yield current
+    except BaseException as e:
+        current.set(error=repr(e))
+        raise
+    finally:
+        _current_span.reset(token)
+        if _tracer:
+            _tracer.write(current, time.time())
+
+def record_span(name, category, start, parent=None, client_request_id=None, **args):
+    """
+    Writes a span that started at start and ends now, e.g. a sub-request of a batch,
+    whose sub-response is only known once it is decoded
+
+    Args:
+        name (str): the name of the operation
+        category (str): the kind of operation
+        start (float): the time (seconds since epoch) the operation started at
+        parent (Span): the span it is nested in. Defaults to the current span
+        client_request_id (str): the client-request-id sent with the operation, if it has its own
+        args: the attributes of the span
+    """
+
+    if not _tracer: return
+    recorded = Span(name, category, parent or _current_span.get(), args, start)
+    if client_request_id:
+        recorded.client_request_id = client_request_id
+    _tracer.write(recorded, time.time())
+
+def bind(function):
+    """
+    Returns function bound to the current span, so the spans it starts in another thread
+    (e.g. of a ThreadPoolExecutor) are nested in the current span
+    """
+
+    context = contextvars.copy_context()
+    def run(*args, **kwargs):
+        # Every call gets its own copy, as a context can only be entered by one thread at a time
+        return context.copy().run(function, *args, **kwargs)
+    return run
+
+if __name__ == '__main__':
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert a trace_file to the Chrome trace event format")
+    parser.add_argument('trace_file', help="the trace file written with trace_file set")
+    parser.add_argument('output', help="the file the Chrome trace is written to")
+    args = parser.parse_args()
+    convert_to_chrome(args.trace_file, args.output)
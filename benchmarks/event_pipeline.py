@@ -0,0 +1,183 @@
+"""
+Micro-benchmarks of the cpu-bound stages of the event pipeline, from the scheduleItems of a getSchedule
+response to the batches posted to the shared calendar:
+
+    parse_schedule_items                 the timestamps of the scheduleItems
+    create_event_for_individual_calendars  one call per OOF item, like the per-event path
+    create_events_for_intervals          the bulk expansion used by process_schedules
+    is_AM / is_PM                        the classification of every OOF item
+    filter                               the merge of a member's events of a day
+    create_tuple                         the keys of the filtered events
+    create_batches_for_adding_events     the $batch payloads of the events to add
+    create_batches_for_deleting_events   the $batch payloads of the events to delete
+
+The schedules are synthesized by graph_standin.SyntheticDirectory, and every combination of --members
+and --days is run, so the number of members and the horizon scale independently. Each stage reports
+its best time, its throughput and the peak and retained memory traced while it runs.
+The category lookup of create_batches_for_adding_events is stubbed, so only the payloads are timed
+
+Example: python3 benchmarks/event_pipeline.py --members 100 1000 --days 14 90 --output pipeline.json
+         python3 benchmarks/event_pipeline.py --members 100 1000 --days 14 90 --compare pipeline.json
+"""
+
+import argparse
+import json
+import os
+import platform
+import sys
+import timeit
+import tracemalloc
+from datetime import datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IndividualCalendar
+import SharedCalendar
+from SimpleEvent import SimpleEvent, WorkDay, parse_date_prefix, get_minutes_kind
+from graph_standin import SyntheticDirectory
+
+ACCESS_TOKEN = 'Bearer vcs-bench'
+CALENDAR_ID = 'vcs-bench-calendar'
+CATEGORY_NAME = 'VCS Bench'
+CATEGORY_COLOR = 'preset0'
+WORK_DAY = WorkDay(540, 1020, 720, 780, 120)
+
+def clear_caches():
+    # Every timed run starts cold, as the first cycle of the program does
+    parse_date_prefix.cache_clear()
+    get_minutes_kind.cache_clear()
+
+def create_stages(directory, start_date, end_date, calendar_id):
+    """
+    Prepares the input of every stage from the output of the previous one
+
+    Returns:
+        list: (name, number of items, function) of every stage
+    """
+
+    schedules = [{
+        'scheduleId': directory.email(net_id),
+        'scheduleItems': directory.get_schedule_items(directory.email(net_id), start_date, end_date)
+    } for net_id in directory.net_ids]
+    items = [(member['scheduleId'].split('@')[0], item) for member in schedules for item in member['scheduleItems'] if item['status'] == IndividualCalendar.EVENT_STATUS]
+    intervals = [(net_id, SimpleEvent.make_datetime(item['start']['dateTime']), SimpleEvent.make_datetime(item['end']['dateTime'])) for net_id, item in items]
+    events = SimpleEvent.create_events_for_intervals(intervals, start_date, end_date, WORK_DAY)
+    filtered_events = IndividualCalendar.filter(events)
+    keys = SharedCalendar.create_tuple(filtered_events)
+    event_ids = {key: f"event{index}" for index, key in enumerate(keys)}
+
+    def run_create_event():
+        events = []
+        for net_id, item in items:
+            events.extend(SimpleEvent.create_event_for_individual_calendars(item, start_date, end_date, net_id, WORK_DAY))
+        return events
+
+    def run_is_AM_PM():
+        return [(SimpleEvent.is_AM(start, end, WORK_DAY), SimpleEvent.is_PM(start, end, WORK_DAY)) for _, start, end in intervals]
+
+    n_items = sum(len(member['scheduleItems']) for member in schedules)
+    return [
+        ('parse_schedule_items', n_items, lambda: [SimpleEvent.parse_schedule_items(member['scheduleItems'], IndividualCalendar.EVENT_STATUS) for member in schedules]),
+        ('create_event_for_individual_calendars', len(items), run_create_event),
+        ('create_events_for_intervals', len(intervals), lambda: SimpleEvent.create_events_for_intervals(intervals, start_date, end_date, WORK_DAY)),
+        ('is_AM_is_PM', len(intervals), run_is_AM_PM),
+        ('filter', len(events), lambda: IndividualCalendar.filter(events)),
+        ('create_tuple', len(filtered_events), lambda: SharedCalendar.create_tuple(filtered_events)),
+        ('create_batches_for_adding_events', len(keys), lambda: SharedCalendar.create_batches_for_adding_events(keys, ACCESS_TOKEN, calendar_id, CATEGORY_NAME, CATEGORY_COLOR)),
+        ('create_batches_for_deleting_events', len(keys), lambda: SharedCalendar.create_batches_for_deleting_events(keys, ACCESS_TOKEN, calendar_id, event_ids))
+    ]
+
+def measure(name, n_items, function, repeat):
+    """
+    Times function and traces the memory it allocates
+
+    Returns:
+        dict: the results of the stage
+    """
+
+    def run():
+        clear_caches()
+        function()
+
+    seconds = min(timeit.repeat(run, number=1, repeat=repeat))
+
+    clear_caches()
+    tracemalloc.start()
+    result = function()
+    retained_memory, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+
+    return {
+        'stage': name,
+        'items': n_items,
+        'seconds': seconds,
+        'items_per_second': n_items / seconds if seconds else None,
+        'peak_memory': peak_memory,
+        'retained_memory': retained_memory
+    }
+
+def run(n_members, days, args, calendar_id=CALENDAR_ID):
+    today = datetime.today()
+    today = datetime(year=today.year, month=today.month, day=today.day)
+    directory = SyntheticDirectory(n_members, today, seed=args.seed, days=days)
+    stages = create_stages(directory, today, today + timedelta(days=days), calendar_id)
+    return {
+        'members': n_members,
+        'days': days,
+        'stages': [measure(name, n_items, function, args.repeat) for name, n_items, function in stages]
+    }
+
+def get_previous(previous, results):
+    for previous_results in previous.get('runs', []):
+        if previous_results['members'] == results['members'] and previous_results['days'] == results['days']:
+            return {stage['stage']: stage for stage in previous_results['stages']}
+    return {}
+
+def print_results(results, previous):
+    print(f"{results['members']} members, {results['days']} days")
+    previous_stages = get_previous(previous, results)
+    for stage in results['stages']:
+        line = (f"  {stage['stage']:>38}: {stage['items']:9,d} items  {stage['seconds'] * 1000:9.2f} ms  "
+            f"{stage['items_per_second'] or 0:12,.0f} items/s  {stage['peak_memory'] / 2**20:7.2f} MiB peak")
+        if stage['stage'] in previous_stages:
+            line = line + f"  {previous_stages[stage['stage']]['seconds'] / stage['seconds']:5.2f}x the speed of the previous run"
+        print(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the cpu-bound stages of the event pipeline")
+    parser.add_argument('--members', type=int, nargs='+', default=[100, 1000], help="numbers of members")
+    parser.add_argument('--days', type=int, nargs='+', default=[14, 90], help="horizons in days")
+    parser.add_argument('--repeat', type=int, default=5, help="number of timed runs, the best one is reported")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="file the results are saved to as json")
+    parser.add_argument('--compare', help="json file of a previous run to compare the results with")
+    args = parser.parse_args()
+
+    previous = {}
+    if args.compare:
+        with open(args.compare, 'r') as file:
+            previous = json.load(file)
+
+    # The category is looked up with a Graph call once per cycle, which would otherwise be timed with the payloads
+    runs = []
+    with mock.patch.object(SharedCalendar, 'get_category', return_value=CATEGORY_NAME):
+        for n_members in args.members:
+            for days in args.days:
+                results = run(n_members, days, args)
+                print_results(results, previous)
+                runs.append(results)
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump({
+                'date': datetime.now().isoformat(timespec='seconds'),
+                'python': platform.python_version(),
+                'repeat': args.repeat,
+                'seed': args.seed,
+                'runs': runs
+            }, file, indent=4)
+
+if __name__ == '__main__':
+    main()
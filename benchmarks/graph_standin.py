@@ -0,0 +1,534 @@
+"""
+A local stand-in for the Microsoft Graph API and the ldap server, used to run complete sync cycles
+without a tenant. It either synthesizes a directory of members with realistic vacation patterns,
+or replays the exchanges recorded by sync_cycle.py record. Latency and throttling can be injected
+"""
+
+import json
+import multiprocessing
+import random
+import re
+import threading
+import time
+import uuid
+from datetime import datetime, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs, urlencode, unquote
+from urllib.request import Request, urlopen
+
+LDAP_SEARCH_BASE = 'dc=ncsa,dc=illinois,dc=edu'
+EMAIL_DOMAIN = 'illinois.edu'
+FILTER_TERM = re.compile(r"\((cn|uid)=([^)]*)\)", re.IGNORECASE)
+FILTER_ESCAPE = re.compile(r"\\([0-9a-fA-F]{2})")
+MODIFIED_TERM = re.compile(r"\(modifyTimestamp>=([^)]*)\)", re.IGNORECASE)
+
+class SyntheticDirectory:
+    """
+    A deterministic directory of n_members members, each with days worth of vacation days, half days,
+    multiday leaves and ordinary meetings after base_date (and a month before it)
+    """
+
+    def __init__(self, n_members, base_date=None, seed=0, group_name='vcs-bench', days=365):
+        self.group_name = group_name
+        self.days = days
+        self.base_date = base_date or datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        self.net_ids = [f"user{i:05d}" for i in range(n_members)]
+        self.schedules = {net_id: self._create_schedule(random.Random(f"{seed}:{net_id}")) for net_id in self.net_ids}
+
+    def email(self, net_id):
+        return f"{net_id}@{EMAIL_DOMAIN}"
+
+    def _create_schedule(self, rng):
+        items = []
+        for offset in range(-30, self.days):
+            day = self.base_date + timedelta(days=offset)
+            if day.weekday() >= 5: continue
+            roll = rng.random()
+            if roll < 0.04:
+                items.append(('oof', day, day + timedelta(days=1)))
+            elif roll < 0.06:
+                items.append(('oof', day.replace(hour=8), day.replace(hour=12)))
+            elif roll < 0.08:
+                items.append(('oof', day.replace(hour=13), day.replace(hour=17)))
+            elif roll < 0.085:
+                # A multiday leave, sometimes starting or ending in the middle of a day
+                start = day.replace(hour=rng.choice([0, 0, 10]))
+                end = start + timedelta(days=rng.randint(2, 15), hours=rng.choice([0, 0, 6]))
+                items.append(('oof', start, end))
+            for _ in range(rng.randint(0, 3)):
+                start = day.replace(hour=rng.randint(8, 16), minute=rng.choice([0, 30]))
+                items.append((rng.choice(['busy', 'busy', 'tentative']), start, start + timedelta(minutes=rng.choice([30, 60, 90]))))
+        return items
+
+    def get_schedule_items(self, email, start_date, end_date):
+        items = []
+        for status, start, end in self.schedules.get(email.split('@')[0], []):
+            if start < end_date and end > start_date:
+                items.append({
+                    'isPrivate': False,
+                    'status': status,
+                    'subject': 'Out of office' if status == 'oof' else 'Meeting',
+                    'location': '',
+                    'isMeeting': status != 'oof',
+                    'isRecurring': False,
+                    'isException': False,
+                    'isReminderSet': True,
+                    'start': {'dateTime': start.strftime("%Y-%m-%dT%H:%M:%S.0000000"), 'timeZone': 'Central Standard Time'},
+                    'end': {'dateTime': end.strftime("%Y-%m-%dT%H:%M:%S.0000000"), 'timeZone': 'Central Standard Time'}
+                })
+        return items
+
+    def get_ldap_entries(self):
+        """
+        Returns:
+            list: (dn, attributes) of the group and of its members
+        """
+
+        entries = [(f"cn={self.group_name},ou=groups,{LDAP_SEARCH_BASE}", {
+            'objectClass': ['groupOfUniqueNames'],
+            'cn': self.group_name,
+            'modifyTimestamp': '20240101000000Z',
+            'uniqueMember': [f"uid={net_id},ou=people,{LDAP_SEARCH_BASE}" for net_id in self.net_ids]
+        })]
+        for net_id in self.net_ids:
+            entries.append((f"uid={net_id},ou=people,{LDAP_SEARCH_BASE}", {
+                'objectClass': ['inetOrgPerson'],
+                'uid': net_id,
+                'mail': self.email(net_id),
+                'modifyTimestamp': '20240101000000Z'
+            }))
+        return entries
+
+class LdapStandIn:
+    """
+    An in-memory ldap server holding the given entries. The entries are indexed by their cn and uid,
+    so that the OR filters of utils.search_uids are answered in time proportional to the uids
+    searched for, like a real ldap server would (the MOCK_SYNC strategy of ldap3 evaluates
+    every filter against every entry, which dominates the cycle of a large directory)
+
+    Attributes
+    ----------
+    entries : dict
+        (attribute, value) of the cn or uid to the attributes of an entry
+    connections : int
+        The number of connections opened
+    searches : int
+        The number of searches made
+    """
+
+    def __init__(self, entries):
+        self.entries = {}
+        for dn, attributes in entries:
+            attribute, value = dn.split(',')[0].split('=', 1)
+            self.entries[(attribute.lower(), value)] = {name: value if isinstance(value, list) else [value] for name, value in attributes.items()}
+        self.connections = 0
+        self.searches = 0
+
+    @classmethod
+    def from_index(cls, index):
+        """
+        Creates the entries from a recorded membership index (see MembershipIndex)
+        """
+
+        entries = []
+        for group_name, group in index['groups'].items():
+            entries.append((f"cn={group_name},ou=groups,{LDAP_SEARCH_BASE}", {
+                'objectClass': ['groupOfUniqueNames'],
+                'cn': group_name,
+                'modifyTimestamp': group['modifyTimestamp'] or '20240101000000Z',
+                'uniqueMember': [f"uid={uid},ou=people,{LDAP_SEARCH_BASE}" for uid in group['members']]
+                    + [f"cn={subgroup},ou=groups,{LDAP_SEARCH_BASE}" for subgroup in group['subgroups']]
+            }))
+        for uid, user in index['users'].items():
+            entries.append((f"uid={uid},ou=people,{LDAP_SEARCH_BASE}", {
+                'objectClass': ['inetOrgPerson'],
+                'uid': uid,
+                'mail': user['mail'],
+                'modifyTimestamp': user['modifyTimestamp'] or '20240101000000Z'
+            }))
+        return cls(entries)
+
+    def open_connection(self):
+        """
+        A replacement for utils.open_ldap_connection
+        """
+
+        self.connections = self.connections + 1
+        return LdapConnection(self)
+
+    def search(self, search_filter, attributes):
+        """
+        Answers a filter made of (cn=...) and (uid=...) terms, optionally ORed together,
+        and optionally ANDed with a (modifyTimestamp>=...) term
+
+        Returns:
+            list: the requested attributes of the matching entries
+        """
+
+        self.searches = self.searches + 1
+        results = []
+        modified = MODIFIED_TERM.search(search_filter)
+        for attribute, value in FILTER_TERM.findall(search_filter):
+            entry = self.entries.get((attribute.lower(), FILTER_ESCAPE.sub(lambda match: chr(int(match.group(1), 16)), value)))
+            if entry is None: continue
+            if modified and entry.get('modifyTimestamp', [''])[0] < modified.group(1): continue
+            results.append({name: entry[name] for name in attributes if name in entry})
+        return results
+
+class LdapEntry:
+    def __init__(self, attributes):
+        self.entry_attributes_as_dict = attributes
+
+class LdapConnection:
+    """
+    The part of the interface of ldap3.Connection used by MembershipIndex and utils.search_uids
+    """
+
+    def __init__(self, standin):
+        self.standin = standin
+        self.entries = []
+        self.extend = self
+        self.standard = self
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        pass
+
+    def bind(self):
+        return True
+
+    def search(self, search_base, search_filter, search_scope=None, attributes=None):
+        self.entries = [LdapEntry(attributes) for attributes in self.standin.search(search_filter, attributes or [])]
+        return len(self.entries) > 0
+
+    def paged_search(self, search_base, search_filter, search_scope=None, attributes=None, paged_size=None, generator=True):
+        for attributes in self.standin.search(search_filter, attributes or []):
+            yield {'type': 'searchResEntry', 'attributes': attributes}
+
+class GraphStandIn:
+    """
+    A local HTTP server answering the Microsoft Graph API calls made by a sync cycle:
+    getSchedule, $batch, the calendars, events, calendarView/delta and masterCategories endpoints,
+    sendMail and subscriptions. Every request can be delayed by latency seconds and
+    throttled (429 with a Retry-After) with probability throttle_rate
+
+    Attributes
+    ----------
+    directory : SyntheticDirectory
+        The members whose schedules are synthesized, or None when replaying
+    recording : dict
+        (method, path, body) to the recorded responses that are replayed in order, or None
+    counts : dict
+        route to the number of requests (and $batch sub-requests) received. 'http' counts the http requests
+    process : multiprocessing.Process
+        The process serving the requests when started with start_process, or None
+    """
+
+    def __init__(self, directory=None, recording=None, latency=0, throttle_rate=0, retry_after=1, seed=0, shared_calendar_name='VCS Bench'):
+        self.directory = directory
+        self.recording = recording
+        self.latency = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.lock = threading.Lock()
+        self.counts = {}
+        self.calendar_id = 'vcs-bench-calendar'
+        self.calendars = [{'id': self.calendar_id, 'name': shared_calendar_name}]
+        self.events = {} # event id to event
+        self.changes = [] # (version, event id) of every created or deleted event, for delta queries
+        self.categories = []
+        self.subscriptions = {}
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), self._create_handler())
+        self.server.daemon_threads = True
+        self.process = None
+
+    @classmethod
+    def from_recording(cls, path, **kwargs):
+        """
+        Loads the exchanges recorded by RecordingGraphClient
+        """
+
+        recording = {}
+        with open(path, 'r') as file:
+            for line in file:
+                exchange = json.loads(line)
+                recording.setdefault(cls._key(exchange['method'], exchange['path'], exchange['body']), []).append(exchange)
+        return cls(recording=recording, **kwargs)
+
+    @staticmethod
+    def _key(method, path, body):
+        return (method, path, json.dumps(body, sort_keys=True) if body is not None else None)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_address[1]}/v1.0"
+
+    def start(self):
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self
+
+    def start_process(self):
+        """
+        Serves the requests from a forked process instead of a thread, so that the cpu time and the memory
+        of the stand-in are kept out of the measurements of the process under test
+        """
+
+        self.process = multiprocessing.get_context('fork').Process(target=self._serve_process, daemon=True)
+        self.process.start()
+        return self
+
+    def _serve_process(self):
+        # The forked process holds the state itself
+        self.process = None
+        self.server.serve_forever()
+
+    def stop(self):
+        if self.process:
+            self.process.terminate()
+            self.process.join()
+        else:
+            self.server.shutdown()
+        self.server.server_close()
+
+    def _control(self, method):
+        # The state of a stand-in started with start_process lives in the forked process
+        request = Request(self.url.rsplit('/', 1)[0] + '/_standin', method=method)
+        with urlopen(request) as response:
+            return json.loads(response.read())
+
+    def get_stats(self):
+        """
+        Returns:
+            dict: the counts of the requests received and the number of events of the shared calendar
+        """
+
+        if self.process:
+            return self._control('GET')
+        with self.lock:
+            return {'counts': dict(self.counts), 'events': len(self.events)}
+
+    def reset_counts(self):
+        if self.process:
+            self._control('DELETE')
+            return
+        with self.lock:
+            self.counts = {}
+
+    def _count(self, route):
+        with self.lock:
+            self.counts[route] = self.counts.get(route, 0) + 1
+
+    def _throttled(self):
+        if self.throttle_rate and self.rng.random() < self.throttle_rate:
+            return {'status': 429, 'headers': {'Retry-After': str(self.retry_after)}, 'body': {'error': {'code': 'TooManyRequests'}}}
+        return None
+
+    # Routing
+
+    def handle(self, method, path, body, top_level=True):
+        """
+        Answers a request or a $batch sub-request
+
+        Returns:
+            dict: {'status', 'headers', 'body'}
+        """
+
+        parsed = urlparse(path)
+        route = parsed.path[len('/v1.0'):] if parsed.path.startswith('/v1.0') else parsed.path
+        query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+        relative = route + ('?' + parsed.query if parsed.query else '')
+
+        throttled = self._throttled()
+        if throttled and not (top_level and route == '/$batch'):
+            self._count('throttled')
+            return throttled
+
+        if route == '/$batch':
+            self._count('$batch')
+            return {'status': 200, 'headers': {}, 'body': {'responses': [
+                dict(id=request['id'], **self.handle(request['method'], '/v1.0' + request['url'], request.get('body'), top_level=False))
+                for request in body['requests']
+            ]}}
+
+        if self.recording is not None:
+            return self._replay(method, relative, body)
+
+        parts = route.strip('/').split('/')
+        if route == '/me/calendar/getSchedule':
+            self._count('getSchedule')
+            return self._get_schedule(body)
+        if route == '/me/calendars':
+            self._count('calendars')
+            return {'status': 200, 'headers': {}, 'body': {'value': self.calendars}}
+        if route == '/me/outlook/masterCategories':
+            self._count('masterCategories')
+            if method == 'POST':
+                self.categories.append(body)
+                return {'status': 201, 'headers': {}, 'body': body}
+            return {'status': 200, 'headers': {}, 'body': {'value': self.categories}}
+        if route == '/me/sendMail':
+            self._count('sendMail')
+            return {'status': 202, 'headers': {}, 'body': None}
+        if parts[0] == 'subscriptions':
+            self._count('subscriptions')
+            return self._subscription(method, parts, body)
+        if len(parts) >= 4 and parts[:2] == ['me', 'calendars'] and parts[3] == 'events':
+            self._count(method + ' events')
+            if method == 'GET' and len(parts) == 4:
+                return self._list_events(query, relative)
+            if method == 'POST':
+                return self._create_event(body)
+            if method == 'DELETE':
+                return self._delete_event(parts[4])
+        if len(parts) == 5 and parts[3:] == ['calendarView', 'delta']:
+            self._count('delta')
+            return self._delta(query)
+        self._count('unknown')
+        return {'status': 404, 'headers': {}, 'body': {'error': {'code': 'ResourceNotFound', 'message': route}}}
+
+    def _replay(self, method, path, body):
+        key = self._key(method, path, body)
+        with self.lock:
+            exchanges = self.recording.get(key)
+            if not exchanges:
+                self.counts['unrecorded'] = self.counts.get('unrecorded', 0) + 1
+                return {'status': 404, 'headers': {}, 'body': {'error': {'code': 'NotRecorded', 'message': path}}}
+            # The recorded responses of a request are replayed in order, and the last one is repeated
+            exchange = exchanges.pop(0) if len(exchanges) > 1 else exchanges[0]
+            route = method + ' ' + urlparse(path).path
+            self.counts[route] = self.counts.get(route, 0) + 1
+
+        body = exchange['response']
+        if isinstance(body, dict):
+            # The recorded paging and delta links point at the server the exchanges were recorded from
+            body = dict(body)
+            for key in ('@odata.nextLink', '@odata.deltaLink'):
+                if key in body and body[key].startswith(exchange['base_url']):
+                    body[key] = self.url + body[key][len(exchange['base_url']):]
+        return {'status': exchange['status'], 'headers': exchange.get('headers', {}), 'body': body}
+
+    # Synthesized endpoints
+
+    def _get_schedule(self, body):
+        start_date = datetime.strptime(body['startTime']['dateTime'][:19], "%Y-%m-%dT%H:%M:%S")
+        end_date = datetime.strptime(body['endTime']['dateTime'][:19], "%Y-%m-%dT%H:%M:%S")
+        value = []
+        for email in body['schedules']:
+            value.append({
+                'scheduleId': email,
+                'availabilityView': '',
+                'scheduleItems': self.directory.get_schedule_items(email, start_date, end_date),
+                'workingHours': {}
+            })
+        return {'status': 200, 'headers': {}, 'body': {'@odata.context': 'https://graph.microsoft.com/v1.0/$metadata#Collection(microsoft.graph.scheduleInformation)', 'value': value}}
+
+    def _create_event(self, body):
+        with self.lock:
+            event = dict(body, id=uuid.uuid4().hex)
+            self.events[event['id']] = event
+            self.changes.append((len(self.changes) + 1, event['id']))
+        return {'status': 201, 'headers': {}, 'body': event}
+
+    def _delete_event(self, event_id):
+        with self.lock:
+            if self.events.pop(event_id, None) is None:
+                return {'status': 404, 'headers': {}, 'body': {'error': {'code': 'ErrorItemNotFound'}}}
+            self.changes.append((len(self.changes) + 1, event_id))
+        return {'status': 204, 'headers': {}, 'body': None}
+
+    def _events_between(self, start, end):
+        with self.lock:
+            events = list(self.events.values())
+        return sorted((event for event in events if start <= event['start']['dateTime'][:len(start)] < end), key=lambda event: event['start']['dateTime'])
+
+    def _page(self, items, query, path, skip_key='$skip'):
+        top = int(query.get('$top', 400))
+        skip = int(query.get(skip_key, 0))
+        page = {'value': items[skip : skip + top]}
+        if skip + top < len(items):
+            parsed = urlparse(path)
+            next_query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+            next_query[skip_key] = str(skip + top)
+            page['@odata.nextLink'] = self.url + parsed.path + '?' + urlencode(next_query)
+        return page
+
+    def _list_events(self, query, path):
+        # Only the filter used by SharedCalendar.iterate_shared_calendar is understood
+        filter = unquote(query.get('$filter', ''))
+        dates = [part.split("'")[1] for part in filter.split(' and ')] if filter else ['0000', '9999']
+        events = self._events_between(dates[0], dates[1])
+        return {'status': 200, 'headers': {}, 'body': self._page(events, query, path)}
+
+    def _delta(self, query):
+        with self.lock:
+            version = len(self.changes)
+        if '$deltatoken' in query:
+            since = int(query['$deltatoken'])
+            with self.lock:
+                changed = dict.fromkeys(event_id for change_version, event_id in self.changes if change_version > since)
+                events = [self.events.get(event_id, {'id': event_id, '@removed': {'reason': 'deleted'}}) for event_id in changed]
+        else:
+            events = self._events_between(query['startDateTime'], query['endDateTime'])
+        base = f"{self.url}/me/calendars/{self.calendar_id}/calendarView/delta?"
+        body = {'value': events, '@odata.deltaLink': base + urlencode({'$deltatoken': version})}
+        return {'status': 200, 'headers': {}, 'body': body}
+
+    def _subscription(self, method, parts, body):
+        if method == 'POST':
+            subscription = dict(body, id=uuid.uuid4().hex)
+            self.subscriptions[subscription['id']] = subscription
+            return {'status': 201, 'headers': {}, 'body': subscription}
+        if len(parts) < 2 or parts[1] not in self.subscriptions:
+            return {'status': 404, 'headers': {}, 'body': {'error': {'code': 'ResourceNotFound'}}}
+        if method == 'DELETE':
+            del self.subscriptions[parts[1]]
+            return {'status': 204, 'headers': {}, 'body': None}
+        self.subscriptions[parts[1]].update(body or {})
+        return {'status': 200, 'headers': {}, 'body': self.subscriptions[parts[1]]}
+
+    def _create_handler(self):
+        standin = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, format, *args):
+                pass
+
+            def _handle(self, method):
+                length = int(self.headers.get('Content-Length', 0))
+                body = json.loads(self.rfile.read(length)) if length else None
+                if self.path == '/_standin':
+                    if method == 'DELETE':
+                        standin.reset_counts()
+                    response = {'status': 200, 'headers': {}, 'body': standin.get_stats()}
+                else:
+                    standin._count('http')
+                    if standin.latency:
+                        time.sleep(standin.latency)
+                    response = standin.handle(method, self.path, body)
+                data = json.dumps(response['body']).encode() if response['body'] is not None else b''
+                self.send_response(response['status'])
+                for name, value in response['headers'].items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                self._handle('GET')
+
+            def do_POST(self):
+                self._handle('POST')
+
+            def do_PATCH(self):
+                self._handle('PATCH')
+
+            def do_DELETE(self):
+                self._handle('DELETE')
+
+        return Handler
@@ -0,0 +1,78 @@
+"""
+Micro-benchmark of the parsing of the timestamps of getSchedule responses. 
+Compares the previous split + strptime parsing with SimpleEvent.make_datetime 
+and the bulk SimpleEvent.parse_schedule_items
+
+Example: python3 benchmarks/parse_timestamps.py --items 20000 --repeat 5
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SimpleEvent import SimpleEvent, parse_date_prefix
+
+def strptime_datetime(date):
+    # The parsing used before the fast path of SimpleEvent.make_datetime
+    if "T" in date:
+        return datetime.strptime(date.split('.')[0], "%Y-%m-%dT%H:%M:%S")
+    return datetime.strptime(date, "%Y-%m-%d")
+
+def create_schedule_items(n_items, days_out, seed=0):
+    """
+    Creates n_items scheduleItems spread over days_out days, shaped like the ones of a getSchedule response
+    """
+
+    rng = random.Random(seed)
+    today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+    items = []
+    for _ in range(n_items):
+        start = today + timedelta(days=rng.randrange(days_out), minutes=rng.randrange(0, 24 * 60, 30))
+        end = start + timedelta(minutes=rng.randrange(30, 3 * 24 * 60, 30))
+        items.append({
+            'status': rng.choice(['oof', 'oof', 'busy', 'tentative']),
+            'start': {'dateTime': start.strftime("%Y-%m-%dT%H:%M:%S.0000000"), 'timeZone': 'Central Standard Time'},
+            'end': {'dateTime': end.strftime("%Y-%m-%dT%H:%M:%S.0000000"), 'timeZone': 'Central Standard Time'}
+        })
+    return items
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the parsing of getSchedule timestamps")
+    parser.add_argument('--items', type=int, default=20000, help="number of scheduleItems")
+    parser.add_argument('--days', type=int, default=60, help="number of days the items are spread over")
+    parser.add_argument('--repeat', type=int, default=5, help="number of timed runs, the best one is reported")
+    args = parser.parse_args()
+
+    items = create_schedule_items(args.items, args.days)
+
+    # Both paths have to agree before their speed is compared
+    for item in items:
+        for field in ('start', 'end'):
+            assert strptime_datetime(item[field]['dateTime']) == SimpleEvent.make_datetime(item[field]['dateTime'])
+
+    def run_strptime():
+        return [(strptime_datetime(item['start']['dateTime']), strptime_datetime(item['end']['dateTime'])) for item in items]
+
+    def run_make_datetime():
+        return [(SimpleEvent.make_datetime(item['start']['dateTime']), SimpleEvent.make_datetime(item['end']['dateTime'])) for item in items]
+
+    def run_bulk():
+        return SimpleEvent.parse_schedule_items(items)
+
+    results = {}
+    for name, function in (('strptime', run_strptime), ('make_datetime', run_make_datetime), ('parse_schedule_items', run_bulk)):
+        parse_date_prefix.cache_clear()
+        results[name] = min(timeit.repeat(function, number=1, repeat=args.repeat))
+
+    baseline = results['strptime']
+    print(f"{args.items} scheduleItems ({2 * args.items} timestamps) over {args.days} days, best of {args.repeat}")
+    for name, seconds in results.items():
+        print(f"{name:>22}: {seconds * 1000:8.2f} ms  {2 * args.items / seconds:12,.0f} timestamps/s  {baseline / seconds:5.1f}x")
+
+if __name__ == '__main__':
+    main()
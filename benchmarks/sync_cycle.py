@@ -0,0 +1,299 @@
+"""
+End-to-end benchmark of complete sync cycles (membership lookup, individual calendar retrieval,
+shared calendar read and update) against the local Graph and ldap stand-ins of graph_standin.py.
+Reports the wall time, the number of requests and the peak of the traced memory of a cold cycle
+(empty state, empty shared calendar) and of a steady-state cycle (nothing changed since the previous one).
+The Graph stand-in is served from a forked process so it doesn't weigh on the measurements
+
+    run      synthesizes a directory of every size given by --members and syncs it
+    record   runs one cycle against the real tenant of VCS_CONFIG and records its Graph and ldap exchanges.
+             The cycle updates the real shared calendar like -m would
+    replay   runs the recorded cycle against the stand-ins
+
+Example: python3 benchmarks/sync_cycle.py run --members 10 100 1000 --output sync_cycle.json
+"""
+
+import argparse
+import json
+import logging
+import os
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import yaml
+import utils
+import OutlookCalendar
+from GraphClient import GraphClient, get_graph_client, set_graph_client
+from StateStore import StateStore
+from MembershipIndex import MembershipIndex
+from graph_standin import GraphStandIn, LdapStandIn, SyntheticDirectory
+
+ACCESS_TOKEN = 'Bearer vcs-bench'
+EXCHANGES_FILE = 'exchanges.jsonl'
+INDEX_FILE = 'membership_index.json'
+CYCLE_FILE = 'cycle.json'
+
+# The keys of the configs that shape the requests of a cycle, and are kept with a recording
+RECORDED_KEYS = OutlookCalendar.TARGET_KEYS + (
+    'targets', 'fetch_mode', 'max_in_flight', 'max_batch_concurrency', 'shared_calendar_sync', 'shared_calendar_refresh_interval',
+    'start_of_work_day', 'end_of_work_day', 'start_of_lunch', 'end_of_lunch', 'duration', 'email_list_update_interval', 'days_out'
+)
+
+class RecordingGraphClient(GraphClient):
+    """
+    A GraphClient that appends every exchange with the Microsoft Graph API to a jsonl file.
+    The sub-requests of a $batch are recorded as exchanges of their own, so that they can be
+    replayed whatever batch they end up in
+    """
+
+    def __init__(self, path, **kwargs):
+        super().__init__(**kwargs)
+        self.file = open(path, 'w')
+        self.lock = threading.Lock()
+
+    def request(self, method, endpoint, access_token, headers=None, retry=True, **kwargs):
+        response = super().request(method, endpoint, access_token, headers, retry, **kwargs)
+        # Reading the content up front keeps the response usable by the caller, streamed or not
+        content = response.content
+        body = kwargs.get('json')
+        if kwargs.get('data'):
+            body = json.loads(kwargs['data'])
+        path = response.request.url[len(self.base_url):]
+
+        exchanges = []
+        if path == '/$batch' and response.status_code == 200:
+            sub_responses = {sub_response['id']: sub_response for sub_response in json.loads(content)['responses']}
+            for sub_request in body['requests']:
+                sub_response = sub_responses[sub_request['id']]
+                exchanges.append(self._exchange(sub_request['method'], sub_request['url'], sub_request.get('body'), sub_response['status'], sub_response.get('headers', {}), sub_response.get('body')))
+        else:
+            exchanges.append(self._exchange(method, path, body, response.status_code, response.headers, json.loads(content) if content else None))
+
+        with self.lock:
+            for exchange in exchanges:
+                self.file.write(json.dumps(exchange) + '\n')
+        return response
+
+    def _exchange(self, method, path, body, status, headers, response):
+        headers = {'Retry-After': headers['Retry-After']} if 'Retry-After' in headers else {}
+        return {'base_url': self.base_url, 'method': method, 'path': path, 'body': body, 'status': status, 'headers': headers, 'response': response}
+
+    def close(self):
+        super().close()
+        self.file.close()
+
+def configure(configs, directory):
+    """
+    Writes configs to a configuration file in directory and makes it the configuration of utils.get_configurations
+    """
+
+    path = os.path.join(directory, 'config.yaml')
+    with open(path, 'w') as file:
+        yaml.safe_dump(configs, file)
+    os.environ['VCS_CONFIG'] = path
+    utils._configuration = utils.Configuration(path)
+    return utils.get_configurations()
+
+def create_configs(directory, graph_url, group_name, shared_calendar_name, args):
+    return {
+        'client_id': 'vcs-bench',
+        'tenant_id': 'vcs-bench',
+        'recipient_email': 'vcs-bench@illinois.edu',
+        'scopes': ['User.Read'],
+        'vcs_directory': directory + os.sep,
+        'graph_url': graph_url,
+        'group_name': group_name,
+        'shared_calendar_name': shared_calendar_name,
+        'category_name': 'VCS Bench',
+        'category_color': 'preset0',
+        'start_of_work_day': 540,
+        'end_of_work_day': 1020,
+        'start_of_lunch': 720,
+        'end_of_lunch': 780,
+        'duration': 120,
+        'days_out': args.days,
+        'update_interval': 900,
+        'email_list_update_interval': 1440,
+        'fetch_mode': args.fetch_mode,
+        'max_in_flight': args.max_in_flight,
+        'shared_calendar_sync': args.shared_calendar_sync,
+        'throttle_budget': 3600
+    }
+
+def run_cycle(configs, start_date, end_date, state_store, membership_index):
+    targets = OutlookCalendar.get_targets_members(configs, membership_index)
+    get_graph_client().throttle.start_cycle()
+    OutlookCalendar.retrieve_and_update_calendars(configs, start_date, end_date, targets, ACCESS_TOKEN, state_store)
+
+def measure(name, graph, ldap, cycle):
+    """
+    Runs cycle once, tracing its memory
+
+    Returns:
+        dict: the wall time, the peak of the traced memory and the requests received by the stand-ins
+    """
+
+    graph.reset_counts()
+    ldap.connections = 0
+    ldap.searches = 0
+    tracemalloc.start()
+    start = time.perf_counter()
+    try:
+        cycle()
+    finally:
+        wall_time = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    counts = graph.get_stats()['counts']
+    result = {
+        'cycle': name,
+        'wall_time': round(wall_time, 3),
+        'peak_memory': peak,
+        'requests': dict(sorted(counts.items())),
+        'ldap_connections': ldap.connections,
+        'ldap_searches': ldap.searches
+    }
+    print(f"  {name:<8} {wall_time:8.2f} s  {counts.get('http', 0):6d} http requests  "
+        f"{peak / 2**20:8.1f} MiB peak  {ldap.searches} ldap searches")
+    return result
+
+def run_synthetic(n_members, args):
+    print(f"{n_members} members, {args.days} days, fetch_mode={args.fetch_mode}, shared_calendar_sync={args.shared_calendar_sync}")
+    today = datetime.today()
+    today = datetime(year=today.year, month=today.month, day=today.day)
+    directory = SyntheticDirectory(n_members, today, seed=args.seed)
+    ldap = LdapStandIn(directory.get_ldap_entries())
+    graph = GraphStandIn(directory, latency=args.latency_ms / 1000, throttle_rate=args.throttle_rate, seed=args.seed).start_process()
+    utils.open_ldap_connection = ldap.open_connection
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        configs = configure(create_configs(work_directory, graph.url, directory.group_name, 'VCS Bench', args), work_directory)
+        graph_client = GraphClient.from_configs(configs)
+        set_graph_client(graph_client)
+        state_store = StateStore.from_configs(configs)
+        membership_index = MembershipIndex.from_configs(configs)
+        end_date = today + timedelta(days=args.days)
+
+        cycle = lambda: run_cycle(configs, today, end_date, state_store, membership_index)
+        results = [measure('cold', graph, ldap, cycle), measure('steady', graph, ldap, cycle)]
+        state_store.connection.close()
+        graph_client.close()
+
+    events = graph.get_stats()['events']
+    graph.stop()
+    return {'members': n_members, 'days': args.days, 'fetch_mode': args.fetch_mode, 'shared_calendar_sync': args.shared_calendar_sync,
+        'latency_ms': args.latency_ms, 'throttle_rate': args.throttle_rate, 'events': events, 'cycles': results}
+
+def record(args):
+    """
+    Runs one cycle against the real tenant and ldap server of VCS_CONFIG, starting from an empty
+    state store and membership index, and records it in args.recording
+    """
+
+    configs = utils.get_configurations()
+    from TokenManager import TokenManager
+    token_manager = TokenManager.from_configs(configs)
+    os.makedirs(args.recording, exist_ok=True)
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        cycle_configs = dict(configs, vcs_directory=work_directory + os.sep)
+        graph_client = RecordingGraphClient(os.path.join(args.recording, EXCHANGES_FILE), base_url=configs.get('graph_url', 'https://graph.microsoft.com/v1.0'))
+        graph_client.token_provider = token_manager.get_token
+        set_graph_client(graph_client)
+        state_store = StateStore.from_configs(cycle_configs)
+        membership_index = MembershipIndex.from_configs(cycle_configs)
+
+        start_date, end_date = get_dates(args, configs)
+        run_cycle(cycle_configs, start_date, end_date, state_store, membership_index)
+        state_store.connection.close()
+        graph_client.close()
+
+    with open(os.path.join(args.recording, INDEX_FILE), 'w') as file:
+        json.dump({'groups': membership_index.groups, 'users': membership_index.users}, file)
+    with open(os.path.join(args.recording, CYCLE_FILE), 'w') as file:
+        json.dump({
+            'start_date': str(start_date.date()),
+            'end_date': str(end_date.date()),
+            'configs': {key: configs[key] for key in RECORDED_KEYS if key in configs}
+        }, file, indent=4)
+    print(f"Recorded the cycle from {start_date.date()} to {end_date.date()} in {args.recording}")
+
+def replay(args):
+    with open(os.path.join(args.recording, CYCLE_FILE), 'r') as file:
+        cycle_info = json.load(file)
+    with open(os.path.join(args.recording, INDEX_FILE), 'r') as file:
+        ldap = LdapStandIn.from_index(json.load(file))
+    graph = GraphStandIn.from_recording(os.path.join(args.recording, EXCHANGES_FILE), latency=args.latency_ms / 1000, throttle_rate=args.throttle_rate, seed=args.seed).start_process()
+    utils.open_ldap_connection = ldap.open_connection
+
+    with tempfile.TemporaryDirectory() as work_directory:
+        configs = create_configs(work_directory, graph.url, None, None, args)
+        configs.update(cycle_info['configs'])
+        configs = configure(configs, work_directory)
+        graph_client = GraphClient.from_configs(configs)
+        set_graph_client(graph_client)
+        state_store = StateStore.from_configs(configs)
+        membership_index = MembershipIndex.from_configs(configs)
+        start_date = datetime.strptime(cycle_info['start_date'], "%Y-%m-%d")
+        end_date = datetime.strptime(cycle_info['end_date'], "%Y-%m-%d")
+
+        print(f"Replaying the cycle from {start_date.date()} to {end_date.date()}")
+        result = measure('replay', graph, ldap, lambda: run_cycle(configs, start_date, end_date, state_store, membership_index))
+        state_store.connection.close()
+        graph_client.close()
+
+    graph.stop()
+    if result['requests'].get('unrecorded'):
+        print(f"  {result['requests']['unrecorded']} requests were not part of the recording")
+    return result
+
+def get_dates(args, configs):
+    if args.start_date:
+        return (datetime.strptime(args.start_date, "%Y-%m-%d"), datetime.strptime(args.end_date, "%Y-%m-%d"))
+    today = datetime.today()
+    today = datetime(year=today.year, month=today.month, day=today.day)
+    return (today, today + timedelta(days=configs['days_out']))
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmarks complete sync cycles against local Graph and ldap stand-ins')
+    parser.add_argument('mode', choices=['run', 'record', 'replay'])
+    parser.add_argument('--members', type=int, nargs='+', default=[10, 100, 1000], help='run: the sizes of the synthetic directories')
+    parser.add_argument('--days', type=int, default=14, help='run: the number of days synced')
+    parser.add_argument('--fetch-mode', default='batch', choices=['serial', 'concurrent', 'batch'])
+    parser.add_argument('--max-in-flight', type=int, default=4)
+    parser.add_argument('--shared-calendar-sync', default='full', choices=['full', 'delta', 'store'])
+    parser.add_argument('--latency-ms', type=float, default=0, help='delay added to every request by the Graph stand-in')
+    parser.add_argument('--throttle-rate', type=float, default=0, help='share of requests the Graph stand-in throttles with a 429')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--recording', default='recording', help='record, replay: the directory of the recording')
+    parser.add_argument('--start-date', help='record: YYYY-MM-DD, today by default')
+    parser.add_argument('--end-date', help='record: YYYY-MM-DD, days_out after today by default')
+    parser.add_argument('--output', help='file the results are saved to as json')
+    parser.add_argument('-v', '--verbose', action='store_true', help='log the debug messages of the cycles')
+    args = parser.parse_args()
+
+    # OutlookCalendar only creates its logger when it is run as a script
+    OutlookCalendar.logger = logging.getLogger('__main__')
+    logging.basicConfig(level=logging.DEBUG if args.verbose else logging.WARNING, format='%(name)s:%(levelname)s:%(message)s')
+
+    if args.mode == 'record':
+        record(args)
+        return
+    if args.mode == 'replay':
+        results = [replay(args)]
+    else:
+        results = [run_synthetic(n_members, args) for n_members in args.members]
+
+    if args.output:
+        with open(args.output, 'w') as file:
+            json.dump(results, file, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,49 @@
+import io
+import os
+import random
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import GenerateReport
+from SimpleEvent import SimpleEvent, Kind
+
+MONDAY = datetime(2025, 3, 3).toordinal()
+
+EVENTS = [
+    SimpleEvent('asmith', MONDAY, Kind.OUT),
+    SimpleEvent('bjones', MONDAY, Kind.AM),
+    SimpleEvent('jdoe', MONDAY, Kind.PM),
+    SimpleEvent('asmith', MONDAY + 1, Kind.PM),
+    SimpleEvent('jdoe', MONDAY + 1, Kind.OUT),
+    SimpleEvent('zlee', MONDAY + 2, Kind.AM),
+]
+
+def render(write, events):
+    output = io.StringIO()
+    write(events, output)
+    return output.getvalue()
+
+class TestReportOrder(unittest.TestCase):
+
+    def test_members_of_a_day_are_sorted(self):
+        self.assertEqual(render(GenerateReport.print_table, EVENTS).splitlines(), [
+            "2025-03-03,asmith,bjones AM,jdoe PM",
+            "2025-03-04,asmith PM,jdoe",
+            "2025-03-05,zlee AM",
+        ])
+
+    def test_output_does_not_depend_on_the_order_of_the_events(self):
+        # The chunks of a window are appended in the order their futures complete
+        expected = {write: render(write, EVENTS) for write in (GenerateReport.print_table, GenerateReport.print_ndjson)}
+        shuffled = list(EVENTS)
+        generator = random.Random(0)
+        for _ in range(20):
+            generator.shuffle(shuffled)
+            for write, output in expected.items():
+                self.assertEqual(render(write, shuffled), output)
+
+if __name__ == '__main__':
+    unittest.main()
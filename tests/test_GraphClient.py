@@ -0,0 +1,162 @@
+import io
+import json
+import os
+import sys
+import unittest
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Throttle
+from GraphClient import GraphClient, MISSING_STATUS
+from Throttle import ThrottleState, is_idempotent, is_retryable
+
+EVENTS = '/me/calendars/calendar-id/events'
+GET_SCHEDULE = '/me/calendar/getSchedule'
+
+def make_response(status_code, body=None, retry_after=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = io.BytesIO(json.dumps(body or {}).encode())
+    if retry_after is not None:
+        response.headers['Retry-After'] = str(retry_after)
+    response.request = requests.Request('POST', 'https://graph.microsoft.com/v1.0/$batch', headers={'client-request-id': 'batch'}).prepare()
+    return response
+
+class TestRetryRules(unittest.TestCase):
+
+    def test_is_idempotent(self):
+        self.assertTrue(is_idempotent('GET', EVENTS))
+        self.assertTrue(is_idempotent('DELETE', EVENTS + '/event-id'))
+        self.assertTrue(is_idempotent('PATCH', EVENTS + '/event-id'))
+        self.assertTrue(is_idempotent('POST', GET_SCHEDULE))
+        self.assertFalse(is_idempotent('POST', EVENTS))
+
+    def test_is_retryable(self):
+        for status_code in (429, 503):
+            self.assertTrue(is_retryable(status_code, True))
+            self.assertTrue(is_retryable(status_code, False))
+        for status_code in (502, 504):
+            self.assertTrue(is_retryable(status_code, True))
+            self.assertFalse(is_retryable(status_code, False))
+        for status_code in (200, 400, 404, 500):
+            self.assertFalse(is_retryable(status_code, True))
+
+    def test_retry_after_is_honoured(self):
+        throttle = ThrottleState()
+        self.assertEqual(throttle.get_delay(3, 7), 7)
+        with mock.patch.object(Throttle.time, 'time', return_value=1000):
+            self.assertTrue(throttle.record_retry(429, 7))
+            self.assertTrue(throttle.is_throttled())
+        with mock.patch.object(Throttle.time, 'time', return_value=1002), mock.patch.object(Throttle.time, 'sleep') as sleep:
+            throttle.wait()
+        sleep.assert_called_once_with(5)
+
+    def test_budget_exhaustion(self):
+        throttle = ThrottleState(budget=10)
+        with mock.patch.object(Throttle.time, 'time', return_value=1000):
+            self.assertTrue(throttle.record_retry(429, 6))
+        with mock.patch.object(Throttle.time, 'time', return_value=1010):
+            self.assertFalse(throttle.record_retry(429, 6))
+            self.assertTrue(throttle.record_retry(503, 4))
+        self.assertEqual(throttle.remaining_budget(), 0)
+        self.assertEqual(throttle.retry_count, 2)
+        self.assertEqual(throttle.throttled_count, 1)
+
+    def test_overlapping_waits_are_charged_once(self):
+        throttle = ThrottleState(budget=60)
+        # Ten threads throttled together with the same Retry-After wait it out together
+        with mock.patch.object(Throttle.time, 'time', return_value=1000):
+            for _ in range(10):
+                self.assertTrue(throttle.record_retry(429, 30))
+        self.assertEqual(throttle.remaining_budget(), 30)
+        # A wait that ends after the current one is only charged for the time it adds
+        with mock.patch.object(Throttle.time, 'time', return_value=1020):
+            self.assertTrue(throttle.record_retry(429, 15))
+        self.assertEqual(throttle.remaining_budget(), 25)
+        self.assertEqual(throttle.throttled_until, 1035)
+        self.assertEqual(throttle.throttled_count, 11)
+
+    def test_start_cycle_keeps_retry_after(self):
+        throttle = ThrottleState(budget=10)
+        throttle.record_retry(429, 5)
+        throttle.start_cycle()
+        self.assertEqual(throttle.remaining_budget(), 10)
+        self.assertTrue(throttle.is_throttled())
+
+class TestGraphClient(unittest.TestCase):
+
+    def setUp(self):
+        patcher = mock.patch.object(Throttle.time, 'sleep')
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def create_client(self, responses, budget=Throttle.DEFAULT_BUDGET):
+        client = GraphClient(base_url='https://graph.microsoft.com/v1.0', throttle=ThrottleState(budget=budget, max_retries=2))
+        client.calls = []
+        def request(method, url, **kwargs):
+            client.calls.append((method, url, kwargs.get('data')))
+            return responses.pop(0)
+        client.session.request = request
+        return client
+
+    def test_gateway_errors_are_only_retried_when_idempotent(self):
+        for method, endpoint, expected_calls in (('POST', EVENTS, 1), ('POST', GET_SCHEDULE, 2), ('GET', EVENTS, 2)):
+            client = self.create_client([make_response(502, retry_after=0), make_response(200)])
+            client.request(method, endpoint, 'token')
+            self.assertEqual(len(client.calls), expected_calls, (method, endpoint))
+
+    def test_throttled_writes_are_retried(self):
+        client = self.create_client([make_response(429, retry_after=0), make_response(201)])
+        response = client.request('POST', EVENTS, 'token')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(len(client.calls), 2)
+
+    def test_spent_budget_returns_the_last_response(self):
+        client = self.create_client([make_response(429, retry_after=20), make_response(200)], budget=10)
+        response = client.request('GET', EVENTS, 'token')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(len(client.calls), 1)
+
+    def test_missing_sub_response_is_retried_when_idempotent(self):
+        sub_requests = [{'id': '1', 'method': 'POST', 'url': GET_SCHEDULE, 'body': {}}, {'id': '2', 'method': 'POST', 'url': GET_SCHEDULE, 'body': {}}]
+        client = self.create_client([
+            make_response(200, {'responses': [{'id': '1', 'status': 200, 'headers': {}, 'body': {}}]}),
+            make_response(200, {'responses': [{'id': '2', 'status': 200, 'headers': {}, 'body': {}}]})
+        ])
+        sub_responses = client.batch(sub_requests, 'token')
+        self.assertEqual([sub_response['status'] for sub_response in sub_responses], [200, 200])
+        self.assertEqual([request['id'] for request in json.loads(client.calls[1][2])['requests']], ['2'])
+
+    def test_missing_sub_response_of_a_write_fails(self):
+        sub_requests = [{'id': '1', 'method': 'POST', 'url': EVENTS, 'body': {}}, {'id': '2', 'method': 'POST', 'url': EVENTS, 'body': {}}]
+        client = self.create_client([make_response(200, {'responses': [{'id': '2', 'status': 201, 'headers': {}, 'body': {}}]})])
+        sub_responses = client.batch(sub_requests, 'token')
+        self.assertEqual([sub_response['status'] for sub_response in sub_responses], [MISSING_STATUS, 201])
+        self.assertEqual(len(client.calls), 1)
+
+    def test_unexpected_sub_response_is_ignored(self):
+        sub_requests = [{'id': '1', 'method': 'GET', 'url': EVENTS}]
+        client = self.create_client([make_response(200, {'responses': [
+            {'id': '7', 'status': 200, 'headers': {}, 'body': {}},
+            {'id': '1', 'status': 200, 'headers': {}, 'body': {'value': []}}
+        ]})])
+        self.assertEqual(client.batch(sub_requests, 'token'), [{'id': '1', 'status': 200, 'headers': {}, 'body': {'value': []}}])
+
+    def test_throttled_sub_responses_are_retried_after_the_longest_retry_after(self):
+        sub_requests = [{'id': '1', 'method': 'POST', 'url': EVENTS, 'body': {}}, {'id': '2', 'method': 'POST', 'url': EVENTS, 'body': {}}]
+        client = self.create_client([
+            make_response(200, {'responses': [
+                {'id': '1', 'status': 429, 'headers': {'Retry-After': '3'}, 'body': {}},
+                {'id': '2', 'status': 429, 'headers': {'Retry-After': '5'}, 'body': {}}
+            ]}),
+            make_response(200, {'responses': [{'id': '1', 'status': 201, 'headers': {}, 'body': {}}, {'id': '2', 'status': 201, 'headers': {}, 'body': {}}]})
+        ])
+        sub_responses = client.batch(sub_requests, 'token')
+        self.assertEqual([sub_response['status'] for sub_response in sub_responses], [201, 201])
+        self.assertEqual(client.throttle.spent, 5)
+
+if __name__ == '__main__':
+    unittest.main()
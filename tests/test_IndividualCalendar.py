@@ -0,0 +1,113 @@
+import os
+import sys
+import threading
+import time
+import unittest
+from datetime import datetime, timedelta
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IndividualCalendar
+from SimpleEvent import SimpleEvent, Kind, WorkDay
+
+MONDAY = datetime(2025, 3, 3).toordinal()
+
+def describe(events):
+    return [(event.net_id, event.day - MONDAY, event.kind) for event in events]
+
+class TestFilter(unittest.TestCase):
+
+    def test_am_and_pm_become_out(self):
+        events = [SimpleEvent('jdoe', MONDAY, Kind.AM), SimpleEvent('jdoe', MONDAY, Kind.PM)]
+        self.assertEqual(describe(IndividualCalendar.filter(events)), [('jdoe', 0, Kind.OUT)])
+        events = [SimpleEvent('jdoe', MONDAY, Kind.PM), SimpleEvent('jdoe', MONDAY, Kind.AM)]
+        self.assertEqual(describe(IndividualCalendar.filter(events)), [('jdoe', 0, Kind.OUT)])
+
+    def test_duplicate_kinds_are_merged(self):
+        for kind in Kind:
+            events = [SimpleEvent('jdoe', MONDAY, kind), SimpleEvent('jdoe', MONDAY, kind), SimpleEvent('jdoe', MONDAY, kind)]
+            self.assertEqual(describe(IndividualCalendar.filter(events)), [('jdoe', 0, kind)])
+
+    def test_out_overrides_am_and_pm(self):
+        for kind in (Kind.AM, Kind.PM):
+            for events in ([SimpleEvent('jdoe', MONDAY, kind), SimpleEvent('jdoe', MONDAY, Kind.OUT)],
+                [SimpleEvent('jdoe', MONDAY, Kind.OUT), SimpleEvent('jdoe', MONDAY, kind)]):
+                self.assertEqual(describe(IndividualCalendar.filter(events)), [('jdoe', 0, Kind.OUT)])
+
+    def test_members_and_days_are_kept_apart(self):
+        events = [
+            SimpleEvent('jdoe', MONDAY, Kind.AM),
+            SimpleEvent('asmith', MONDAY, Kind.PM),
+            SimpleEvent('jdoe', MONDAY + 1, Kind.PM),
+            SimpleEvent('asmith', MONDAY, Kind.PM),
+            SimpleEvent('jdoe', MONDAY, Kind.PM)
+        ]
+        # In the order each member and day was first seen
+        self.assertEqual(describe(IndividualCalendar.filter(events)), [('jdoe', 0, Kind.OUT), ('asmith', 0, Kind.PM), ('jdoe', 1, Kind.PM)])
+
+    def test_kinds_stay_kinds(self):
+        events = IndividualCalendar.filter([SimpleEvent('jdoe', MONDAY, Kind.AM), SimpleEvent('jdoe', MONDAY, Kind.PM)])
+        self.assertIs(events[0].kind, Kind.OUT)
+        self.assertEqual(events[0].subject, 'jdoe OUT')
+        self.assertEqual(IndividualCalendar.filter([]), [])
+
+WORK_DAY = WorkDay(540, 1020, 720, 780, 120)
+WINDOWS = [(datetime(2025, 3, 3) + timedelta(days=7 * i), datetime(2025, 3, 10) + timedelta(days=7 * i)) for i in range(3)]
+MEMBERS = [f"member{i:02d}@illinois.edu" for i in range(25)]
+
+def chunk_events(start_date, chunk):
+    return [SimpleEvent(member.split('@')[0], start_date.toordinal(), Kind.OUT) for member in chunk]
+
+class TestFetchModes(unittest.TestCase):
+    """
+    Every fetch mode yields None for a window whose getSchedule calls did not all succeed, and still retrieves the others
+    """
+
+    def retrieve_chunk(self, start_date, end_date, chunk, access_token, work_day=None):
+        if start_date == WINDOWS[1][0] and chunk[0] == MEMBERS[10]:
+            raise ConnectionError('Unable to retrieve individual calendar from the getSchedule endpoint')
+        return chunk_events(start_date, chunk)
+
+    def retrieve_batch(self, batch_entries, access_token, work_day):
+        self.batch_sizes.append(len(batch_entries))
+        return {id: None if window == WINDOWS[1] and chunk[0] == MEMBERS[10] else chunk_events(window[0], chunk)
+            for id, (window, chunk) in batch_entries.items()}
+
+    def retrieve(self, fetch_mode, **kwargs):
+        self.batch_sizes = []
+        with mock.patch.object(IndividualCalendar, 'retrieve_individual_calendar_events', self.retrieve_chunk), \
+            mock.patch.object(IndividualCalendar, 'retrieve_schedules_using_batch', self.retrieve_batch), \
+            mock.patch.object(IndividualCalendar.utils, 'send_email'):
+            return IndividualCalendar.retrieve_individual_calendars_events(WINDOWS, MEMBERS, 'token', fetch_mode=fetch_mode, work_day=WORK_DAY, **kwargs)
+
+    def test_failed_windows_are_none_in_every_mode(self):
+        for fetch_mode in IndividualCalendar.FETCH_MODES:
+            events = self.retrieve(fetch_mode, max_in_flight=3, max_batches_in_flight=2)
+            self.assertIsNone(events[WINDOWS[1]], fetch_mode)
+            for window in (WINDOWS[0], WINDOWS[2]):
+                self.assertEqual(sorted(event.net_id for event in events[window]), [member.split('@')[0] for member in MEMBERS], fetch_mode)
+
+    def test_batches_are_posted_up_to_max_batches_in_flight(self):
+        in_flight = []
+        peak = []
+        lock = threading.Lock()
+        retrieve_batch = self.retrieve_batch
+        def track(batch_entries, access_token, work_day):
+            with lock:
+                in_flight.append(None)
+                peak.append(len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+            return retrieve_batch(batch_entries, access_token, work_day)
+        self.retrieve_batch = track
+
+        # One member per sub-request, so the 75 sub-requests of the 3 windows are packed into 4 batches
+        events = self.retrieve('batch', max_batches_in_flight=2, grouping=1)
+        self.assertEqual(sorted(self.batch_sizes), [15, 20, 20, 20])
+        self.assertEqual(max(peak), 2)
+        self.assertIsNone(events[WINDOWS[1]])
+
+if __name__ == '__main__':
+    unittest.main()
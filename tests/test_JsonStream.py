@@ -0,0 +1,87 @@
+import json
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from JsonStream import iter_json_array
+
+FIXTURES = [
+    # A getSchedule response
+    {
+        '@odata.context': 'https://graph.microsoft.com/v1.0/$metadata#Collection(microsoft.graph.scheduleInformation)',
+        'value': [
+            {
+                'scheduleId': 'user00001@illinois.edu',
+                'availabilityView': '0033',
+                'scheduleItems': [
+                    {'isPrivate': False, 'status': 'oof', 'subject': 'Vacation été ✈ "quoted"',
+                     'start': {'dateTime': '2026-10-19T00:00:00.0000000', 'timeZone': 'Central Standard Time'},
+                     'end': {'dateTime': '2026-10-21T00:00:00.0000000', 'timeZone': 'Central Standard Time'}}
+                ],
+                'workingHours': {'daysOfWeek': ['monday', 'friday'], 'startTime': '08:00:00.0000000', 'timeZone': {'name': 'Central Standard Time'}}
+            },
+            {'scheduleId': 'user00002@illinois.edu', 'scheduleItems': [], 'error': None}
+        ]
+    },
+    # A batch response
+    {
+        'responses': [
+            {'id': '1', 'status': 201, 'headers': {'Retry-After': '10'}, 'body': {'id': 'AAMkAD\\/=='}},
+            {'id': '2', 'status': 429, 'headers': {}, 'body': {'error': {'code': 'TooManyRequests', 'message': 'Retry 😀'}}}
+        ],
+        '@odata.nextLink': None
+    },
+    # Numbers and literals
+    {'value': [1.5, 90.25, 3e-2, -0.5, 1E+10, 0, -7, 123456789012345678901234567890, 2.5e3, True, False, None, [], {}, '12']},
+    {'before': [1, 2], 'value': [], 'after': {'value': [3]}},
+    {'value': [10]},
+    {'other': 1.25}
+]
+
+def split(document, *offsets):
+    bounds = [0, *offsets, len(document)]
+    return [document[bounds[i] : bounds[i + 1]] for i in range(len(bounds) - 1)]
+
+class TestIterJsonArray(unittest.TestCase):
+
+    def check(self, document, chunks, key):
+        expected = json.loads(document).get(key, [])
+        self.assertEqual(list(iter_json_array(iter(chunks), key)), expected)
+
+    def test_every_split(self):
+        # A chunk can end anywhere, including inside a number, a literal, an escape or a utf-8 sequence
+        for fixture in FIXTURES:
+            for key in ('value', 'responses'):
+                for separators in ((', ', ': '), (',', ':')):
+                    document = json.dumps(fixture, ensure_ascii=False, separators=separators).encode('utf-8')
+                    for offset in range(len(document) + 1):
+                        with self.subTest(document=document, offset=offset, key=key):
+                            self.check(document, split(document, offset), key)
+
+    def test_every_pair_of_splits(self):
+        document = b'{"value": [1.5, 90.25, 3e-2, -12, true, null, "a\\"b"]}'
+        for first in range(len(document) + 1):
+            for second in range(first, len(document) + 1):
+                with self.subTest(first=first, second=second):
+                    self.check(document, split(document, first, second), 'value')
+
+    def test_one_byte_chunks(self):
+        for fixture in FIXTURES:
+            document = json.dumps(fixture, ensure_ascii=False, indent=4).encode('utf-8')
+            self.check(document, [document[i : i + 1] for i in range(len(document))], 'value')
+
+    def test_numbers_cut_after_prefix(self):
+        chunks = [b'{"value": [1.5, 90.', b'25, 3e', b'-2]}']
+        self.assertEqual(list(iter_json_array(iter(chunks), 'value')), [1.5, 90.25, 3e-2])
+
+    def test_invalid_document(self):
+        for document in (b'{"value": [1, 2', b'{"value": [1 2]}', b'{"value": [1.]}', b'[1]'):
+            for offset in range(len(document) + 1):
+                with self.subTest(document=document, offset=offset):
+                    with self.assertRaises(json.JSONDecodeError):
+                        list(iter_json_array(iter(split(document, offset)), 'value'))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,134 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime, timezone
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import utils
+from MembershipIndex import MembershipIndex
+from graph_standin import LdapStandIn, LDAP_SEARCH_BASE
+
+GROUP = 'vcs-test'
+OTHER_GROUP = 'vcs-other'
+OLD = '20240101000000Z'
+START = datetime(2024, 6, 1, tzinfo=timezone.utc).timestamp()
+
+def create_group(group_name, members):
+    return (f"cn={group_name},ou=groups,{LDAP_SEARCH_BASE}", {
+        'cn': group_name,
+        'modifyTimestamp': OLD,
+        'uniqueMember': [f"uid={uid},ou=people,{LDAP_SEARCH_BASE}" for uid in members]
+    })
+
+def create_entries(members, others):
+    entries = [create_group(GROUP, members)]
+    for uid in members + others:
+        entries.append((f"uid={uid},ou=people,{LDAP_SEARCH_BASE}", {'uid': uid, 'mail': f"{uid}@illinois.edu", 'modifyTimestamp': OLD}))
+    return entries
+
+class RecordingLdap(LdapStandIn):
+    """
+    The ldap stand-in, recording the uids of every entry it returns
+    """
+
+    def __init__(self, entries):
+        super().__init__(entries)
+        self.fetched = []
+
+    def search(self, search_filter, attributes):
+        results = super().search(search_filter, attributes)
+        self.fetched.extend(result['uid'][0] for result in results if 'uid' in result)
+        return results
+
+class TestMembershipIndex(unittest.TestCase):
+
+    def setUp(self):
+        self.members = [f"member{i:03d}" for i in range(150)]
+        # Modified more recently than every member, so a search of the whole directory would return them
+        self.others = [f"other{i:03d}" for i in range(300)]
+        self.ldap = RecordingLdap(create_entries(self.members, self.others))
+        for uid in self.others:
+            self.ldap.entries[('uid', uid)]['modifyTimestamp'] = ['20250601000000Z']
+        patcher = mock.patch.object(utils, 'open_ldap_connection', self.ldap.open_connection)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        # The clock of the index, so that the modifyTimestamps of the entries can be placed between its checks
+        self.now = START
+        patcher = mock.patch('MembershipIndex.time')
+        patcher.start().time.side_effect = lambda: self.now
+        self.addCleanup(patcher.stop)
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.index = MembershipIndex(os.path.join(self.directory.name, 'index.json'))
+
+    def refresh(self, group_name=GROUP):
+        self.now = self.now + 3600
+        self.index.groups[group_name]['checked'] = 0
+        self.ldap.fetched = []
+        return self.index.get_emails(group_name, 60)
+
+    def modify(self, uid, **attributes):
+        # Modified a minute after the latest check of the index
+        self.now = self.now + 60
+        timestamp = datetime.fromtimestamp(self.now, timezone.utc).strftime('%Y%m%d%H%M%SZ')
+        self.ldap.entries[('uid', uid)].update(modifyTimestamp=[timestamp], **attributes)
+
+    def test_first_refresh_resolves_every_member(self):
+        emails = self.index.get_emails(GROUP, 60)
+        self.assertEqual(emails, [f"{uid}@illinois.edu" for uid in self.members])
+
+    def test_non_members_are_never_fetched(self):
+        self.index.get_emails(GROUP, 60)
+        self.ldap.entries[('uid', 'member007')].update(mail=['changed@illinois.edu'], modifyTimestamp=['20250101000000Z'])
+        emails = self.refresh()
+        self.assertTrue(set(self.ldap.fetched) <= set(self.members))
+        self.assertIn('changed@illinois.edu', emails)
+
+    def test_only_modified_members_are_resolved_again(self):
+        self.index.get_emails(GROUP, 60)
+        self.modify('member001', mail=['new@illinois.edu'])
+        self.refresh()
+        self.assertEqual(self.index.users['member001']['mail'], 'new@illinois.edu')
+        self.assertEqual(self.ldap.fetched, ['member001'])
+
+        # The members are not resolved again once they were checked after their modification
+        self.refresh()
+        self.assertEqual(self.ldap.fetched, [])
+
+        self.modify('member002')
+        self.refresh()
+        self.assertEqual(self.ldap.fetched, ['member002'])
+
+    def test_members_modified_before_another_group_refreshed_are_resolved(self):
+        # member100 to member149 are also in the other group, which is refreshed separately
+        _, attributes = create_group(OTHER_GROUP, self.members[100:])
+        self.ldap.entries[('cn', OTHER_GROUP)] = {name: value if isinstance(value, list) else [value] for name, value in attributes.items()}
+        self.index.get_emails(GROUP, 60)
+        self.index.get_emails(OTHER_GROUP, 60)
+
+        # member001 is modified before a shared member, and the other group is refreshed in between
+        self.modify('member001', mail=['new@illinois.edu'])
+        self.modify('member120', mail=['shared@illinois.edu'])
+        self.refresh(OTHER_GROUP)
+        self.assertEqual(self.ldap.fetched, ['member120'])
+
+        emails = self.refresh()
+        self.assertIn('new@illinois.edu', emails)
+        self.assertIn('shared@illinois.edu', emails)
+
+    def test_removed_members_are_forgotten(self):
+        self.index.get_emails(GROUP, 60)
+        group = self.ldap.entries[('cn', GROUP)]
+        group['uniqueMember'] = group['uniqueMember'][1:]
+        group['modifyTimestamp'] = ['20250101000000Z']
+        emails = self.refresh()
+        self.assertNotIn('member000', self.index.users)
+        self.assertEqual(len(emails), len(self.members) - 1)
+        self.assertEqual(len(MembershipIndex(self.index.path).users), len(self.members) - 1)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,290 @@
+import json
+import os
+import sys
+import time
+import unittest
+from datetime import datetime, timedelta, timezone
+from unittest import mock
+
+import requests
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Notifications
+from Notifications import NotificationReceiver, SubscriptionManager, get_affected_ranges
+from GraphClient import set_graph_client
+from StateStore import StateStore
+
+CLIENT_STATE = 'client-state'
+
+def send_notification(url, subscription_id, client_state, resource, change_type='updated', event_id=None):
+    """
+    A local stand-in for the Microsoft Graph API that sends a change notification to a NotificationReceiver
+
+    Returns:
+        int: the status code of the response of the receiver
+    """
+
+    notification = {
+        'subscriptionId': subscription_id,
+        'clientState': client_state,
+        'changeType': change_type,
+        'resource': resource,
+        'subscriptionExpirationDateTime': (datetime.now(timezone.utc) + timedelta(days=1)).strftime("%Y-%m-%dT%H:%M:%SZ"),
+        'resourceData': {
+            '@odata.type': '#Microsoft.Graph.Event',
+            'id': event_id if event_id else resource.rstrip('/').split('/')[-1]
+        }
+    }
+    return requests.post(url, data=json.dumps({'value': [notification]}), headers={'Content-Type': 'application/json'}).status_code
+
+def send_validation(url, validation_token='validation-token'):
+    """
+    A local stand-in for the validation request the Microsoft Graph API sends when a subscription is created
+
+    Returns:
+        bool: True if the receiver echoed validation_token back
+    """
+
+    response = requests.post(url, params={'validationToken': validation_token})
+    return response.status_code == 200 and response.text == validation_token
+
+class FakeResponse:
+    def __init__(self, status_code, body=None):
+        self.status_code = status_code
+        self.body = body or {}
+        self.text = json.dumps(self.body)
+
+    def json(self):
+        return self.body
+
+class FakeGraphClient:
+    """
+    Answers the subscription and event requests of the Notifications module, recording every request
+    """
+
+    def __init__(self):
+        self.calls = []
+        self.refused = set() # resources whose subscription is refused
+        self.renewable = True
+        self.events = {} # resource to event
+        self.count = 0
+
+    def post(self, endpoint, access_token, data=None, headers=None):
+        body = json.loads(data)
+        self.calls.append(('POST', body['resource']))
+        if body['resource'] in self.refused:
+            return FakeResponse(403, {'error': {'code': 'ExtensionError'}})
+        self.count = self.count + 1
+        return FakeResponse(201, {'id': f"subscription{self.count}"})
+
+    def request(self, method, endpoint, access_token, data=None, headers=None):
+        self.calls.append((method, endpoint))
+        if method == 'PATCH':
+            return FakeResponse(200 if self.renewable else 404)
+        return FakeResponse(204)
+
+    def get(self, endpoint, access_token, headers=None):
+        resource = endpoint.split('?')[0]
+        self.calls.append(('GET', resource))
+        if resource in self.events:
+            return FakeResponse(200, self.events[resource])
+        return FakeResponse(404)
+
+class TestNotificationReceiver(unittest.TestCase):
+
+    def setUp(self):
+        self.receiver = NotificationReceiver(CLIENT_STATE, host='127.0.0.1', port=0)
+        self.receiver.start()
+        self.addCleanup(self.receiver.stop)
+        self.url = f"http://127.0.0.1:{self.receiver.port}/"
+
+    def test_validation_token_is_echoed(self):
+        self.assertTrue(send_validation(self.url, 'a token'))
+
+    def test_wrong_client_state_is_rejected(self):
+        self.assertEqual(send_notification(self.url, 'subscription1', 'wrong', '/me/events/1'), 202)
+        self.assertEqual(send_notification(self.url, 'subscription1', CLIENT_STATE, '/me/events/2'), 202)
+        notifications = self.receiver.get_notifications(1, debounce=0.1)
+        self.assertEqual([notification['resourceData']['id'] for notification in notifications], ['2'])
+
+    def test_invalid_body(self):
+        self.assertEqual(requests.post(self.url, data='{').status_code, 400)
+
+    def test_burst_is_debounced(self):
+        for i in range(5):
+            send_notification(self.url, 'subscription1', CLIENT_STATE, f"/me/events/{i}")
+        notifications = self.receiver.get_notifications(1, debounce=0.2)
+        self.assertEqual(len(notifications), 5)
+        start = time.time()
+        self.assertEqual(self.receiver.get_notifications(0.1, debounce=0.2), [])
+        self.assertLess(time.time() - start, 1)
+
+class TestSubscriptionManager(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = FakeGraphClient()
+        set_graph_client(self.graph)
+        self.addCleanup(set_graph_client, None)
+        self.state_store = StateStore(':memory:')
+        self.manager = SubscriptionManager('https://vcs.example/notify', CLIENT_STATE, self.state_store)
+        self.resources = SubscriptionManager.get_resources([({}, ['a@illinois.edu', 'b@illinois.edu'])], ['calendar1'])
+
+    def test_missing_subscriptions_are_created(self):
+        self.manager.ensure(self.resources, 'token')
+        self.assertEqual(sorted(self.manager.subscriptions), sorted(self.resources))
+        self.assertEqual(self.manager.subscriptions['/users/a@illinois.edu/events']['email'], 'a@illinois.edu')
+        self.assertEqual(self.manager.subscriptions['/me/calendars/calendar1/events']['calendar_id'], 'calendar1')
+        # The subscriptions are kept in the state store, so they are reused after a restart
+        self.assertEqual(SubscriptionManager('https://vcs.example/notify', CLIENT_STATE, self.state_store).subscriptions, self.manager.subscriptions)
+
+        self.graph.calls = []
+        self.manager.ensure(self.resources, 'token')
+        self.assertEqual(self.graph.calls, [])
+
+    def test_expiring_subscriptions_are_renewed(self):
+        self.manager.ensure(self.resources, 'token')
+        self.manager.subscriptions['/users/a@illinois.edu/events']['expiration'] = time.time() + 60
+        self.graph.calls = []
+        self.manager.ensure(self.resources, 'token')
+        self.assertEqual(self.graph.calls, [('PATCH', '/subscriptions/subscription1')])
+        self.assertGreater(self.manager.subscriptions['/users/a@illinois.edu/events']['expiration'], time.time() + 3600)
+
+    def test_subscriptions_that_cannot_be_renewed_are_recreated(self):
+        self.manager.ensure(self.resources, 'token')
+        self.manager.subscriptions['/users/a@illinois.edu/events']['expiration'] = time.time() + 60
+        self.graph.renewable = False
+        self.graph.calls = []
+        self.manager.ensure(self.resources, 'token')
+        self.assertEqual(self.graph.calls, [('PATCH', '/subscriptions/subscription1'), ('POST', '/users/a@illinois.edu/events')])
+        self.assertEqual(self.manager.subscriptions['/users/a@illinois.edu/events']['id'], 'subscription4')
+
+    def test_subscriptions_to_removed_resources_are_deleted(self):
+        self.manager.ensure(self.resources, 'token')
+        del self.resources['/users/b@illinois.edu/events']
+        self.graph.calls = []
+        self.manager.ensure(self.resources, 'token')
+        self.assertEqual(self.graph.calls, [('DELETE', '/subscriptions/subscription2')])
+        self.assertNotIn('/users/b@illinois.edu/events', self.manager.subscriptions)
+
+    def test_refused_subscriptions_back_off(self):
+        self.graph.refused = {'/users/a@illinois.edu/events'}
+        self.manager.ensure(self.resources, 'token')
+        self.assertNotIn('/users/a@illinois.edu/events', self.manager.subscriptions)
+
+        # The following wakeups don't request the refused subscription again
+        self.graph.calls = []
+        for _ in range(3):
+            self.manager.ensure(self.resources, 'token')
+        self.assertEqual(self.graph.calls, [])
+
+        # Once its delay has passed it is requested again, and the next delay is doubled
+        retry_at = self.manager.refused['/users/a@illinois.edu/events']['retry_at']
+        with mock.patch.object(Notifications.time, 'time', return_value=retry_at + 1):
+            self.manager.ensure(self.resources, 'token')
+        self.assertEqual(self.graph.calls, [('POST', '/users/a@illinois.edu/events')])
+        refused = self.manager.refused['/users/a@illinois.edu/events']
+        self.assertEqual(refused['count'], 2)
+        self.assertAlmostEqual(refused['retry_at'] - retry_at - 1, 2 * Notifications.RETRY_DELAY, delta=1)
+
+        # A subscription that is finally created isn't refused anymore
+        self.graph.refused = set()
+        with mock.patch.object(Notifications.time, 'time', return_value=refused['retry_at'] + 1):
+            self.manager.ensure(self.resources, 'token')
+        self.assertIn('/users/a@illinois.edu/events', self.manager.subscriptions)
+        self.assertEqual(self.manager.refused, {})
+
+    def test_members_without_a_live_subscription_are_polled(self):
+        targets = [({}, ['a@illinois.edu', 'b@illinois.edu']), ({}, ['b@illinois.edu', 'c@illinois.edu'])]
+        self.graph.refused = {'/users/b@illinois.edu/events'}
+        self.manager.ensure(SubscriptionManager.get_resources(targets, ['calendar1']), 'token')
+        self.assertEqual(self.manager.get_unsubscribed_members(targets), ['b@illinois.edu'])
+
+        # An expired subscription doesn't deliver notifications anymore
+        expiration = self.manager.subscriptions['/users/c@illinois.edu/events']['expiration']
+        self.assertEqual(self.manager.get_unsubscribed_members(targets, now=expiration + 1), ['a@illinois.edu', 'b@illinois.edu', 'c@illinois.edu'])
+
+class TestAffectedRanges(unittest.TestCase):
+
+    def setUp(self):
+        self.graph = FakeGraphClient()
+        set_graph_client(self.graph)
+        self.addCleanup(set_graph_client, None)
+        self.state_store = StateStore(':memory:')
+        self.manager = SubscriptionManager('https://vcs.example/notify', CLIENT_STATE, self.state_store)
+        self.manager.subscriptions = {
+            '/users/a@illinois.edu/events': {'id': 'member', 'expiration': time.time() + 86400, 'email': 'a@illinois.edu'},
+            '/me/calendars/calendar1/events': {'id': 'shared', 'expiration': time.time() + 86400, 'calendar_id': 'calendar1'}
+        }
+        self.horizon = (datetime(2026, 10, 1), datetime(2026, 11, 1))
+
+    def notification(self, subscription_id, resource, change_type, event_id=None):
+        return {
+            'subscriptionId': subscription_id,
+            'changeType': change_type,
+            'resource': resource,
+            'resourceData': {'id': event_id or resource.split('/')[-1]}
+        }
+
+    def event(self, subject, start, end):
+        return {'subject': subject, 'start': {'dateTime': start + '.0000000'}, 'end': {'dateTime': end + '.0000000'}, 'showAs': 'oof'}
+
+    def test_member_change_affects_the_days_of_the_event(self):
+        self.graph.events['/Users/a/Events/1'] = self.event('Vacation', '2026-10-05T13:00:00', '2026-10-07T09:00:00')
+        ranges = get_affected_ranges([self.notification('member', 'Users/a/Events/1', 'updated')], self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {'a': (datetime(2026, 10, 5), datetime(2026, 10, 8))})
+
+    def test_moved_member_event_affects_its_previous_days(self):
+        # The event was on the 20th and 21st when the calendar was last retrieved, and was moved to the 5th
+        self.state_store.replace_member_absences(*self.horizon, [('a', '2026-10-20', 'OUT'), ('a', '2026-10-21', 'OUT'), ('b', '2026-10-28', 'OUT')])
+        self.graph.events['/Users/a/Events/1'] = self.event('Vacation', '2026-10-05T00:00:00', '2026-10-06T00:00:00')
+        ranges = get_affected_ranges([self.notification('member', 'Users/a/Events/1', 'updated')], self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {'a': (datetime(2026, 10, 5), datetime(2026, 10, 22))})
+
+        # A new event can't have been on other days
+        self.graph.events['/Users/a/Events/2'] = self.event('Vacation', '2026-10-05T00:00:00', '2026-10-06T00:00:00')
+        ranges = get_affected_ranges([self.notification('member', 'Users/a/Events/2', 'created')], self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {'a': (datetime(2026, 10, 5), datetime(2026, 10, 6))})
+
+    def test_member_deletion_affects_the_horizon(self):
+        ranges = get_affected_ranges([self.notification('member', 'Users/a/Events/1', 'deleted')], self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {'a': self.horizon})
+        self.assertEqual(self.graph.calls, [])
+
+    def test_ranges_are_merged_and_clamped_to_the_horizon(self):
+        self.graph.events['/Users/a/Events/1'] = self.event('Vacation', '2026-09-28T00:00:00', '2026-10-02T00:00:00')
+        self.graph.events['/Users/a/Events/2'] = self.event('Vacation', '2026-10-20T00:00:00', '2026-10-21T00:00:00')
+        notifications = [self.notification('member', 'Users/a/Events/1', 'created'), self.notification('member', 'Users/a/Events/2', 'updated')]
+        ranges = get_affected_ranges(notifications, self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {'a': (datetime(2026, 10, 1), datetime(2026, 10, 21))})
+
+    def test_unknown_subscription_is_ignored(self):
+        ranges = get_affected_ranges([self.notification('unknown', 'Users/a/Events/1', 'updated')], self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {})
+
+    def test_events_created_by_the_program_are_not_retrieved(self):
+        self.state_store.apply_shared_event_changes('calendar1', [{'id': 'e1', 'subject': 'b OUT', 'start': {'dateTime': '2026-10-12T00:00:00.0000000'}, 'showAs': 'free'}])
+        notification = self.notification('shared', 'Users/me/Events/e1', 'created')
+        self.assertEqual(get_affected_ranges([notification], self.manager, self.horizon, 'token', self.state_store), {})
+        self.assertEqual(self.graph.calls, [])
+
+    def test_deleted_shared_event_uses_the_date_of_the_mirror(self):
+        self.state_store.apply_shared_event_changes('calendar1', [{'id': 'e1', 'subject': 'b OUT AM', 'start': {'dateTime': '2026-10-12T00:00:00.0000000'}, 'showAs': 'free'}])
+        notifications = [self.notification('shared', 'Users/me/Events/e1', 'deleted'), self.notification('shared', 'Users/me/Events/e2', 'deleted')]
+        ranges = get_affected_ranges(notifications, self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {'b': (datetime(2026, 10, 12), datetime(2026, 10, 13))})
+        self.assertEqual(self.graph.calls, [])
+
+    def test_shared_event_changed_by_someone_else(self):
+        self.state_store.apply_shared_event_changes('calendar1', [{'id': 'e1', 'subject': 'b OUT', 'start': {'dateTime': '2026-10-12T00:00:00.0000000'}, 'showAs': 'free'}])
+        self.graph.events['/Users/me/Events/e1'] = self.event('b OUT', '2026-10-14T00:00:00', '2026-10-15T00:00:00')
+        ranges = get_affected_ranges([self.notification('shared', 'Users/me/Events/e1', 'updated')], self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {'b': (datetime(2026, 10, 14), datetime(2026, 10, 15))})
+
+        # An update that leaves the event as the program mirrored it is the program's own
+        self.graph.events['/Users/me/Events/e1'] = self.event('b OUT', '2026-10-12T00:00:00', '2026-10-13T00:00:00')
+        ranges = get_affected_ranges([self.notification('shared', 'Users/me/Events/e1', 'updated')], self.manager, self.horizon, 'token', self.state_store)
+        self.assertEqual(ranges, {})
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,119 @@
+import logging
+import os
+import sys
+import unittest
+from collections import Counter
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import IndividualCalendar
+import OutlookCalendar
+import SharedCalendar
+from SimpleEvent import SimpleEvent, Kind
+from StateStore import StateStore
+
+# The logger of OutlookCalendar is only created when it is run as a script
+OutlookCalendar.logger = logging.getLogger('__main__')
+
+CONFIGS = {
+    'group_name': 'vcs-a',
+    'shared_calendar_name': 'Calendar A',
+    'category_name': 'Vacation',
+    'category_color': 'preset2',
+    'targets': [
+        {'group_name': 'vcs-a'},
+        {'group_name': 'vcs-b', 'shared_calendar_name': 'Calendar B', 'category_name': 'Leave'}
+    ],
+    'start_of_work_day': 540,
+    'end_of_work_day': 1020,
+    'start_of_lunch': 720,
+    'end_of_lunch': 780,
+    'duration': 120
+}
+START_DATE = datetime(2025, 3, 3)
+END_DATE = datetime(2025, 3, 31)
+WINDOW_STARTS = [START_DATE, datetime(2025, 3, 17)] # Two 14 day windows
+MEMBERS_A = [f"member{i}@illinois.edu" for i in range(4)]
+MEMBERS_B = [f"member{i}@illinois.edu" for i in range(2, 6)]
+
+def get_net_ids(members):
+    return {member.split('@')[0] for member in members}
+
+class TestGetTargets(unittest.TestCase):
+
+    def test_left_out_keys_are_taken_from_the_top_level(self):
+        targets = OutlookCalendar.get_targets(CONFIGS)
+        self.assertEqual([(target['group_name'], target['shared_calendar_name'], target['category_name'], target['category_color']) for target in targets],
+            [('vcs-a', 'Calendar A', 'Vacation', 'preset2'), ('vcs-b', 'Calendar B', 'Leave', 'preset2')])
+
+    def test_top_level_is_the_only_target_without_targets(self):
+        configs = {key: value for key, value in CONFIGS.items() if key != 'targets'}
+        self.assertEqual([target['shared_calendar_name'] for target in OutlookCalendar.get_targets(configs)], ['Calendar A'])
+
+    def test_missing_key_is_reported(self):
+        configs = dict(CONFIGS, targets=[{'group_name': 'vcs-c', 'shared_calendar_name': None}])
+        del configs['shared_calendar_name']
+        with self.assertRaises(KeyError):
+            OutlookCalendar.get_targets(configs)
+
+class TestRetrieveAndUpdateCalendars(unittest.TestCase):
+    """
+    The members of several targets are retrieved once, and the events of every member are routed
+    to the shared calendar of each of its targets
+    """
+
+    def setUp(self):
+        self.store = StateStore(':memory:')
+        self.addCleanup(self.store.close)
+        self.fetched = [] # (window start, email) of every retrieved calendar
+        self.updates = {} # (shared calendar id, category) to the net_ids of the events it was updated with
+        patchers = [
+            mock.patch.object(IndividualCalendar, 'retrieve_individual_calendar_events', self.retrieve_chunk),
+            mock.patch.object(SharedCalendar, 'get_shared_calendar_id', lambda name, access_token: name + ' id'),
+            mock.patch.object(SharedCalendar, 'read_shared_calendar', lambda *args, **kwargs: []),
+            mock.patch.object(SharedCalendar, 'update_shared_calendar', self.update_shared_calendar)
+        ]
+        for patcher in patchers:
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def retrieve_chunk(self, start_date, end_date, chunk, access_token, work_day=None):
+        self.fetched.extend((start_date, member) for member in chunk)
+        return [SimpleEvent(member.split('@')[0], start_date.toordinal(), Kind.OUT) for member in chunk]
+
+    def update_shared_calendar(self, individual_calendars, shared_calendar, event_ids, shared_calendar_id, category_name, category_color, access_token, state_store=None, max_batch_concurrency=1):
+        self.updates.setdefault((shared_calendar_id, category_name), set()).update(event.net_id for event in individual_calendars)
+        return (len(individual_calendars), 0)
+
+    def update(self, targets, targeted=False):
+        OutlookCalendar.retrieve_and_update_calendars(CONFIGS, START_DATE, END_DATE, targets, 'token', self.store, targeted=targeted)
+
+    def test_shared_members_are_fetched_once(self):
+        target_a, target_b = OutlookCalendar.get_targets(CONFIGS)
+        self.update([(target_a, MEMBERS_A), (target_b, MEMBERS_B)])
+
+        fetched = Counter(self.fetched)
+        self.assertEqual(set(fetched.values()), {1})
+        self.assertEqual(sorted(fetched), sorted((start, member) for start in WINDOW_STARTS for member in set(MEMBERS_A + MEMBERS_B)))
+        self.assertEqual(self.updates, {('Calendar A id', 'Vacation'): get_net_ids(MEMBERS_A), ('Calendar B id', 'Leave'): get_net_ids(MEMBERS_B)})
+
+    def test_targeted_members_are_routed_to_their_targets(self):
+        target_a, target_b = OutlookCalendar.get_targets(CONFIGS)
+        targets = [(target_a, MEMBERS_A), (target_b, MEMBERS_B)]
+        self.update(targets)
+        self.updates = {}
+        self.fetched = []
+
+        # member3 is in both groups and member5 is only in vcs-b
+        members = ['member3@illinois.edu', 'member5@illinois.edu']
+        self.update(OutlookCalendar.get_member_targets(targets, members), targeted=True)
+
+        self.assertEqual(sorted(member for _, member in self.fetched), sorted(members * 2))
+        self.assertEqual(self.updates, {('Calendar A id', 'Vacation'): {'member3'}, ('Calendar B id', 'Leave'): {'member3', 'member5'}})
+        # The absences of the members that weren't retrieved are kept
+        self.assertEqual(self.store.get_member_absence_dates('member0', START_DATE, END_DATE), WINDOW_STARTS)
+
+if __name__ == '__main__':
+    unittest.main()
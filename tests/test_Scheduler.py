@@ -0,0 +1,102 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from Scheduler import Scheduler, Tier
+
+NOW = 1700000000
+
+CONFIGS = {
+    'days_out': 90,
+    'update_interval': 3600,
+    'refresh_tiers': [
+        {'start': 0, 'end': 7, 'interval': 300},
+        {'start': 7, 'end': 30, 'interval': 1800},
+        {'start': 30, 'end': 90, 'interval': 7200}
+    ]
+}
+
+class TestTier(unittest.TestCase):
+
+    def test_invalid_tiers(self):
+        for start_day, end_day, interval in ((-1, 7, 300), (7, 7, 300), (7, 3, 300), (0, 7, 0)):
+            with self.assertRaises(ValueError):
+                Tier(start_day, end_day, interval)
+
+class TestScheduler(unittest.TestCase):
+
+    def setUp(self):
+        self.scheduler = Scheduler.from_configs(CONFIGS)
+
+    def test_without_tiers_the_whole_horizon_is_one_tier(self):
+        scheduler = Scheduler.from_configs({'days_out': 60, 'update_interval': 900})
+        self.assertEqual([tier.key for tier in scheduler.tiers], [(0, 60, 900)])
+
+    def test_overlapping_tiers_are_rejected(self):
+        with self.assertRaises(ValueError):
+            Scheduler([Tier(0, 10, 300), Tier(7, 30, 1800)])
+
+    def test_tiers_are_sorted(self):
+        scheduler = Scheduler([Tier(30, 90, 7200), Tier(0, 7, 300), Tier(7, 30, 1800)])
+        self.assertEqual([tier.start_day for tier in scheduler.tiers], [0, 7, 30])
+        self.assertEqual(scheduler.horizon(), (0, 90))
+
+    def test_horizon_with_a_gap(self):
+        scheduler = Scheduler([Tier(0, 7, 300), Tier(14, 30, 1800)])
+        self.assertEqual(scheduler.horizon(), (0, 30))
+
+    def test_every_tier_is_due_at_first(self):
+        self.assertEqual(self.scheduler.due(now=NOW), self.scheduler.tiers)
+
+    def test_mark_run_keeps_the_cadence_of_every_tier(self):
+        short, medium, long = self.scheduler.tiers
+        self.scheduler.mark_run(self.scheduler.tiers, now=NOW)
+        self.assertEqual([tier.next_run for tier in self.scheduler.tiers], [NOW + 300, NOW + 1800, NOW + 7200])
+        self.assertEqual(self.scheduler.due(now=NOW + 299), [])
+        self.assertEqual(self.scheduler.due(now=NOW + 300), [short])
+
+        # A refresh that finishes a little late doesn't shift the cadence
+        self.scheduler.mark_run([short], now=NOW + 310)
+        self.assertEqual(short.next_run, NOW + 600)
+        self.assertEqual(short.last_run, NOW + 310)
+        self.assertEqual(self.scheduler.due(now=NOW + 1800), [short, medium])
+        self.assertEqual(self.scheduler.next_run(), NOW + 600)
+
+    def test_mark_run_starts_over_after_an_overrun(self):
+        short = self.scheduler.tiers[0]
+        self.scheduler.mark_run([short], now=NOW)
+        self.scheduler.mark_run([short], now=NOW + 1000)
+        self.assertEqual(short.next_run, NOW + 1300)
+
+    def test_get_ranges_merges_adjacent_tiers(self):
+        short, medium, long = self.scheduler.tiers
+        self.assertEqual(Scheduler.get_ranges([long, short, medium]), [(0, 90)])
+        self.assertEqual(Scheduler.get_ranges([short, long]), [(0, 7), (30, 90)])
+        self.assertEqual(Scheduler.get_ranges([medium, long]), [(7, 90)])
+        self.assertEqual(Scheduler.get_ranges([]), [])
+
+    def test_update_keeps_the_next_run_of_unchanged_tiers(self):
+        self.scheduler.mark_run(self.scheduler.tiers, now=NOW)
+        configs = dict(CONFIGS, refresh_tiers=CONFIGS['refresh_tiers'][:2] + [{'start': 30, 'end': 120, 'interval': 7200}])
+        self.scheduler.update(configs)
+        self.assertEqual([tier.key for tier in self.scheduler.tiers], [(0, 7, 300), (7, 30, 1800), (30, 120, 7200)])
+        self.assertEqual([tier.next_run for tier in self.scheduler.tiers], [NOW + 300, NOW + 1800, 0])
+
+    def test_update_keeps_the_tiers_when_the_new_ones_are_invalid(self):
+        tiers = list(self.scheduler.tiers)
+        invalid = (
+            [{'start': 0, 'end': 10, 'interval': 300}, {'start': 7, 'end': 30, 'interval': 1800}],
+            [{'start': 0, 'end': 7, 'interval': -5}],
+            [{'start': 0, 'end': 7}],
+            [{'start': 0, 'end': None, 'interval': 300}]
+        )
+        for refresh_tiers in invalid:
+            with self.subTest(refresh_tiers=refresh_tiers):
+                with self.assertLogs('__main__.Scheduler', level='ERROR'):
+                    self.scheduler.update(dict(CONFIGS, refresh_tiers=refresh_tiers))
+                self.assertEqual(self.scheduler.tiers, tiers)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,307 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+from datetime import datetime
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'benchmarks'))
+
+import SharedCalendar
+from GraphClient import GraphClient, set_graph_client
+from SimpleEvent import Kind, SimpleEvent
+from StateStore import StateStore
+from graph_standin import GraphStandIn
+
+CALENDAR_ID = 'calendar-id'
+
+def create_event(event_id, subject, start):
+    return {'id': event_id, 'subject': subject, 'start': {'dateTime': start}, 'showAs': 'free'}
+
+class TestCheckDeletedResponse(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = StateStore(os.path.join(self.directory.name, 'state.db'))
+        self.addCleanup(self.store.close)
+        events = [
+            create_event('event-1', 'jdoe OUT', '2025-03-03T00:00:00'),
+            create_event('event-2', 'asmith AM', '2025-03-04T00:00:00'),
+            create_event('event-3', 'bjones PM', '2025-03-05T00:00:00')
+        ]
+        list(self.store.mirror_shared_events(CALENDAR_ID, datetime(2025, 3, 1), datetime(2025, 4, 1), events))
+        self.batch = {'requests': [
+            {'id': str(id), 'method': 'DELETE', 'url': f"/me/calendars/{CALENDAR_ID}/events/event-{id}"} for id in (1, 2, 3)
+        ]}
+        day = datetime(2025, 3, 3).toordinal()
+        self.info = {'1': ('jdoe', day, Kind.OUT), '2': ('asmith', day + 1, Kind.AM), '3': ('bjones', day + 2, Kind.PM)}
+
+    def test_deleted_and_missing_events_are_forgotten(self):
+        responses = [
+            {'id': '1', 'status': 204, 'headers': {}, 'body': None},
+            {'id': '2', 'status': 404, 'headers': {}, 'body': {'error': {'code': 'ErrorItemNotFound'}}},
+            {'id': '3', 'status': 500, 'headers': {}, 'body': {'error': {'code': 'InternalServerError'}}}
+        ]
+        SharedCalendar.check_deleted_response(self.batch, responses, 'token', self.info, self.store)
+        self.assertIsNone(self.store.get_shared_event('event-1'))
+        self.assertIsNone(self.store.get_shared_event('event-2'))
+        self.assertIsNotNone(self.store.get_shared_event('event-3'))
+
+def create_range(start_day, end_day, age=0):
+    return {'start': str(datetime(2025, 3, start_day)), 'end': str(datetime(2025, 3, end_day)), 'time': time.time() - age}
+
+class TestIsRefreshed(unittest.TestCase):
+
+    def is_refreshed(self, ranges, start_day, end_day):
+        return SharedCalendar.is_refreshed({'ranges': ranges}, datetime(2025, 3, start_day), datetime(2025, 3, end_day), 3600)
+
+    def test_nothing_refreshed(self):
+        self.assertFalse(SharedCalendar.is_refreshed(None, datetime(2025, 3, 1), datetime(2025, 3, 8), 3600))
+        self.assertFalse(self.is_refreshed([], 1, 8))
+
+    def test_single_range(self):
+        self.assertTrue(self.is_refreshed([create_range(1, 8)], 1, 8))
+        self.assertTrue(self.is_refreshed([create_range(1, 8)], 2, 5))
+        self.assertFalse(self.is_refreshed([create_range(1, 8)], 1, 9))
+        self.assertFalse(self.is_refreshed([create_range(2, 8)], 1, 8))
+
+    def test_partial_coverage(self):
+        # Adjacent and overlapping ranges cover the timeframe together, in any order
+        self.assertTrue(self.is_refreshed([create_range(8, 20), create_range(1, 8)], 1, 20))
+        self.assertTrue(self.is_refreshed([create_range(1, 10), create_range(5, 20)], 3, 18))
+        # A gap between the ranges
+        self.assertFalse(self.is_refreshed([create_range(1, 7), create_range(8, 20)], 1, 20))
+        # A range that starts before the covered part and ends within it doesn't extend it
+        self.assertFalse(self.is_refreshed([create_range(1, 10), create_range(2, 5)], 1, 12))
+
+    def test_expired_ranges_are_ignored(self):
+        self.assertFalse(self.is_refreshed([create_range(1, 8), create_range(8, 20, age=3600)], 1, 20))
+        self.assertTrue(self.is_refreshed([create_range(1, 8), create_range(8, 20, age=3599)], 1, 20))
+
+    def test_single_range_meta(self):
+        # The meta used to hold a single range
+        refreshed = create_range(1, 8)
+        self.assertTrue(SharedCalendar.is_refreshed(refreshed, datetime(2025, 3, 2), datetime(2025, 3, 8), 3600))
+
+class TestStoreMode(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.store = StateStore(os.path.join(self.directory.name, 'state.db'))
+        self.addCleanup(self.store.close)
+        self.reads = []
+        def iterate_shared_calendar(shared_calendar_id, start_date, end_date, access_token):
+            self.reads.append((start_date.day, end_date.day))
+            return iter([create_event(f"event-{start_date.day}", 'jdoe OUT', start_date.strftime("%Y-%m-%dT%H:%M:%S"))])
+        patcher = mock.patch.object(SharedCalendar, 'iterate_shared_calendar', iterate_shared_calendar)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def read(self, start_day, end_day):
+        return list(SharedCalendar.read_shared_calendar(CALENDAR_ID, datetime(2025, 3, start_day), datetime(2025, 3, end_day), 'token', 
+            self.store, sync_mode='store', refresh_interval=3600))
+
+    def test_ranges_refreshed_by_different_tiers_are_combined(self):
+        self.read(1, 8)
+        self.read(8, 20)
+        self.assertEqual(len(self.store.get_meta('refreshed:' + CALENDAR_ID)['ranges']), 2)
+        events = self.read(1, 20)
+        self.assertEqual(self.reads, [(1, 8), (8, 20)])
+        self.assertEqual([event['id'] for event in events], ['event-1', 'event-8'])
+
+    def test_partially_refreshed_timeframe_is_read_again(self):
+        self.read(1, 8)
+        self.read(1, 20)
+        self.assertEqual(self.reads, [(1, 8), (1, 20)])
+        # The range that is covered by the new one is dropped
+        self.assertEqual(len(self.store.get_meta('refreshed:' + CALENDAR_ID)['ranges']), 1)
+
+class ExpiringGraphStandIn(GraphStandIn):
+    """
+    The Graph stand-in, answering the delta links with a 410 once expired is set, 
+    like the Microsoft Graph API does when the sync state of a delta link has expired
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.expired = False
+        self.delta_paths = []
+
+    def handle(self, method, path, body, top_level=True):
+        if '/calendarView/delta' in path:
+            self.delta_paths.append(path)
+            if self.expired and '%24deltatoken' in path:
+                self._count('expired')
+                return {'status': 410, 'headers': {}, 'body': {'error': {'code': 'SyncStateNotFound'}}}
+        return super().handle(method, path, body, top_level)
+
+class TestDeltaSync(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = ExpiringGraphStandIn().start()
+        self.addCleanup(self.standin.stop)
+        set_graph_client(GraphClient(base_url=self.standin.url))
+        self.addCleanup(set_graph_client, None)
+        self.calendar_id = self.standin.calendar_id
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'state.db')
+        self.store = StateStore(self.path)
+        self.addCleanup(lambda: self.store.close())
+
+    def create_event(self, subject, day):
+        body = {'subject': subject, 'showAs': 'free', 'start': {'dateTime': f"2025-03-{day:02d}T00:00:00.0000000"}}
+        return self.standin.handle('POST', f"/v1.0/me/calendars/{self.calendar_id}/events", body)['body']['id']
+
+    def read(self):
+        return SharedCalendar.read_shared_calendar(self.calendar_id, datetime(2025, 3, 1), datetime(2025, 3, 8), 'token', 
+            self.store, sync_mode='delta')
+
+    def get_subjects(self, events):
+        return sorted(event['subject'] for event in events)
+
+    def test_delta_link_is_kept_between_runs(self):
+        self.create_event('jdoe OUT', 3)
+        self.create_event('asmith AM', 4)
+        self.assertEqual(self.get_subjects(self.read()), ['asmith AM', 'jdoe OUT'])
+        delta_link = self.store.get_meta('delta:' + self.calendar_id)['delta_link']
+        self.assertIn('deltatoken', delta_link)
+
+        # The delta link and the mirror survive a restart
+        self.store.close()
+        self.store = StateStore(self.path)
+        self.create_event('bjones PM', 5)
+        self.assertEqual(self.get_subjects(self.read()), ['asmith AM', 'bjones PM', 'jdoe OUT'])
+        self.assertEqual(self.standin.delta_paths[-1], delta_link[len(self.standin.url.rsplit('/', 1)[0]):])
+        self.assertNotEqual(self.store.get_meta('delta:' + self.calendar_id)['delta_link'], delta_link)
+
+    def test_removed_events_leave_the_mirror(self):
+        event_id = self.create_event('jdoe OUT', 3)
+        self.create_event('asmith AM', 4)
+        self.read()
+        self.standin.handle('DELETE', f"/v1.0/me/calendars/{self.calendar_id}/events/{event_id}", None)
+        self.assertEqual(self.get_subjects(self.read()), ['asmith AM'])
+        self.assertIsNone(self.store.get_shared_event(event_id))
+
+    def test_expired_delta_link_restarts_the_range(self):
+        event_id = self.create_event('jdoe OUT', 3)
+        self.create_event('asmith AM', 4)
+        self.read()
+        # A change the delta link would never report, which only a full read of the range notices
+        with self.standin.lock:
+            del self.standin.events[event_id]
+        self.create_event('bjones PM', 5)
+        self.standin.expired = True
+        self.assertEqual(self.get_subjects(self.read()), ['asmith AM', 'bjones PM'])
+        self.assertEqual(self.standin.counts['expired'], 1)
+        self.assertNotIn('deltatoken', self.standin.delta_paths[-1])
+        self.assertIsNotNone(self.store.get_meta('delta:' + self.calendar_id)['delta_link'])
+
+class TestPaging(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = GraphStandIn().start()
+        self.addCleanup(self.standin.stop)
+        set_graph_client(GraphClient(base_url=self.standin.url))
+        self.addCleanup(set_graph_client, None)
+        patcher = mock.patch.object(SharedCalendar, 'PAGE_SIZE', 2)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_every_page_is_read(self):
+        for day in (7, 3, 4, 5, 6, 9):
+            body = {'subject': f"jdoe{day} OUT", 'showAs': 'free', 'start': {'dateTime': f"2025-03-{day:02d}T00:00:00.0000000"}}
+            self.standin.handle('POST', f"/v1.0/me/calendars/{self.standin.calendar_id}/events", body)
+        self.standin.reset_counts()
+        events = list(SharedCalendar.iterate_shared_calendar(self.standin.calendar_id, datetime(2025, 3, 1), datetime(2025, 3, 8), 'token'))
+        self.assertEqual([event['subject'] for event in events], ['jdoe3 OUT', 'jdoe4 OUT', 'jdoe5 OUT', 'jdoe6 OUT', 'jdoe7 OUT'])
+        self.assertEqual(self.standin.counts['GET events'], 3)
+
+class FailingGraphStandIn(GraphStandIn):
+    """
+    The Graph stand-in, failing the sub-requests that add an event with a subject in failing or delete an event 
+    with an id in failing, and recording how many $batch requests are in flight at the same time
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.failing = set()
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def handle(self, method, path, body, top_level=True):
+        if top_level and path.endswith('/$batch'):
+            with self.lock:
+                self.in_flight = self.in_flight + 1
+                self.max_in_flight = max(self.max_in_flight, self.in_flight)
+            try:
+                # Long enough for the other batches to be posted while this one is in flight
+                time.sleep(0.1)
+                return super().handle(method, path, body, top_level)
+            finally:
+                with self.lock:
+                    self.in_flight = self.in_flight - 1
+        if (method == 'POST' and body and body.get('subject') in self.failing) or (method == 'DELETE' and path.split('/')[-1] in self.failing):
+            return {'status': 500, 'headers': {}, 'body': {'error': {'code': 'InternalServerError'}}}
+        return super().handle(method, path, body, top_level)
+
+class TestPostBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.standin = FailingGraphStandIn().start()
+        self.addCleanup(self.standin.stop)
+        set_graph_client(GraphClient(base_url=self.standin.url))
+        self.addCleanup(set_graph_client, None)
+        self.calendar_id = self.standin.calendar_id
+        self.store = StateStore(':memory:')
+        self.addCleanup(self.store.close)
+        day = datetime(2025, 3, 3).toordinal()
+        # 45 events, so 3 batches of 20, 20 and 5 requests
+        self.keys = [(f"user{i:02d}", day + i % 5, Kind.OUT) for i in range(45)]
+
+    def get_mirror(self):
+        return {event['id']: event['subject'] for event in self.store.get_shared_events(self.calendar_id, datetime(2025, 3, 1), datetime(2025, 4, 1))}
+
+    def test_failed_additions_are_left_out_of_the_mirror(self):
+        failing = {f"user{i:02d} OUT" for i in (0, 7, 21, 44)}
+        self.standin.failing.update(failing)
+        batches = SharedCalendar.create_batches_for_adding_events(self.keys, 'token', self.calendar_id, 'Vacation', 'preset2')
+        with self.assertLogs(SharedCalendar.logger, 'WARNING') as logs:
+            SharedCalendar.post_batch('token', batches, state_store=self.store, max_concurrency=3)
+
+        self.assertGreater(self.standin.max_in_flight, 1)
+        self.assertLessEqual(self.standin.max_in_flight, 3)
+        mirror = self.get_mirror()
+        self.assertEqual(sorted(mirror.values()), sorted({f"user{i:02d} OUT" for i in range(45)} - failing))
+        # Every mirrored event is the one the sub-response of its own request created
+        for event_id, subject in mirror.items():
+            self.assertEqual(self.standin.events[event_id]['subject'], subject)
+        messages = [record.getMessage() for record in logs.records if 'unccessfully added' in record.getMessage()]
+        self.assertEqual(sorted(message.split(' on ')[0] for message in messages), sorted(f"Event {subject}" for subject in failing))
+
+    def test_failed_deletions_are_kept_in_the_mirror(self):
+        batches = SharedCalendar.create_batches_for_adding_events(self.keys, 'token', self.calendar_id, 'Vacation', 'preset2')
+        SharedCalendar.post_batch('token', batches, state_store=self.store)
+        keys = {SimpleEvent(*key).subject: key for key in self.keys}
+        event_ids = {keys[subject]: event_id for event_id, subject in self.get_mirror().items()}
+        # An event deleted by hand (404) is forgotten as well, while the ones that failed are kept
+        with self.standin.lock:
+            del self.standin.events[event_ids[self.keys[30]]]
+        failing = {event_ids[self.keys[i]] for i in (1, 20, 40)}
+        self.standin.failing.update(failing)
+
+        batches, info = SharedCalendar.create_batches_for_deleting_events(self.keys, 'token', self.calendar_id, event_ids)
+        with self.assertLogs(SharedCalendar.logger, 'WARNING') as logs:
+            SharedCalendar.post_batch('token', batches, info, state_store=self.store, max_concurrency=3)
+
+        self.assertGreater(self.standin.max_in_flight, 1)
+        self.assertEqual(set(self.get_mirror()), failing)
+        self.assertEqual(set(self.standin.events), failing)
+        self.assertEqual(len([record for record in logs.records if 'unsuccesfully deleted' in record.getMessage()]), len(failing))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,149 @@
+import os
+import random
+import sys
+import unittest
+from datetime import datetime, timedelta, time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from SimpleEvent import SimpleEvent, Kind, WorkDay, get_minutes_kind, parse_date_prefix
+
+# 9:00 AM to 5:00 PM with lunch from 12:00 PM to 1:00 PM, and 2 hours to count as OUT
+WORK_DAY = WorkDay(540, 1020, 720, 780, 120)
+
+def reference_kind(start_time, end_time, work_day=WORK_DAY):
+    """
+    Classifies the time from start_time to end_time, in minutes since midnight, minute by minute
+    """
+
+    am = sum(1 for minute in range(start_time, end_time) if work_day.start_of_workday <= minute < work_day.start_of_lunch)
+    pm = sum(1 for minute in range(start_time, end_time) if work_day.end_of_lunch <= minute < work_day.end_of_workday)
+    kind = (Kind.AM if am >= work_day.duration else 0) | (Kind.PM if pm >= work_day.duration else 0)
+    return Kind(kind) if kind else None
+
+def reference_events(net_id, start, end, start_date, end_date, work_day=WORK_DAY):
+    """
+    Splits the event day by day, the way SimpleEvent did before the days were computed with interval arithmetic
+    """
+
+    def minutes(value):
+        return value.hour * 60 + value.minute
+
+    def create(new_start, new_end):
+        if start_date <= new_start < end_date:
+            kind = reference_kind(minutes(new_start), minutes(new_end), work_day)
+            if kind:
+                return [SimpleEvent(net_id, new_start.toordinal(), kind)]
+        return []
+
+    if start.date() == end.date():
+        return create(start, end)
+
+    duration = end - start
+    n_days = duration.days + (duration.seconds // 3600 != 0) + (start.time() != time(0) and end.time() <= start.time())
+    events = []
+    for i in range(n_days):
+        day = start + timedelta(days=i)
+        new_start = start if i == 0 else day.replace(hour=0, minute=0)
+        if i == 0 or i < n_days - 1 or end.time() == time(0):
+            new_end = day.replace(hour=23, minute=59)
+        else:
+            new_end = day.replace(hour=end.hour, minute=end.minute)
+        events.extend(create(new_start, new_end))
+    return events
+
+def describe(events):
+    return [(event.net_id, str(event.date.date()), event.kind.name) for event in events]
+
+class TestGetMinutesKind(unittest.TestCase):
+
+    def test_every_quarter_hour_matches_the_minute_by_minute_classification(self):
+        times = list(range(0, 24 * 60, 15)) + [719, 721, 779, 781, 539, 541, 1019, 1021, 23 * 60 + 59]
+        for start_time in times:
+            for end_time in times:
+                if end_time < start_time: continue
+                self.assertEqual(get_minutes_kind(start_time, end_time, WORK_DAY), reference_kind(start_time, end_time), (start_time, end_time))
+
+    def test_lunch_edges(self):
+        self.assertEqual(get_minutes_kind(600, 720, WORK_DAY), Kind.AM) # 10:00 AM to 12:00 PM
+        self.assertIsNone(get_minutes_kind(601, 720, WORK_DAY)) # 10:01 AM to 12:00 PM is a minute short
+        self.assertIsNone(get_minutes_kind(600, 780, WorkDay(540, 1020, 720, 780, 121))) # 10:00 AM to 1:00 PM when 121 minutes are needed
+        self.assertEqual(get_minutes_kind(780, 900, WORK_DAY), Kind.PM) # 1:00 PM to 3:00 PM
+        self.assertIsNone(get_minutes_kind(720, 780, WORK_DAY)) # the lunch itself
+        self.assertEqual(get_minutes_kind(600, 900, WORK_DAY), Kind.OUT)
+        self.assertEqual(get_minutes_kind(0, 23 * 60 + 59, WORK_DAY), Kind.OUT)
+
+class TestCreateEventsForIntervals(unittest.TestCase):
+
+    def assertMatchesReference(self, start, end, start_date=datetime(2025, 3, 1), end_date=datetime(2025, 4, 1)):
+        events = SimpleEvent.create_events_for_intervals([('jdoe', start, end)], start_date, end_date, WORK_DAY)
+        expected = reference_events('jdoe', start, end, start_date, end_date)
+        self.assertEqual(describe(events), describe(expected), (start, end, start_date, end_date))
+        return describe(events)
+
+    def test_single_day(self):
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3, 9), datetime(2025, 3, 3, 12)), [('jdoe', '2025-03-03', 'AM')])
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3, 12), datetime(2025, 3, 3, 15)), [('jdoe', '2025-03-03', 'PM')])
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3, 11), datetime(2025, 3, 3, 14)), [])
+
+    def test_midnight_spanning_events(self):
+        # Overnight events don't overlap the work day
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3, 22), datetime(2025, 3, 4, 2)), [])
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3, 14), datetime(2025, 3, 4, 11)),
+            [('jdoe', '2025-03-03', 'PM'), ('jdoe', '2025-03-04', 'AM')])
+        # An all-day event ends at midnight of the next day, which isn't a day of its own
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3), datetime(2025, 3, 4)), [('jdoe', '2025-03-03', 'OUT')])
+
+    def test_events_longer_than_a_day(self):
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3), datetime(2025, 3, 6)),
+            [('jdoe', '2025-03-03', 'OUT'), ('jdoe', '2025-03-04', 'OUT'), ('jdoe', '2025-03-05', 'OUT')])
+        self.assertEqual(self.assertMatchesReference(datetime(2025, 3, 3, 11), datetime(2025, 3, 5, 17)),
+            [('jdoe', '2025-03-03', 'PM'), ('jdoe', '2025-03-04', 'OUT'), ('jdoe', '2025-03-05', 'OUT')])
+        self.assertEqual(len(self.assertMatchesReference(datetime(2025, 1, 1), datetime(2025, 7, 1), end_date=datetime(2025, 8, 1))),
+            (datetime(2025, 7, 1) - datetime(2025, 3, 1)).days)
+
+    def test_events_clipped_to_the_timeframe(self):
+        # The days before start_date and from end_date on are left out, even in the middle of an event
+        self.assertMatchesReference(datetime(2025, 2, 20, 10), datetime(2025, 3, 3, 15), start_date=datetime(2025, 3, 1, 12))
+        self.assertMatchesReference(datetime(2025, 3, 28, 10), datetime(2025, 4, 3, 15), end_date=datetime(2025, 3, 31, 12))
+        self.assertMatchesReference(datetime(2025, 3, 1, 8), datetime(2025, 3, 2, 9), start_date=datetime(2025, 3, 1, 9))
+
+    def test_random_intervals_match_the_reference(self):
+        generator = random.Random(15)
+        for _ in range(2000):
+            start = datetime(2025, 3, 1) + timedelta(minutes=generator.randrange(0, 20 * 24 * 4) * 15)
+            end = start + timedelta(minutes=generator.choice([generator.randrange(0, 24 * 4), generator.randrange(0, 10 * 24 * 4)]) * 15)
+            start_date = datetime(2025, 3, 1) + timedelta(hours=generator.randrange(0, 10 * 24))
+            end_date = start_date + timedelta(hours=generator.randrange(1, 20 * 24))
+            self.assertMatchesReference(start, end, start_date, end_date)
+
+    def test_intervals_keep_their_order(self):
+        intervals = [
+            ('asmith', datetime(2025, 3, 4), datetime(2025, 3, 6)),
+            ('jdoe', datetime(2025, 3, 3, 9), datetime(2025, 3, 3, 12))
+        ]
+        events = SimpleEvent.create_events_for_intervals(intervals, datetime(2025, 3, 1), datetime(2025, 4, 1), WORK_DAY)
+        self.assertEqual(describe(events), [('asmith', '2025-03-04', 'OUT'), ('asmith', '2025-03-05', 'OUT'), ('jdoe', '2025-03-03', 'AM')])
+
+class TestMakeDatetime(unittest.TestCase):
+
+    def test_parse_date_prefix(self):
+        self.assertEqual(parse_date_prefix('2025-03-18'), (2025, 3, 18))
+        self.assertEqual(parse_date_prefix('1999-12-31'), (1999, 12, 31))
+
+    def test_fast_path_matches_strptime(self):
+        for date in ('2023-03-18T00:00:00.0000000', '2023-03-18T23:59:59.9999999', '2024-02-29T12:30:00', '2023-12-31T09:05:07.1230000'):
+            self.assertEqual(SimpleEvent.make_datetime(date), datetime.strptime(date.split('.')[0], "%Y-%m-%dT%H:%M:%S"), date)
+        self.assertEqual(SimpleEvent.make_datetime('2023-03-18'), datetime(2023, 3, 18))
+
+    def test_other_layouts_fall_back_to_strptime(self):
+        self.assertEqual(SimpleEvent.make_datetime('2023-3-8'), datetime(2023, 3, 8))
+        self.assertEqual(SimpleEvent.make_datetime('2023-03-18T9:05:07'), datetime(2023, 3, 18, 9, 5, 7))
+
+    def test_invalid_dates_are_rejected(self):
+        for date in ('2023-02-30', '2023-02-30T00:00:00.0000000', '2023-03-18T24:00:00'):
+            with self.assertRaises(ValueError):
+                SimpleEvent.make_datetime(date)
+
+if __name__ == '__main__':
+    unittest.main()
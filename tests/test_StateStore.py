@@ -0,0 +1,45 @@
+import os
+import sys
+import tempfile
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from StateStore import StateStore
+
+START = datetime(2025, 3, 3)
+END = datetime(2025, 3, 17)
+
+class TestMemberAbsences(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.state_store = StateStore(os.path.join(self.directory.name, 'vcs_state.db'))
+
+    def test_changes_are_counted(self):
+        absences = [('jdoe', '2025-03-04', 'OUT'), ('jdoe', '2025-03-05', 'OUT AM'), ('asmith', '2025-03-04', 'OUT PM')]
+        self.assertEqual(self.state_store.replace_member_absences(START, END, absences), (3, 0))
+        self.assertEqual(self.state_store.replace_member_absences(START, END, absences), (0, 0))
+        self.assertEqual(self.state_store.replace_member_absences(START, END, absences[1:]), (0, 1))
+
+    def test_only_the_given_members_are_replaced(self):
+        self.state_store.replace_member_absences(START, END, [('jdoe', '2025-03-04', 'OUT'), ('asmith', '2025-03-04', 'OUT')])
+        self.assertEqual(self.state_store.replace_member_absences(START, END, [('jdoe', '2025-03-10', 'OUT')], {'jdoe'}), (1, 1))
+        self.assertEqual(self.state_store.get_member_absence_dates('jdoe', START, END), [datetime(2025, 3, 10)])
+        self.assertEqual(self.state_store.get_member_absence_dates('asmith', START, END), [datetime(2025, 3, 4)])
+
+    def test_absence_dates_are_within_the_timeframe(self):
+        self.state_store.replace_member_absences(datetime(2025, 3, 1), datetime(2025, 3, 31), [
+            ('jdoe', '2025-03-02', 'OUT'),
+            ('jdoe', '2025-03-06', 'OUT AM'),
+            ('jdoe', '2025-03-06', 'OUT PM'),
+            ('jdoe', '2025-03-03', 'OUT'),
+            ('jdoe', '2025-03-17', 'OUT')
+        ])
+        self.assertEqual(self.state_store.get_member_absence_dates('jdoe', START, END), [datetime(2025, 3, 3), datetime(2025, 3, 6)])
+        self.assertEqual(self.state_store.get_member_absence_dates('asmith', START, END), [])
+
+if __name__ == '__main__':
+    unittest.main()
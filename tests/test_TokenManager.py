@@ -0,0 +1,107 @@
+import json
+import os
+import stat
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import TokenManager
+from TokenManager import TOKEN_CACHE_FILE, LEGACY_TOKEN_FILE
+
+SCOPES = ['Calendars.ReadWrite']
+
+def create_cache(secret):
+    return json.dumps({
+        'Account': {'account': {'home_account_id': 'jdoe', 'username': 'jdoe@illinois.edu'}},
+        'RefreshToken': {'refresh-token': {'secret': secret}}
+    })
+
+class FakeApp:
+    """
+    A stand-in for the msal PublicClientApplication. Like msal, it finds the accounts in its token cache
+    and changes the cache when it redeems a refresh token
+    """
+
+    def __init__(self, client_id, authority, token_cache):
+        self.token_cache = token_cache
+        self.silent_calls = []
+        self.refresh_token_calls = []
+
+    def get_accounts(self):
+        return list(json.loads(self.token_cache.serialize()).get('Account', {}).values())
+
+    def redeem(self, secret):
+        self.token_cache.deserialize(create_cache(secret))
+        self.token_cache.has_state_changed = True
+        return {'access_token': f"access-token-{len(self.silent_calls) + len(self.refresh_token_calls)}", 'expires_in': 3600}
+
+    def acquire_token_silent(self, scopes, account, force_refresh=False):
+        self.silent_calls.append(force_refresh)
+        return self.redeem(f"refresh-token-{len(self.silent_calls)}") if force_refresh else {'access_token': 'cached-token', 'expires_in': 3600}
+
+    def acquire_token_by_refresh_token(self, refresh_token, scopes):
+        self.refresh_token_calls.append(refresh_token)
+        return self.redeem('migrated-refresh-token')
+
+class TestTokenManager(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.vcs_directory = self.directory.name + '/'
+        self.cache_path = self.vcs_directory + TOKEN_CACHE_FILE
+        for target, replacement in (('PublicClientApplication', FakeApp), ('utils', mock.Mock())):
+            patcher = mock.patch.object(TokenManager, target, replacement)
+            patcher.start()
+            self.addCleanup(patcher.stop)
+        self.device_code_flow = TokenManager.utils.init_device_code_flow
+
+    def create_manager(self):
+        manager = TokenManager.TokenManager('client-id', 'tenant-id', SCOPES, self.vcs_directory)
+        self.addCleanup(manager.stop)
+        return manager
+
+    def read_cache(self):
+        with open(self.cache_path, 'r') as file:
+            return json.loads(file.read())
+
+    def test_cached_account_is_used_silently(self):
+        with open(self.cache_path, 'w') as file:
+            file.write(create_cache('refresh-token-0'))
+        manager = self.create_manager()
+        self.assertEqual(manager.get_token(), 'cached-token')
+        self.assertEqual(manager.app.silent_calls, [False])
+        self.device_code_flow.assert_not_called()
+        # The token is kept in memory until it is about to expire
+        self.assertEqual(manager.get_token(), 'cached-token')
+        self.assertEqual(manager.app.silent_calls, [False])
+
+    def test_refreshed_cache_is_written_back(self):
+        with open(self.cache_path, 'w') as file:
+            file.write(create_cache('refresh-token-0'))
+        manager = self.create_manager()
+        manager.get_token()
+        manager._background_refresh()
+        self.assertEqual(manager.app.silent_calls, [False, True])
+        self.assertEqual(manager.get_token(), 'access-token-2')
+        self.assertEqual(self.read_cache()['RefreshToken']['refresh-token']['secret'], 'refresh-token-2')
+        self.assertEqual(stat.S_IMODE(os.stat(self.cache_path).st_mode), 0o600)
+        self.assertFalse(os.path.exists(self.cache_path + '.tmp'))
+        # The written cache is the one the next process starts from
+        self.assertEqual(self.create_manager().app.get_accounts(), manager.app.get_accounts())
+
+    def test_legacy_refresh_token_is_migrated(self):
+        with open(self.vcs_directory + LEGACY_TOKEN_FILE, 'w') as file:
+            file.write('legacy-refresh-token\n')
+        manager = self.create_manager()
+        self.assertEqual(manager.get_token(), 'access-token-1')
+        self.assertEqual(manager.app.refresh_token_calls, ['legacy-refresh-token'])
+        self.assertEqual(self.read_cache()['RefreshToken']['refresh-token']['secret'], 'migrated-refresh-token')
+        self.assertFalse(os.path.exists(self.vcs_directory + LEGACY_TOKEN_FILE))
+        self.device_code_flow.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,71 @@
+import json
+import os
+import sys
+import tempfile
+import threading
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import Tracing
+
+class TestTracing(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = os.path.join(self.directory.name, 'trace.jsonl')
+        self.tracer = Tracing.Tracer(self.path)
+        Tracing.set_tracer(self.tracer)
+        self.addCleanup(Tracing.set_tracer, None)
+
+    def read(self):
+        self.tracer.close()
+        with open(self.path, 'r') as file:
+            return [json.loads(line) for line in file]
+
+    def test_one_json_object_per_span(self):
+        with Tracing.span('cycle', 'cycle', targets=['Team']) as cycle:
+            with Tracing.span('POST /$batch', 'http'):
+                pass
+            Tracing.record_span('GET /me', 'sub_request', cycle.start, client_request_id='abc', status=200)
+
+        request, sub_request, recorded_cycle = self.read()
+        self.assertEqual(recorded_cycle['args'], {'targets': ['Team']})
+        self.assertIsNone(recorded_cycle['parent_id'])
+        self.assertEqual(request['parent_id'], recorded_cycle['span_id'])
+        self.assertEqual(sub_request['client_request_id'], 'abc')
+        self.assertEqual({request['trace_id'], sub_request['trace_id']}, {recorded_cycle['trace_id']})
+
+    def test_spans_of_bound_threads_are_nested(self):
+        with Tracing.span('cycle', 'cycle') as cycle:
+            with ThreadPoolExecutor(max_workers=4) as executor:
+                def chunk():
+                    with Tracing.span('chunk', 'chunk'):
+                        pass
+                for future in [executor.submit(Tracing.bind(chunk)) for _ in range(8)]:
+                    future.result()
+
+        chunks = [record for record in self.read() if record['name'] == 'chunk']
+        self.assertEqual(len(chunks), 8)
+        self.assertTrue(all(record['parent_id'] == cycle.span_id for record in chunks))
+
+    def test_convert_to_chrome(self):
+        with Tracing.span('cycle', 'cycle'):
+            thread = threading.Thread(target=Tracing.bind(lambda: Tracing.record_span('window', 'window', 0)), name='worker')
+            thread.start()
+            thread.join()
+        self.tracer.close()
+
+        output = os.path.join(self.directory.name, 'trace.json')
+        Tracing.convert_to_chrome(self.path, output)
+        with open(output, 'r') as file:
+            events = json.load(file)
+        self.assertEqual(sorted(event['args']['name'] for event in events if event['ph'] == 'M'), ['MainThread', 'worker'])
+        spans = {event['name']: event for event in events if event['ph'] == 'X'}
+        self.assertEqual(spans['window']['args']['parent_id'], spans['cycle']['args']['span_id'])
+        self.assertEqual(spans['window']['ts'], 0)
+
+if __name__ == '__main__':
+    unittest.main()
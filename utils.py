@@ -2,13 +2,18 @@ import json
 import yaml
 import os
 import os.path
-import requests
+from GraphClient import get_graph_client
 import ldap3
-from datetime import datetime
+from ldap3.utils.conv import escape_filter_chars
+from datetime import timedelta
 import logging
-import time
+import threading
 
 SUBJECT = "Vacation Calendar Sync Error Notification"
+LDAP_SERVER = "ldaps://ldap1.ncsa.illinois.edu"
+LDAP_SEARCH_BASE = 'dc=ncsa,dc=illinois,dc=edu'
+LDAP_FILTER_CHUNK = 100 # Number of uids in each OR filter
+LDAP_PAGE_SIZE = 500 # Number of entries per page of a paged search
 logger = logging.getLogger("__main__." + __name__)
 
 def init_device_code_flow(app, scopes):
@@ -29,47 +34,47 @@ def init_device_code_flow(app, scopes):
     return result
 
 
-def acquire_access_token(app, scopes):
+class Configuration:
+    """
+    The configurations of the yaml configuration file. The file is only parsed 
+    the first time the configurations are requested and whenever its modification time changes
+
+    Attributes
+    ----------
+    path : str
+        The path of the yaml configuration file
+    configs : dict
+        The configs parsed from the file
+    mtime : float
+        The modification time of the file when configs was parsed
     """
-    Acquire the access token using the MSAL library
 
-    Args:
-        app (PublicClientApplication object): the public client for the msal library
-        scope (list): a list consisting of the Azure permissions
-    
-    Returns:
-        str: the access token for the Microsoft Graph API
-    """
-    configs = get_configurations()
-    collection_path = configs['vcs_directory']
-    # Note access_token usually lasts for a little bit over an hour
-    result = None
-    accounts = app.get_accounts()
-    if accounts:
-        # If accounts exist, that means that it is an iteration, since system rebooting and first time running won't have acccount 
-        logger.debug("Tokens found in cache")
-        result = app.acquire_token_silent(scopes, accounts[0])
-    elif os.path.isfile(collection_path + 'token.txt'):
-        # if the token file exist, then read the refresh token and use it to acquire the access_token 
-        with open(collection_path + "token.txt", "r") as file:
-            logger.debug("Refresh token found")
-            refresh_token = file.readline()
-    
-        result = app.acquire_token_by_refresh_token(refresh_token, scopes)
-    
-    if not result or "error" in result:
-        result = init_device_code_flow(app, scopes)
-
-    if "access_token" in result:
-        with open(collection_path + "token.txt", "w") as file:
-            file.write(result["refresh_token"])
-            logger.debug("Writing new refresh token into token file")
-        return result["access_token"]
-    else:
-        logger.error(result.get("error"))
-        logger.error(result.get("error_description"))
-        logger.error(result.get("correlation_id"))
-        raise ConnectionError("Unable to retrieve access_token")
+    def __init__(self, path):
+        self.path = path
+        self.configs = None
+        self.mtime = None
+        self.lock = threading.Lock()
+
+    def get(self):
+        """
+        Retrieves the configs, reloading them if the file was modified since they were parsed
+
+        Returns:
+            dict: the configs as a dict
+        """
+
+        mtime = os.stat(self.path).st_mtime
+        with self.lock:
+            if self.configs is None or mtime != self.mtime:
+                with open(self.path, 'r') as file:
+                    configs = yaml.safe_load(file)
+                if self.configs is not None:
+                    logger.info(f"Reloaded the configurations from {self.path}")
+                self.configs = configs
+                self.mtime = mtime
+            return self.configs
+
+_configuration = None
 
 def get_configurations():
     """
@@ -79,10 +84,11 @@ def get_configurations():
         dict: the configs as a dict
     
     """
-    # Created ENV variable using docker's ENV command in Dockerfile
-    path = os.getenv('VCS_CONFIG')
-    with open(path, 'r') as file:
-        return yaml.safe_load(file)
+    global _configuration
+    if _configuration is None:
+        # Created ENV variable using docker's ENV command in Dockerfile
+        _configuration = Configuration(os.getenv('VCS_CONFIG'))
+    return _configuration.get()
         
 def send_email(message, access_token):
     config = get_configurations()
@@ -96,10 +102,9 @@ def send_email(message, access_token):
         access_token (str): the token used make calls to the Microsoft Graph API as part of the Oauth2 Authorization code flow
     """
 
-    endpoint = "https://graph.microsoft.com/v1.0/me/sendMail"
+    endpoint = "/me/sendMail"
 
     header = {
-        "Authorization": str(access_token),
         "Content-Type": "application/json"
     }
 
@@ -121,7 +126,7 @@ def send_email(message, access_token):
         },
         "saveToSentItems": "false"
     }
-    response = requests.post(endpoint, data=json.dumps(payload), headers=header)
+    response = get_graph_client().post(endpoint, access_token, data=json.dumps(payload), headers=header)
 
     if (response.status_code != 202):
         #logger.error(response.json())
@@ -130,41 +135,48 @@ def send_email(message, access_token):
 
     # TODO: consider a case if the status code isn't 202
             
-def get_email_list(group_name, update_interval):
-    configs = get_configurations()
-    path_to_email_list = configs['vcs_directory'] + 'email_list.txt'
-    
-    if os.path.isfile(path_to_email_list):
-        seconds_since_epoch = os.path.getctime(path_to_email_list)
-        modified_time = time.localtime(seconds_since_epoch)
-        modified_time = datetime(
-            year=modified_time.tm_year,
-            month=modified_time.tm_mon,
-            day=modified_time.tm_mday,
-            hour=modified_time.tm_hour,
-            minute=modified_time.tm_min,
-            second=modified_time.tm_sec,
-        )
-        if divmod((datetime.today()- modified_time).total_seconds(), 60)[0] < update_interval:
-            with open(path_to_email_list, 'r') as file:
-                email_list = []
-                line = file.readline()
-                while line:
-                    email = line.strip()
-                    email_list.append(email)
-                    line = file.readline()         
-            return email_list
-            
-    # if the file doesn't exist 
-    email_list = get_email_list_from_ldap(group_name)
-    with open(path_to_email_list, 'w') as file:
-        for email in email_list:
-            file.write(f"{email}\n")
-    
-    #print(f"Email list retrieved from LDAP: {current_email_list}")
-    return email_list
+def open_ldap_connection():
+    """
+    Opens an anonymous connection to the ldap server
+
+    Returns:
+        ldap3.Connection: the connection to the ldap server
+    """
+
+    ldap_user = None
+    ldap_password = None
+    return ldap3.Connection(LDAP_SERVER, ldap_user, ldap_password)
+
+def search_uids(conn, uids, attributes, modified_since=None):
+    """
+    Searches the entries of uids using a single OR filter per chunk of LDAP_FILTER_CHUNK uids
+    and a paged search, so a group is resolved in a few round trips
+
+    Args:
+        conn (ldap3.Connection): a bound connection to the ldap server
+        uids (list): the uids to search for
+        attributes (list): the attributes of the entries to retrieve
+        modified_since (str): if set, only the entries of uids modified at or after 
+        this generalized time (e.g. 20240101000000Z) are retrieved
+
+    Returns:
+        dict: uid to the attributes of its entry
+    """
+
+    entries = {}
+    for i in range(0, len(uids), LDAP_FILTER_CHUNK):
+        chunk = uids[i : i + LDAP_FILTER_CHUNK]
+        search_filter = "(|" + "".join(f"(uid={escape_filter_chars(uid)})" for uid in chunk) + ")"
+        if modified_since:
+            search_filter = f"(&(modifyTimestamp>={escape_filter_chars(modified_since)}){search_filter})"
+        results = conn.extend.standard.paged_search(LDAP_SEARCH_BASE, search_filter, ldap3.SUBTREE, attributes=attributes, paged_size=LDAP_PAGE_SIZE, generator=True)
+        for result in results:
+            if result.get('type') != 'searchResEntry': continue
+            uid = result['attributes']['uid']
+            uid = uid[0] if isinstance(uid, list) else uid
+            entries[uid] = result['attributes']
+    return entries
 
-    
 def get_email_list_from_ldap(group_name):
     """
     Retrieves the email list of the members in group_name using ldap server
@@ -175,49 +187,35 @@ def get_email_list_from_ldap(group_name):
     Returns:
         A list of emails from the specified group_name using ldap server
     """
-    ldap_server = "ldaps://ldap1.ncsa.illinois.edu"  # Replace with your LDAP server
-    
-    ldap_user = None
-    ldap_password = None
-
-    search_base = 'dc=ncsa,dc=illinois,dc=edu'
-    
-    search_scope = ldap3.SUBTREE
-    attributes = ldap3.ALL_ATTRIBUTES
 
-    group_list = [
-        group_name
-    ]
-
-    with ldap3.Connection(ldap_server, ldap_user, ldap_password) as conn:
+    with open_ldap_connection() as conn:
         if not conn.bind():
             raise Exception("Error: Could not bind to LDAP server")
-        else:
-            for group_name in group_list:
-                search_filter = f"(cn={group_name})"
-                #print("search_filter: " + search_filter)
-                result = conn.search(search_base, search_filter, search_scope, attributes=attributes)
-                if not result:
-                    raise KeyError(f"Error: Could not find group {group_name}")
-                else:
-                    members = [ m.split(',')[0].split('=')[1] for m in conn.entries[0].uniqueMember ]
-                
-            emails = []
-            for member in members:    
-                result = conn.search(search_base, f"(uid={member})", search_scope, attributes=attributes)
-                if not result:
-                    raise KeyError(f"Error: Could not find member with uid {member}")
-                else:
-                    emails.append(str(conn.entries[0].mail))
-
-            temp_emails = []
-            logger.debug(f"{len(emails)} emails were found")
-            for email in emails:
-                if '@illinois.edu' in email:
-                    temp_emails.append(email)
-                else:
-                    logger.warning(f"{email} is not a illinois affiliated email")
-            return temp_emails
+
+        search_filter = f"(cn={escape_filter_chars(group_name)})"
+        result = conn.search(LDAP_SEARCH_BASE, search_filter, ldap3.SUBTREE, attributes=['uniqueMember'])
+        if not result:
+            raise KeyError(f"Error: Could not find group {group_name}")
+        members = [ m.split(',')[0].split('=')[1] for m in conn.entries[0].uniqueMember ]
+
+        # Only the uid and mail of the members are retrieved, in one search per chunk of members
+        entries = search_uids(conn, members, ['uid', 'mail'])
+            
+        emails = []
+        for member in members:
+            if member not in entries:
+                raise KeyError(f"Error: Could not find member with uid {member}")
+            mail = entries[member].get('mail')
+            emails.append(str(mail[0] if isinstance(mail, list) and mail else mail))
+
+        temp_emails = []
+        logger.debug(f"{len(emails)} emails were found")
+        for email in emails:
+            if '@illinois.edu' in email:
+                temp_emails.append(email)
+            else:
+                logger.warning(f"{email} is not a illinois affiliated email")
+        return temp_emails
         
 def connection_error_handler(message, response, access_token):        
     send_email(message, access_token)
@@ -225,19 +223,27 @@ def connection_error_handler(message, response, access_token):
     raise ConnectionError(message)
 
 
-def subject_identifier(subject):
+def split_into_windows(start_date, end_date, window_size=14):
     """
-    Give value to OUT AM, OUT PM, and OUT. This creates a hierarchy/priority scheme 
-    that can used for filtering and comparison.
+    Splits the timeframe between start_date and end_date into windows of window_size days. 
+    The last window is shorter if the timeframe isn't a multiple of window_size days
 
-    subject (string): the name of the event in format: [netID] OUT [None/AM/PM]
+    Args:
+        start_date (datetime): the start of the timeframe
+        end_date (datetime): the end of the timeframe
+        window_size (int): the number of days in each window
     
     Returns:
-        0 for OUT AM and OUT PM events 
-        1 for OUT events
+        list: a list of (start_date, end_date) tuples of datetimes
     """
 
-    if "AM" in subject or "PM" in subject:
-        return 0
-    else: 
-        return 1
+    windows = []
+    current_date = start_date
+    while (current_date + timedelta(window_size) <= end_date):
+        temp_end_date = current_date + timedelta(window_size)
+        windows.append((current_date, temp_end_date))
+        current_date = temp_end_date
+
+    if (current_date < end_date):
+        windows.append((current_date, end_date))
+    return windows